@@ -8,12 +8,26 @@ from typing import Dict, List, Any, Optional
 # from typing_extensions import Never
 import asyncio
 import json
+import time
+from datetime import datetime
 from .code_analysis_agent import CodeAnalysisAgent
 from .legacy_mapping_agent import LegacyMappingAgent
 from .validation_agent import ValidationAgent
 from .document_generation_agent import DocumentGenerationAgent
 from services.llm_service import LLMService
-from models.database import db, MappingResult
+from services.deadline import deadline_scope, current_deadline, deadline_expired
+from services.content_store import git_blob_sha
+from models.database import db, MappingResult, AgentExecutionLog
+
+
+# Share of the remaining workflow deadline given to each stage, in run order.
+# A stage that finishes early leaves its unused time to the stages after it.
+STAGE_BUDGET_SHARES = {
+    'code_analysis': 0.35,
+    'legacy_mapping': 0.25,
+    'validation': 0.2,
+    'document_generation': 0.2
+}
 
 
 class MappingWorkflowOrchestrator:
@@ -27,8 +41,15 @@ class MappingWorkflowOrchestrator:
     4. DocumentGenerationAgent - Generates final standardized document
     """
     
-    def __init__(self, llm_service):
+    def __init__(self, llm_service, compact_output: bool = False, gitlab_service=None, content_store=None):
         self.llm_service = llm_service
+        # Shared GitLab client (e.g. one recording or replaying a cassette)
+        self.gitlab_service = gitlab_service
+        # Optional ContentStore: stage results are reused for notebooks whose
+        # blob SHA has been analyzed before
+        self.content_store = content_store
+        # Ask agents for the compact positional response contract (fewer output tokens)
+        self.compact_output = compact_output
         self._setup_agents()
     
     def _setup_agents(self):
@@ -38,12 +59,21 @@ class MappingWorkflowOrchestrator:
         from .validation_agent import ValidationAgent
         from .document_generation_agent import DocumentGenerationAgent
         
-        self.code_analysis_agent = CodeAnalysisAgent(self.llm_service)
-        self.legacy_mapping_agent = LegacyMappingAgent(self.llm_service)
-        self.validation_agent = ValidationAgent(self.llm_service)
-        self.document_generation_agent = DocumentGenerationAgent(self.llm_service)
+        self.code_analysis_agent = CodeAnalysisAgent(
+            self.llm_service, compact_output=self.compact_output, gitlab_service=self.gitlab_service
+        )
+        self.legacy_mapping_agent = LegacyMappingAgent(self.llm_service, compact_output=self.compact_output)
+        self.validation_agent = ValidationAgent(self.llm_service, compact_output=self.compact_output)
+        self.document_generation_agent = DocumentGenerationAgent(self.llm_service, compact_output=self.compact_output)
     
-    async def execute_mapping_workflow(self, notebook_path: str, gitlab_credentials: Optional[Dict], session_id: int) -> Dict[str, Any]:
+    async def execute_mapping_workflow(
+        self,
+        notebook_path: str,
+        gitlab_credentials: Optional[Dict],
+        session_id: int,
+        deadline_seconds: Optional[float] = None,
+        notebook_content: Optional[str] = None
+    ) -> Dict[str, Any]:
         """
         Execute the complete mapping generation workflow
         
@@ -51,10 +81,25 @@ class MappingWorkflowOrchestrator:
             notebook_path: Path to the Databricks notebook
             gitlab_credentials: GitLab auth credentials
             session_id: Database session ID for tracking
+            deadline_seconds: Overall time budget. Each stage gets a share of
+                what is left; LLM and GitLab call timeouts are capped by it, and
+                stages fall back to deterministic processing once it runs out
+            notebook_content: Notebook text when the caller already has it
+                (e.g. from a bulk archive fetch); it is then not fetched again
         
         Returns:
             Dict with success status and generated mapping data
         """
+        with deadline_scope(deadline_seconds):
+            return await self._execute_mapping_workflow(notebook_path, gitlab_credentials, session_id, notebook_content)
+    
+    async def _execute_mapping_workflow(
+        self,
+        notebook_path: str,
+        gitlab_credentials: Optional[Dict],
+        session_id: int,
+        notebook_content: Optional[str] = None
+    ) -> Dict[str, Any]:
         try:
             # Prepare initial input
             initial_input = {
@@ -64,38 +109,84 @@ class MappingWorkflowOrchestrator:
                 'timestamp': asyncio.get_event_loop().time()
             }
             
+            # Start scaling up idle serving endpoints while the notebook is
+            # fetched and parsed, before the first stage reaches the LLM
+            self.llm_service.warm_up()
+            
+            # Check LLM endpoint health up front; agents fall back to
+            # deterministic extraction for endpoints whose breaker is open
+            endpoint_health = self.llm_service.get_endpoint_health()
+            for model, health in endpoint_health.items():
+                if not health['available']:
+                    print(f"LLM endpoint '{model}' unavailable (circuit open, retry in {health['retry_in_seconds']}s)")
+            
+            # Identify the notebook by blob SHA; an unchanged notebook reuses
+            # the stored session result without running any agent
+            if notebook_content is not None:
+                blob_sha = git_blob_sha(notebook_content) if self.content_store is not None else None
+            else:
+                notebook_content, blob_sha = await self._resolve_notebook(notebook_path, gitlab_credentials)
+            if blob_sha is not None:
+                stored_document = self.content_store.get_artifact(blob_sha, 'session_result')
+                if stored_document is not None:
+                    print(f"Notebook unchanged (blob {blob_sha[:12]}), reusing the stored analysis")
+                    final_results = await self._run_agent(
+                        'document_generation', session_id,
+                        {'blob_sha': blob_sha},
+                        lambda: self.document_generation_agent.reuse_document(stored_document, session_id)
+                    )
+                    return self._workflow_result(session_id, final_results, endpoint_health, blob_sha, reused=True)
+            
             # Run agents sequentially (simplified approach for demo)
             print("Starting Code Analysis Agent...")
-            code_results = await self.code_analysis_agent.analyze_notebook(
-                notebook_path=notebook_path,
-                gitlab_credentials=gitlab_credentials
+            code_results = await self._run_stored_agent(
+                'code_analysis', session_id, blob_sha, notebook_path,
+                lambda: self.code_analysis_agent.analyze_notebook(
+                    notebook_path=notebook_path,
+                    gitlab_credentials=gitlab_credentials,
+                    notebook_content=notebook_content
+                )
             )
             
             print("Starting Legacy Mapping Agent...")  
-            legacy_results = await self.legacy_mapping_agent.extract_mappings(
-                notebook_path=notebook_path
+            legacy_results = await self._run_stored_agent(
+                'legacy_mapping', session_id, blob_sha, notebook_path,
+                lambda: self.legacy_mapping_agent.extract_mappings(
+                    notebook_path=notebook_path,
+                    notebook_content=notebook_content
+                )
             )
             
             print("Starting Validation Agent...")
-            validation_results = await self.validation_agent.validate_and_correct(
-                code_analysis_results=code_results,
-                legacy_mapping_results=legacy_results,
-                session_id=session_id
+            validation_results = await self._run_agent(
+                'validation', session_id,
+                {'code_analysis': code_results, 'legacy_mapping': legacy_results},
+                lambda: self.validation_agent.validate_and_correct(
+                    code_analysis_results=code_results,
+                    legacy_mapping_results=legacy_results,
+                    session_id=session_id
+                )
             )
             
             print("Starting Document Generation Agent...")
-            final_results = await self.document_generation_agent.generate_document(
-                validated_mappings=validation_results,
-                session_id=session_id
+            final_results = await self._run_agent(
+                'document_generation', session_id,
+                validation_results,
+                lambda: self.document_generation_agent.generate_document(
+                    validated_mappings=validation_results,
+                    session_id=session_id
+                )
             )
             
-            return {
-                'success': True,
-                'session_id': session_id,
-                'mappings_generated': len(final_results.get('mappings', [])),
-                'confidence_summary': final_results.get('confidence_summary', {}),
-                'review_required_count': final_results.get('review_required_count', 0)
-            }
+            stage_results = (code_results, legacy_results, validation_results, final_results)
+            if blob_sha is not None and self._storable(*stage_results):
+                self.content_store.put_artifact(blob_sha, 'session_result', {
+                    'mappings': final_results.get('mappings', []),
+                    'confidence_summary': final_results.get('confidence_summary', {}),
+                    'review_required_count': final_results.get('review_required_count', 0)
+                })
+            
+            return self._workflow_result(session_id, final_results, endpoint_health, blob_sha)
             
         except Exception as e:
             print(f"Workflow execution failed: {str(e)}")
@@ -106,6 +197,194 @@ class MappingWorkflowOrchestrator:
             }
 
 
+    def _workflow_result(
+        self,
+        session_id: int,
+        final_results: Dict[str, Any],
+        endpoint_health: Dict[str, Any],
+        blob_sha: Optional[str],
+        reused: bool = False
+    ) -> Dict[str, Any]:
+        result = {
+            'success': True,
+            'session_id': session_id,
+            'mappings_generated': len(final_results.get('mappings', [])),
+            'confidence_summary': final_results.get('confidence_summary', {}),
+            'review_required_count': final_results.get('review_required_count', 0),
+            'llm_endpoint_health': endpoint_health
+        }
+        
+        if blob_sha is not None:
+            result['blob_sha'] = blob_sha
+            result['reused_stored_analysis'] = reused
+        
+        deadline = current_deadline()
+        if deadline is not None:
+            result['deadline'] = {
+                'budget_seconds': deadline.budget_seconds,
+                'remaining_seconds': round(deadline.remaining(), 3),
+                'expired': deadline.expired
+            }
+        
+        return result
+    
+    async def _resolve_notebook(self, notebook_path: str, gitlab_credentials: Optional[Dict]):
+        """
+        Fetch the notebook once and compute its blob SHA (content store only)
+        
+        Returns:
+            (content, blob_sha), or (None, None) without a content store or if
+            the fetch fails (the code analysis stage then reports the error)
+        """
+        if self.content_store is None:
+            return None, None
+        
+        try:
+            content = await self.code_analysis_agent.gitlab_service.fetch_notebook_content(
+                notebook_path, gitlab_credentials
+            )
+        except Exception as e:
+            print(f"Could not fetch notebook for the content store: {str(e)}")
+            return None, None
+        
+        return content, git_blob_sha(content)
+    
+    def _storable(self, *results: Dict[str, Any]) -> bool:
+        """
+        Only complete results are kept for reuse: stages that ran out of time
+        or had an LLM endpoint down produced fallbacks, which must not stick
+        """
+        endpoints_up = all(health['available'] for health in self.llm_service.get_endpoint_health().values())
+        return (
+            endpoints_up
+            and not deadline_expired()
+            and all(result.get('status') == 'success' for result in results)
+        )
+    
+    async def _run_stored_agent(
+        self,
+        agent_name: str,
+        session_id: int,
+        blob_sha: Optional[str],
+        notebook_path: str,
+        run
+    ) -> Dict[str, Any]:
+        """
+        Run one stage, or reuse its result stored for the same notebook blob
+        
+        A reused result is relabeled with this run's notebook_path (the blob
+        may have been analyzed under another path or branch) and still gets
+        its AgentExecutionLog row, with no LLM usage.
+        """
+        input_data = {'notebook_path': notebook_path}
+        
+        if blob_sha is not None:
+            stored = self.content_store.get_artifact(blob_sha, agent_name)
+            if stored is not None:
+                print(f"{agent_name}: reusing the stored result for blob {blob_sha[:12]}")
+                
+                async def reuse():
+                    return {**stored, 'notebook_path': notebook_path, 'reused': True}
+                
+                return await self._run_agent(agent_name, session_id, {**input_data, 'blob_sha': blob_sha}, reuse)
+        
+        result = await self._run_agent(agent_name, session_id, input_data, run)
+        
+        if blob_sha is not None and self._storable(result):
+            self.content_store.put_artifact(blob_sha, agent_name, result)
+        
+        return result
+    
+    async def _run_agent(self, agent_name: str, session_id: int, input_data: Any, run) -> Dict[str, Any]:
+        """
+        Run one agent stage with its LLM calls attributed to it, then persist
+        an AgentExecutionLog row with timing, data sizes and token/cost usage
+        """
+        start_time = datetime.utcnow()
+        started = time.perf_counter()
+        result = None
+        error = None
+        
+        with self.llm_service.usage_scope(agent_name, session_id) as usage, deadline_scope(self._stage_budget(agent_name)):
+            try:
+                result = await run()
+                return result
+            except Exception as e:
+                error = str(e)
+                raise
+            finally:
+                self._record_agent_execution(
+                    agent_name=agent_name,
+                    session_id=session_id,
+                    start_time=start_time,
+                    processing_time=time.perf_counter() - started,
+                    input_data=input_data,
+                    result=result,
+                    error=error,
+                    usage=usage
+                )
+    
+    def _stage_budget(self, agent_name: str) -> Optional[float]:
+        """Seconds of the workflow deadline available to this stage (None without a deadline)"""
+        deadline = current_deadline()
+        if deadline is None or agent_name not in STAGE_BUDGET_SHARES:
+            return None
+        
+        stages = list(STAGE_BUDGET_SHARES)
+        later_shares = sum(STAGE_BUDGET_SHARES[stage] for stage in stages[stages.index(agent_name):])
+        return deadline.remaining() * STAGE_BUDGET_SHARES[agent_name] / later_shares
+    
+    def _record_agent_execution(
+        self,
+        agent_name: str,
+        session_id: int,
+        start_time: datetime,
+        processing_time: float,
+        input_data: Any,
+        result: Optional[Dict[str, Any]],
+        error: Optional[str],
+        usage
+    ):
+        """Persist one AgentExecutionLog row; failures are logged, never raised"""
+        result = result or {}
+        mappings = (
+            result.get('transformations')
+            or result.get('validated_mappings')
+            or result.get('mappings')
+            or []
+        )
+        confidence_scores = [m.get('confidence_score') for m in mappings if isinstance(m, dict)]
+        
+        print(f"{agent_name}: {processing_time:.2f}s, {usage.calls} LLM calls "
+              f"({usage.cached_calls} cached), {usage.total_tokens} tokens, ~${usage.cost_estimate:.4f}")
+        
+        try:
+            log = AgentExecutionLog(
+                session_id=session_id,
+                agent_name=agent_name,
+                start_time=start_time,
+                end_time=datetime.utcnow(),
+                status='error' if error or result.get('status') == 'error' else 'success',
+                error_message=error or result.get('error'),
+                input_data_size=len(json.dumps(input_data, default=str)),
+                output_data_size=len(json.dumps(result, default=str)),
+                processing_time_seconds=processing_time,
+                llm_model_used=usage.primary_model,
+                llm_tokens_used=usage.total_tokens,
+                llm_cost_estimate=usage.cost_estimate,
+                confidence_scores=json.dumps(confidence_scores),
+                review_flags_count=sum(1 for m in mappings if isinstance(m, dict) and m.get('needs_review'))
+            )
+            db.session.add(log)
+            db.session.commit()
+        except Exception as e:
+            print(f"Failed to record agent execution log: {str(e)}")
+            try:
+                db.session.rollback()
+            except Exception:
+                pass
+
+
 # Simplified agent executor classes for demo
 class BaseExecutor:
     """Base class for simplified agent executors"""
@@ -147,13 +426,24 @@ class AgentOrchestrator:
     Main orchestrator class - simplified interface for the Flask app
     """
     
-    def __init__(self, llm_service: LLMService):
-        self.workflow_orchestrator = MappingWorkflowOrchestrator(llm_service)
+    def __init__(self, llm_service: LLMService, compact_output: bool = False, gitlab_service=None, content_store=None):
+        self.workflow_orchestrator = MappingWorkflowOrchestrator(
+            llm_service, compact_output=compact_output, gitlab_service=gitlab_service, content_store=content_store
+        )
     
-    async def execute_mapping_workflow(self, notebook_path: str, gitlab_credentials: Optional[Dict], session_id: int) -> Dict[str, Any]:
-        """Execute the complete mapping workflow"""
+    async def execute_mapping_workflow(
+        self,
+        notebook_path: str,
+        gitlab_credentials: Optional[Dict],
+        session_id: int,
+        deadline_seconds: Optional[float] = None,
+        notebook_content: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Execute the complete mapping workflow within an optional overall deadline"""
         return await self.workflow_orchestrator.execute_mapping_workflow(
             notebook_path=notebook_path,
             gitlab_credentials=gitlab_credentials,
-            session_id=session_id
+            session_id=session_id,
+            deadline_seconds=deadline_seconds,
+            notebook_content=notebook_content
         )
\ No newline at end of file
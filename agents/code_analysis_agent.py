@@ -4,6 +4,38 @@ import asyncio
 from typing import Dict, List, Any, Optional
 from services.gitlab_service import GitLabService
 from services.llm_service import LLMService
+from services.json_stream import IncrementalJSONParser
+from services.notebook_chunker import NotebookChunker, NotebookChunk, merge_chunk_mappings
+from services.prompt_encoding import PromptEncoder, TABLE_FORMAT_NOTE
+from services.compact_schema import CompactSchema
+from services.deadline import deadline_expired
+
+
+# Verbose response contract (the default)
+MAPPINGS_OUTPUT_FORMAT = """REQUIRED OUTPUT FORMAT:
+        {
+            "mappings": [
+                {
+                    "source_table": "table_name",
+                    "source_column": "column_name", 
+                    "transformation_rule": "actual PySpark/SQL transformation code",
+                    "target_field": "target_column_name",
+                    "array_field": "array_field_if_applicable",
+                    "confidence_score": 0.95,
+                    "needs_review": false,
+                    "reasoning": "explanation of the transformation",
+                    "code_location": "line or section where found"
+                }
+            ],
+            "summary": {
+                "total_transformations": 10,
+                "high_confidence_count": 8,
+                "needs_review_count": 2
+            }
+        }"""
+
+# Opt-in compact positional contract, see services/compact_schema.py
+COMPACT_SCHEMA = CompactSchema({'m': 'mappings'}, note_field='reasoning')
 
 
 class CodeAnalysisAgent:
@@ -12,9 +44,17 @@ class CodeAnalysisAgent:
     and extracting data transformation mappings using Claude LLM
     """
     
-    def __init__(self, llm_service: LLMService):
+    def __init__(
+        self,
+        llm_service: LLMService,
+        chunker: Optional[NotebookChunker] = None,
+        compact_output: bool = False,
+        gitlab_service: Optional[GitLabService] = None
+    ):
         self.llm_service = llm_service
-        self.gitlab_service = GitLabService()
+        self.gitlab_service = gitlab_service or GitLabService()
+        self.chunker = chunker or NotebookChunker()
+        self.compact_output = compact_output
         
         # Patterns for different types of transformations
         self.transformation_patterns = {
@@ -28,22 +68,29 @@ class CodeAnalysisAgent:
             'sql_case': r'CASE\s+WHEN\s+(.*?)\s+THEN\s+(.*?)\s+END',
         }
     
-    async def analyze_notebook(self, notebook_path: str, gitlab_credentials: Optional[Dict] = None) -> Dict[str, Any]:
+    async def analyze_notebook(
+        self,
+        notebook_path: str,
+        gitlab_credentials: Optional[Dict] = None,
+        notebook_content: Optional[str] = None
+    ) -> Dict[str, Any]:
         """
         Main method to analyze a notebook and extract transformations
         
         Args:
             notebook_path: Path to the Databricks notebook
             gitlab_credentials: GitLab authentication credentials
+            notebook_content: Notebook text if already fetched
             
         Returns:
             Dict containing extracted transformations and metadata
         """
         try:
             # Fetch notebook content from GitLab
-            notebook_content = await self.gitlab_service.fetch_notebook_content(
-                notebook_path, gitlab_credentials
-            )
+            if notebook_content is None:
+                notebook_content = await self.gitlab_service.fetch_notebook_content(
+                    notebook_path, gitlab_credentials
+                )
             
             # Parse the notebook content
             parsed_code = self._parse_notebook_content(notebook_content)
@@ -215,65 +262,116 @@ class CodeAnalysisAgent:
         pattern_transformations: List[Dict[str, Any]]
     ) -> List[Dict[str, Any]]:
         """
-        Use Claude LLM to enhance and validate extracted transformations
+        Use Claude LLM to enhance and validate extracted transformations.
+        
+        The notebook is split into cell-aligned chunks that are analyzed
+        concurrently; the partial mapping lists are merged in notebook order.
+        """
+        if deadline_expired():
+            print("Workflow deadline reached: using extracted transformations without LLM enhancement")
+            return self._fallback_format_transformations(ast_transformations, pattern_transformations)
+        
+        chunks = self.chunker.chunk(notebook_content)
+        if not chunks:
+            return self._fallback_format_transformations(ast_transformations, pattern_transformations)
+        
+        print(f"Analyzing notebook in {len(chunks)} chunk(s) of up to ~{self.chunker.max_chunk_tokens} tokens")
+        
+        # Chunks are analyzed concurrently; one limiter keeps at most
+        # batch_concurrency requests in flight, split halves included
+        limiter = self.llm_service.batch_limiter()
+        partial_results = await asyncio.gather(*[
+            self._enhance_chunk_with_llm(chunk, len(chunks), limiter) for chunk in chunks
+        ])
+        
+        return merge_chunk_mappings(partial_results)
+    
+    async def _enhance_chunk_with_llm(
+        self,
+        chunk: NotebookChunk,
+        total_chunks: int,
+        limiter: asyncio.Semaphore
+    ) -> List[Dict[str, Any]]:
+        """
+        Analyze one notebook chunk; falls back to the chunk's raw transformations on failure
+        
+        The limiter is held only while the request streams, and the halves
+        of a split chunk share it with the rest of the notebook.
         """
+        parsed_chunk = self._parse_notebook_content(chunk.text)
+        ast_transformations = self._extract_ast_transformations(parsed_chunk)
+        pattern_transformations = self._extract_pattern_transformations(parsed_chunk)
+        
+        encoder = PromptEncoder()
+        ast_table = encoder.table(ast_transformations, baseline='repr')
+        pattern_table = encoder.table(pattern_transformations, baseline='repr')
+        output_format = COMPACT_SCHEMA.output_format() if self.compact_output else MAPPINGS_OUTPUT_FORMAT
         
         prompt = f"""
         As an expert in PySpark and SQL data transformations, analyze the following Databricks notebook code and provide enhanced mapping information.
 
-        NOTEBOOK CONTENT:
-        {notebook_content[:8000]}  # Limit content to avoid token limits
+        NOTEBOOK SECTION {chunk.index + 1} OF {total_chunks} (cells {chunk.cell_start}-{chunk.cell_end}):
+        {chunk.text}
+
+        DATAFRAME TO SOURCE TABLE BINDINGS (defined elsewhere in the notebook):
+        {chunk.context_text()}
+
+        {TABLE_FORMAT_NOTE}
 
         EXTRACTED AST TRANSFORMATIONS:
-        {ast_transformations}
+        {ast_table}
 
         EXTRACTED PATTERN TRANSFORMATIONS:
-        {pattern_transformations}
+        {pattern_table}
 
         TASK:
-        1. Analyze all the transformations in the code
+        1. Analyze all the transformations in this section of the code
         2. Identify source tables, source columns, transformation logic, and target fields
         3. Provide a standardized mapping format for each transformation
         4. Include confidence scores (0.0-1.0) for each mapping
         5. Flag any transformations that need human review
 
-        REQUIRED OUTPUT FORMAT:
-        {{
-            "mappings": [
-                {{
-                    "source_table": "table_name",
-                    "source_column": "column_name", 
-                    "transformation_rule": "actual PySpark/SQL transformation code",
-                    "target_field": "target_column_name",
-                    "array_field": "array_field_if_applicable",
-                    "confidence_score": 0.95,
-                    "needs_review": false,
-                    "reasoning": "explanation of the transformation",
-                    "code_location": "line or section where found"
-                }}
-            ],
-            "summary": {{
-                "total_transformations": 10,
-                "high_confidence_count": 8,
-                "needs_review_count": 2
-            }}
-        }}
+        {output_format}
 
         Focus on accuracy and provide detailed transformation rules that match the standard mapping document format.
         """
+        encoder.report(f"Code analysis chunk {chunk.index + 1}/{total_chunks}", prompt)
 
         try:
-            response = await self.llm_service.call_claude(prompt)
+            # Stream the response and collect each mapping as soon as it is complete
+            parser = IncrementalJSONParser(COMPACT_SCHEMA.parser_keys if self.compact_output else ['mappings'])
+            mappings = []
+            
+            # Scored on the transformations extracted from the chunk, like the other agents' rules
+            model = self.llm_service.route_model(
+                'code_analysis', prompt,
+                rules=[trans.get('transformation') for trans in ast_transformations + pattern_transformations]
+            )
+            max_tokens = self.llm_service.max_tokens_for(
+                model, len(ast_transformations) + len(pattern_transformations), compact=self.compact_output
+            )
+            
+            # Split the chunk instead of sending a prompt the model cannot take
+            if not self.llm_service.prompt_budget(model, prompt, max_tokens=max_tokens)['fits']:
+                halves = self.chunker.split_chunk(chunk)
+                if len(halves) > 1:
+                    print(f"Chunk {chunk.index + 1}/{total_chunks} does not fit the {model} context window, splitting it")
+                    partial_results = await asyncio.gather(*[
+                        self._enhance_chunk_with_llm(half, total_chunks, limiter) for half in halves
+                    ])
+                    return merge_chunk_mappings(partial_results)
             
-            # Parse LLM response
-            import json
-            enhanced_data = json.loads(response)
+            async with limiter:
+                async for key, mapping in self.llm_service.stream_json_items(model, prompt, parser, max_tokens=max_tokens):
+                    if self.compact_output:
+                        key, mapping = COMPACT_SCHEMA.decode_item(key, mapping)
+                    mappings.append(mapping)
             
-            return enhanced_data.get('mappings', [])
+            return mappings
             
         except Exception as e:
-            print(f"LLM enhancement failed: {str(e)}")
-            # Fall back to combined raw transformations
+            print(f"LLM enhancement failed for chunk {chunk.index + 1}/{total_chunks}: {str(e)}")
+            # Fall back to this chunk's raw transformations
             return self._fallback_format_transformations(ast_transformations, pattern_transformations)
     
     def _fallback_format_transformations(
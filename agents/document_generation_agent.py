@@ -1,9 +1,39 @@
 import asyncio
 from typing import Dict, List, Any
 from services.llm_service import LLMService
+from services.json_stream import IncrementalJSONParser
+from services.prompt_encoding import PromptEncoder, TABLE_FORMAT_NOTE
+from services.compact_schema import CompactSchema
+from services.deadline import deadline_expired
+from services.rule_cache import merge_by_index
 from models.database import db, MappingResult
 from datetime import datetime
-import json
+
+
+# Verbose response contract (the default)
+STANDARDIZED_OUTPUT_FORMAT = """REQUIRED OUTPUT FORMAT:
+        {
+            "standardized_mappings": [
+                {
+                    "source_table": "table_name",
+                    "source_column": "column_name or complex_expression",
+                    "transformation_rule": "properly formatted PySpark/SQL code",
+                    "target_field": "target_column_name",
+                    "array_field": "array_field_if_applicable or empty",
+                    "confidence_score": 0.95,
+                    "needs_review": false,
+                    "final_notes": "any important notes for the user"
+                }
+            ],
+            "standardization_summary": {
+                "rules_cleaned": 5,
+                "syntax_corrections": 3,
+                "formatting_applied": true
+            }
+        }"""
+
+# Opt-in compact positional contract, see services/compact_schema.py
+COMPACT_SCHEMA = CompactSchema({'s': 'standardized_mappings'}, note_field='final_notes')
 
 
 class DocumentGenerationAgent:
@@ -12,8 +42,9 @@ class DocumentGenerationAgent:
     and storing results in the database with proper formatting
     """
     
-    def __init__(self, llm_service: LLMService):
+    def __init__(self, llm_service: LLMService, compact_output: bool = False):
         self.llm_service = llm_service
+        self.compact_output = compact_output
     
     async def generate_document(
         self, 
@@ -62,10 +93,39 @@ class DocumentGenerationAgent:
                 'session_id': session_id
             }
     
+    async def reuse_document(self, stored_document: Dict[str, Any], session_id: int) -> Dict[str, Any]:
+        """
+        Store a previously generated document for a new session without any LLM call
+        
+        Args:
+            stored_document: Mappings and summary of an earlier session on the same notebook blob
+            session_id: Database session ID
+            
+        Returns:
+            Dict shaped like generate_document's result
+        """
+        mappings = stored_document.get('mappings', [])
+        storage_results = await self._store_mappings_in_database(mappings, session_id)
+        
+        return {
+            'agent': 'document_generation',
+            'status': 'success',
+            'session_id': session_id,
+            'mappings': mappings,
+            'storage_results': storage_results,
+            'confidence_summary': stored_document.get('confidence_summary', {}),
+            'review_required_count': stored_document.get('review_required_count', 0),
+            'total_mappings': len(mappings),
+            'reused': True
+        }
+    
     async def _standardize_mappings_with_claude(self, mappings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
         Use Claude to standardize the final mapping format according to the template
         """
+        if deadline_expired():
+            print("Workflow deadline reached: standardizing with fallback rules")
+            return self._fallback_standardization(mappings)
         
         # Load the sample mapping format from the existing CSV
         sample_format = """
@@ -76,11 +136,30 @@ class DocumentGenerationAgent:
         provider_drname,"drsal, dr_fname, dr_iname, dr_lname, drsuffix","trim(concat(coalesce(drsal,"" ""),coalesce(dr_fname,"" ""),coalesce(dr_iname,"" ""),coalesce(dr_lname,"" ""),coalesce(drsuffix,"" ""))",alternate_name_name,
         """
         
+        batch = mappings[:20]  # Limit to prevent token overflow
+        
+        # Mappings whose rule repeats an idiom that was already standardized
+        rule_cache = self.llm_service.rule_cache
+        if rule_cache is not None:
+            cached_mappings, pending_indices = rule_cache.lookup_many('document_generation', batch, self._rule_of)
+        else:
+            cached_mappings, pending_indices = {}, list(range(len(batch)))
+        if not pending_indices:
+            print(f"Document generation: all {len(batch)} mappings standardized from the rule cache")
+            return [cached_mappings[index] for index in sorted(cached_mappings)]
+        pending = [batch[index] for index in pending_indices]
+        
+        encoder = PromptEncoder()
+        mappings_table = encoder.table(pending)
+        output_format = COMPACT_SCHEMA.output_format() if self.compact_output else STANDARDIZED_OUTPUT_FORMAT
+        
         prompt = f"""
         As an expert in data mapping standardization, format these validated mappings into the final standardized mapping document format.
 
+        {TABLE_FORMAT_NOTE}
+
         VALIDATED MAPPINGS:
-        {json.dumps(mappings[:20], indent=2)}  # Limit to prevent token overflow
+        {mappings_table}
 
         REQUIRED STANDARD FORMAT (based on existing template):
         {sample_format}
@@ -101,42 +180,47 @@ class DocumentGenerationAgent:
         - For literals: lit("value")
         - For column references: col("column_name") or just column_name
 
-        REQUIRED OUTPUT FORMAT:
-        {{
-            "standardized_mappings": [
-                {{
-                    "source_table": "table_name",
-                    "source_column": "column_name or complex_expression",
-                    "transformation_rule": "properly formatted PySpark/SQL code",
-                    "target_field": "target_column_name",
-                    "array_field": "array_field_if_applicable or empty",
-                    "confidence_score": 0.95,
-                    "needs_review": false,
-                    "final_notes": "any important notes for the user"
-                }}
-            ],
-            "standardization_summary": {{
-                "rules_cleaned": 5,
-                "syntax_corrections": 3,
-                "formatting_applied": true
-            }}
-        }}
+        {output_format}
 
         Focus on creating clean, readable, and consistent transformation rules that match the standard format.
         """
+        encoder.report("Document generation", prompt)
 
         try:
-            response = await self.llm_service.call_claude(prompt)
+            # Stream Claude's response and collect each standardized mapping as it completes
+            parser = IncrementalJSONParser(COMPACT_SCHEMA.parser_keys if self.compact_output else ['standardized_mappings'])
+            standardized_mappings = []
+            
+            model = self.llm_service.route_model(
+                'generation', prompt, rules=[mapping.get('transformation_rule') for mapping in pending]
+            )
+            max_tokens = self.llm_service.max_tokens_for(model, len(pending), compact=self.compact_output)
+            
+            async for key, mapping in self.llm_service.stream_json_items(model, prompt, parser, max_tokens=max_tokens):
+                if self.compact_output:
+                    key, mapping = COMPACT_SCHEMA.decode_item(key, mapping)
+                standardized_mappings.append(mapping)
             
-            # Parse Claude response
-            standardized_data = json.loads(response)
-            return standardized_data.get('standardized_mappings', mappings)
+            if not parser.seen_keys & {'standardized_mappings', 's'}:
+                return mappings
+            
+            if rule_cache is None:
+                return standardized_mappings
+            
+            # Store the new verdicts and put the results back in input order
+            pairing = rule_cache.store_many('document_generation', pending, standardized_mappings, self._rule_of)
+            return merge_by_index(cached_mappings, pending_indices, standardized_mappings, pairing)
             
         except Exception as e:
             print(f"Claude standardization failed: {str(e)}")
             # Return original mappings with basic cleanup
             return self._fallback_standardization(mappings)
     
+    @staticmethod
+    def _rule_of(mapping: Dict[str, Any]) -> List[str]:
+        """Rules a standardization verdict depends on"""
+        return [mapping.get('transformation_rule', '')]
+    
     def _fallback_standardization(self, mappings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
         Fallback standardization when Claude fails
@@ -1,47 +1,86 @@
 import asyncio
+import re
 import subprocess
 import tempfile
 import os
 # import pandas as pd  # Commented out for demo
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from services.llm_service import LLMService
+from services.json_stream import IncrementalJSONParser
+from services.notebook_chunker import NotebookChunker, NotebookChunk, merge_chunk_mappings
+from services.prompt_encoding import PromptEncoder, TABLE_FORMAT_NOTE
+from services.compact_schema import CompactSchema
+from services.deadline import deadline_expired
 from DocumentExtractorV5 import MappingExtractor  # Import the existing extractor
 
 
+# Verbose response contract (the default)
+CORRECTIONS_OUTPUT_FORMAT = """REQUIRED OUTPUT FORMAT:
+        {
+            "corrected_mappings": [
+                {
+                    "source_table": "corrected_table_name",
+                    "source_column": "corrected_column_name",
+                    "transformation_rule": "corrected_transformation_code",
+                    "target_field": "target_column_name",
+                    "array_field": "array_field_if_applicable",
+                    "confidence_score": 0.85,
+                    "needs_review": false,
+                    "reasoning": "explanation of corrections made",
+                    "changes_made": ["list", "of", "corrections"]
+                }
+            ],
+            "additional_mappings": [
+                // Any mappings missed by legacy tool
+            ],
+            "summary": {
+                "corrections_made": 5,
+                "mappings_added": 2,
+                "high_confidence_count": 8
+            }
+        }"""
+
+# Opt-in compact positional contract, see services/compact_schema.py
+COMPACT_SCHEMA = CompactSchema({'c': 'corrected_mappings', 'a': 'additional_mappings'}, note_field='reasoning')
+
+
 class LegacyMappingAgent:
     """
     Agent responsible for running the existing DocumentExtractorV5.py script
     and extracting mappings using the current AST-based approach
     """
     
-    def __init__(self, llm_service: LLMService):
+    def __init__(self, llm_service: LLMService, chunker: Optional[NotebookChunker] = None, compact_output: bool = False):
         self.llm_service = llm_service
-        self.extractor = MappingExtractor()
+        self.chunker = chunker or NotebookChunker()
+        self.compact_output = compact_output
     
-    async def extract_mappings(self, notebook_path: str) -> Dict[str, Any]:
+    async def extract_mappings(self, notebook_path: str, notebook_content: Optional[str] = None) -> Dict[str, Any]:
         """
         Extract mappings using the legacy DocumentExtractorV5 approach
         
         Args:
             notebook_path: Path to the Databricks notebook
+            notebook_content: Notebook text if already fetched (otherwise read from notebook_path on disk)
             
         Returns:
             Dict containing extracted mappings and metadata
         """
         try:
             # Read the notebook content
-            with open(notebook_path, 'r', encoding='utf-8') as f:
-                notebook_content = f.read()
+            if notebook_content is None:
+                with open(notebook_path, 'r', encoding='utf-8') as f:
+                    notebook_content = f.read()
             
             # Use the existing DocumentExtractorV5 logic
-            legacy_mappings = await self._run_legacy_extraction(notebook_content)
+            legacy_mappings, dataframe_to_table = await self._run_legacy_extraction(notebook_content)
             
             # Format results to match our standard format
             formatted_mappings = self._format_legacy_mappings(legacy_mappings)
             
             # Enhance with LLM understanding
             enhanced_mappings = await self._enhance_legacy_with_llm(
-                notebook_content, formatted_mappings
+                notebook_content, formatted_mappings, dataframe_to_table
             )
             
             return {
@@ -62,34 +101,38 @@ class LegacyMappingAgent:
                 'notebook_path': notebook_path
             }
     
-    async def _run_legacy_extraction(self, notebook_content: str) -> List[Dict[str, Any]]:
+    async def _run_legacy_extraction(self, notebook_content: str) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
         """
         Run the legacy DocumentExtractorV5 extraction logic
+        
+        Returns:
+            (mappings, dataframe_to_table) for this notebook; the extractor is
+            local to the run, so concurrent notebooks don't share its state
         """
         import ast
         
         mappings = []
+        extractor = MappingExtractor()
         
         try:
             # Parse the notebook content as Python AST
             tree = ast.parse(notebook_content)
+            extractor.visit(tree)
             
-            # Use the existing MappingExtractor
-            self.extractor.visit(tree)
-            
-            # Extract the mappings from the extractor
-            for mapping in self.extractor.mappings:
+            # Extract the mappings from the extractor (plain dicts keyed by
+            # the mapping document's column headers)
+            for mapping in extractor.mappings:
                 mappings.append({
-                    'source_table': getattr(mapping, 'source_table', 'unknown'),
-                    'source_column': getattr(mapping, 'source_column', 'unknown'),
-                    'transformation': getattr(mapping, 'transformation', ''),
-                    'target_field': getattr(mapping, 'target_field', ''),
-                    'array_field': getattr(mapping, 'array_field', ''),
-                    'extraction_details': getattr(mapping, 'details', {})
+                    'source_table': mapping.get('Source Table') or 'unknown',
+                    'source_column': mapping.get('Source Column(s)') or 'unknown',
+                    'transformation': mapping.get('Transformation') or '',
+                    'target_field': mapping.get('Target Column(s)') or '',
+                    'array_field': ', '.join(alias for alias, _ in mapping.get('Array Field') or []),
+                    'extraction_details': {}
                 })
             
             # Also extract dataframe mappings if available
-            for df_name, df_mapping in self.extractor.dataframe_mappings.items():
+            for df_name, df_mapping in extractor.dataframe_mappings.items():
                 mappings.append({
                     'source_table': df_name,
                     'source_column': 'dataframe_operation',
@@ -104,7 +147,7 @@ class LegacyMappingAgent:
             # If AST parsing fails, try a simpler approach
             mappings = self._fallback_legacy_extraction(notebook_content)
         
-        return mappings
+        return mappings, extractor.dataframe_to_table
     
     def _fallback_legacy_extraction(self, notebook_content: str) -> List[Dict[str, Any]]:
         """
@@ -177,66 +220,145 @@ class LegacyMappingAgent:
     async def _enhance_legacy_with_llm(
         self, 
         notebook_content: str, 
-        formatted_mappings: List[Dict[str, Any]]
+        formatted_mappings: List[Dict[str, Any]],
+        dataframe_to_table: Dict[str, str]
+    ) -> List[Dict[str, Any]]:
+        """
+        Use Llama model to enhance and validate legacy mappings.
+        
+        The notebook is split into cell-aligned chunks; each chunk is reviewed
+        concurrently together with the legacy mappings found in it, and the
+        partial results are merged in notebook order.
+        """
+        if deadline_expired():
+            print("Workflow deadline reached: keeping legacy mappings without LLM review")
+            return formatted_mappings
+        
+        chunks = self.chunker.chunk(notebook_content, extra_context=dataframe_to_table)
+        if not chunks:
+            return formatted_mappings
+        
+        mappings_by_chunk = self._assign_mappings_to_chunks(formatted_mappings, chunks)
+        print(f"Reviewing legacy mappings in {len(chunks)} chunk(s) of up to ~{self.chunker.max_chunk_tokens} tokens")
+        
+        # Chunks are reviewed concurrently; one limiter keeps at most
+        # batch_concurrency requests in flight, split halves included
+        limiter = self.llm_service.batch_limiter()
+        partial_results = await asyncio.gather(*[
+            self._enhance_chunk_with_llm(chunk, len(chunks), mappings_by_chunk[chunk.index], limiter)
+            for chunk in chunks
+        ])
+        
+        return merge_chunk_mappings(partial_results)
+    
+    def _assign_mappings_to_chunks(
+        self,
+        formatted_mappings: List[Dict[str, Any]],
+        chunks: List[NotebookChunk]
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Route each legacy mapping to the first chunk whose code mentions its
+        target (or source) column; unmatched mappings go to the first chunk
+        """
+        chunk_words = [set(re.findall(r'\w+', chunk.text)) for chunk in chunks]
+        mappings_by_chunk = [[] for _ in chunks]
+        
+        for mapping in formatted_mappings:
+            target = str(mapping.get('target_field') or '')
+            source = str(mapping.get('source_column') or '').split('.')[-1]
+            # Extractor columns are prefixed with the dataframe name ("address1_df__zip")
+            candidates = [name for name in (target, target.split('__')[-1], source, source.split('__')[-1]) if name]
+            
+            chunk_index = next(
+                (index for name in candidates for index, words in enumerate(chunk_words) if name in words),
+                0
+            )
+            mappings_by_chunk[chunk_index].append(mapping)
+        
+        return mappings_by_chunk
+    
+    async def _enhance_chunk_with_llm(
+        self,
+        chunk: NotebookChunk,
+        total_chunks: int,
+        formatted_mappings: List[Dict[str, Any]],
+        limiter: asyncio.Semaphore
     ) -> List[Dict[str, Any]]:
         """
-        Use Llama model to enhance and validate legacy mappings
+        Review one notebook chunk; returns the chunk's legacy mappings unchanged on failure
+        
+        The limiter is held only while the request streams, and the halves
+        of a split chunk share it with the rest of the notebook.
         """
+        encoder = PromptEncoder()
+        mappings_table = encoder.table(formatted_mappings, baseline='repr')
+        output_format = COMPACT_SCHEMA.output_format() if self.compact_output else CORRECTIONS_OUTPUT_FORMAT
         
         prompt = f"""
         As a data transformation expert, review and improve these mappings extracted from a Databricks notebook using a legacy extraction tool.
 
-        NOTEBOOK CONTENT (first 6000 chars):
-        {notebook_content[:6000]}
+        NOTEBOOK SECTION {chunk.index + 1} OF {total_chunks} (cells {chunk.cell_start}-{chunk.cell_end}):
+        {chunk.text}
+
+        DATAFRAME TO SOURCE TABLE BINDINGS (defined elsewhere in the notebook):
+        {chunk.context_text()}
+
+        {TABLE_FORMAT_NOTE}
 
-        LEGACY EXTRACTED MAPPINGS:
-        {formatted_mappings}
+        LEGACY EXTRACTED MAPPINGS FOR THIS SECTION:
+        {mappings_table}
 
         The legacy tool has known accuracy issues. Your task:
 
         1. Review each mapping for accuracy
         2. Correct any obvious errors in source tables, source columns, or transformation rules
-        3. Identify missing transformations that the legacy tool might have missed
+        3. Identify missing transformations in this section that the legacy tool might have missed
         4. Improve confidence scores based on your analysis
         5. Flag mappings that definitely need human review
 
-        REQUIRED OUTPUT FORMAT:
-        {{
-            "corrected_mappings": [
-                {{
-                    "source_table": "corrected_table_name",
-                    "source_column": "corrected_column_name",
-                    "transformation_rule": "corrected_transformation_code",
-                    "target_field": "target_column_name",
-                    "array_field": "array_field_if_applicable",
-                    "confidence_score": 0.85,
-                    "needs_review": false,
-                    "reasoning": "explanation of corrections made",
-                    "changes_made": ["list", "of", "corrections"]
-                }}
-            ],
-            "additional_mappings": [
-                // Any mappings missed by legacy tool
-            ],
-            "summary": {{
-                "corrections_made": 5,
-                "mappings_added": 2,
-                "high_confidence_count": 8
-            }}
-        }}
+        {output_format}
 
         Focus on accuracy and provide detailed explanations for your corrections.
         """
+        encoder.report(f"Legacy review chunk {chunk.index + 1}/{total_chunks}", prompt)
 
         try:
-            response = await self.llm_service.call_llama(prompt)
+            # Stream the response and collect mappings as soon as each is complete
+            if self.compact_output:
+                parser = IncrementalJSONParser(COMPACT_SCHEMA.parser_keys)
+            else:
+                parser = IncrementalJSONParser(['corrected_mappings', 'additional_mappings'])
+            corrected_mappings = []
+            additional_mappings = []
+            
+            model = self.llm_service.route_model(
+                'enhancement', prompt, rules=[mapping.get('transformation_rule') for mapping in formatted_mappings]
+            )
+            max_tokens = self.llm_service.max_tokens_for(model, len(formatted_mappings), compact=self.compact_output)
+            
+            # Split the chunk instead of sending a prompt the model cannot take
+            if not self.llm_service.prompt_budget(model, prompt, max_tokens=max_tokens)['fits']:
+                halves = self.chunker.split_chunk(chunk)
+                if len(halves) > 1:
+                    print(f"Legacy chunk {chunk.index + 1}/{total_chunks} does not fit the {model} context window, splitting it")
+                    assigned = self._assign_mappings_to_chunks(formatted_mappings, halves)
+                    partial_results = await asyncio.gather(*[
+                        self._enhance_chunk_with_llm(half, total_chunks, half_mappings, limiter)
+                        for half, half_mappings in zip(halves, assigned)
+                    ])
+                    return merge_chunk_mappings(partial_results)
             
-            # Parse LLM response
-            import json
-            enhanced_data = json.loads(response)
+            async with limiter:
+                async for key, mapping in self.llm_service.stream_json_items(model, prompt, parser, max_tokens=max_tokens):
+                    if self.compact_output:
+                        key, mapping = COMPACT_SCHEMA.decode_item(key, mapping)
+                    if key == 'corrected_mappings':
+                        corrected_mappings.append(mapping)
+                    else:
+                        additional_mappings.append(mapping)
             
-            corrected_mappings = enhanced_data.get('corrected_mappings', formatted_mappings)
-            additional_mappings = enhanced_data.get('additional_mappings', [])
+            if not parser.seen_keys & {'corrected_mappings', 'c'}:
+                corrected_mappings = formatted_mappings
             
             # Combine corrected and additional mappings
             all_mappings = corrected_mappings + additional_mappings
@@ -249,8 +371,8 @@ class LegacyMappingAgent:
             return all_mappings
             
         except Exception as e:
-            print(f"Legacy LLM enhancement failed: {str(e)}")
-            # Return formatted mappings without enhancement
+            print(f"Legacy LLM enhancement failed for chunk {chunk.index + 1}/{total_chunks}: {str(e)}")
+            # Return this chunk's formatted mappings without enhancement
             return formatted_mappings
     
     def _extract_table_definitions(self, notebook_content: str) -> Dict[str, List[str]]:
@@ -1,8 +1,47 @@
 import asyncio
 from typing import Dict, List, Any, Tuple
 from services.llm_service import LLMService
+from services.json_stream import IncrementalJSONParser
+from services.prompt_encoding import PromptEncoder, TABLE_FORMAT_NOTE
+from services.compact_schema import CompactSchema, decode_sources
+from services.deadline import deadline_expired
+from services.rule_cache import merge_by_index
 import difflib
-import json
+
+
+# Verbose response contract (the default)
+VALIDATION_OUTPUT_FORMAT = """REQUIRED OUTPUT FORMAT:
+        {
+            "validated_mappings": [
+                {
+                    "source_table": "table_name",
+                    "source_column": "column_name",
+                    "transformation_rule": "complete PySpark/SQL code",
+                    "target_field": "target_column_name",
+                    "array_field": "array_field_if_applicable",
+                    "confidence_score": 0.95,
+                    "needs_review": false,
+                    "validation_reasoning": "explanation of validation decision",
+                    "sources_used": ["code_analysis", "legacy", "merged"],
+                    "conflict_resolution": "how conflicts were resolved if any"
+                }
+            ],
+            "validation_summary": {
+                "total_validated": 15,
+                "high_confidence": 12,
+                "needs_review": 3,
+                "conflicts_resolved": 4,
+                "methodology": "prioritized code analysis with legacy validation"
+            }
+        }"""
+
+# Opt-in compact positional contract, see services/compact_schema.py
+COMPACT_SCHEMA = CompactSchema(
+    {'v': 'validated_mappings'},
+    note_field='validation_reasoning',
+    extra_fields=[('sources_used', "letters for the sources used: c=code_analysis, l=legacy, m=merged (e.g. \"cl\")")],
+    field_decoders={'sources_used': decode_sources}
+)
 
 
 class ValidationAgent:
@@ -11,8 +50,9 @@ class ValidationAgent:
     Code Analysis Agent and Legacy Mapping Agent outputs using Claude LLM
     """
     
-    def __init__(self, llm_service: LLMService):
+    def __init__(self, llm_service: LLMService, compact_output: bool = False):
         self.llm_service = llm_service
+        self.compact_output = compact_output
     
     async def validate_and_correct(
         self, 
@@ -95,8 +135,9 @@ class ValidationAgent:
         code_lookup = self._create_mapping_lookup(code_mappings, 'code_analysis')
         legacy_lookup = self._create_mapping_lookup(legacy_mappings, 'legacy')
         
-        # Find matches and conflicts
-        all_keys = set(code_lookup.keys()) | set(legacy_lookup.keys())
+        # Find matches and conflicts (in first-seen order, not set order, so
+        # prompts are identical across processes for caching and replay)
+        all_keys = list(dict.fromkeys([*code_lookup.keys(), *legacy_lookup.keys()]))
         
         for key in all_keys:
             code_mapping = code_lookup.get(key)
@@ -183,6 +224,26 @@ class ValidationAgent:
         """
         Use Claude LLM to intelligently validate and correct mapping conflicts
         """
+        if deadline_expired():
+            print("Workflow deadline reached: resolving conflicts with fallback validation")
+            return self._fallback_validation(comparison_analysis)
+        
+        # Pairs whose rules repeat an idiom that was already validated reuse that verdict
+        conflict_count = len(comparison_analysis['conflicts'][:10])  # Limit to first 10 conflicts
+        matches = comparison_analysis['conflicts'][:10] + comparison_analysis['partial_matches'][:10]
+        rule_cache = self.llm_service.rule_cache
+        if rule_cache is not None:
+            cached_mappings, pending_indices = rule_cache.lookup_many('validation', matches, self._rule_pair, self._code_mapping)
+        else:
+            cached_mappings, pending_indices = {}, list(range(len(matches)))
+        pending = [matches[index] for index in pending_indices]
+        conflicts = [matches[index] for index in pending_indices if index < conflict_count]
+        partial_matches = [matches[index] for index in pending_indices if index >= conflict_count]
+        
+        encoder = PromptEncoder()
+        conflicts_table = encoder.table(conflicts)
+        partial_matches_table = encoder.table(partial_matches)
+        output_format = COMPACT_SCHEMA.output_format() if self.compact_output else VALIDATION_OUTPUT_FORMAT
         
         prompt = f"""
         As an expert in PySpark and SQL data transformations, you need to validate and correct mapping conflicts between two extraction methods.
@@ -206,11 +267,13 @@ class ValidationAgent:
         Code Analysis Only: {len(comparison_analysis['code_only'])}
         Legacy Only: {len(comparison_analysis['legacy_only'])}
 
+        {TABLE_FORMAT_NOTE}
+
         CONFLICTS TO RESOLVE:
-        {json.dumps(comparison_analysis['conflicts'][:10], indent=2)}  # Limit to first 10 conflicts
+        {conflicts_table}
 
         PARTIAL MATCHES TO VALIDATE:
-        {json.dumps(comparison_analysis['partial_matches'][:10], indent=2)}
+        {partial_matches_table}
 
         YOUR TASK:
         1. For CONFLICTS: Choose the more accurate mapping or create a corrected version
@@ -226,42 +289,39 @@ class ValidationAgent:
         - Validate that target fields make sense
         - Check for proper PySpark/SQL syntax in transformation rules
 
-        REQUIRED OUTPUT FORMAT:
-        {{
-            "validated_mappings": [
-                {{
-                    "source_table": "table_name",
-                    "source_column": "column_name",
-                    "transformation_rule": "complete PySpark/SQL code",
-                    "target_field": "target_column_name",
-                    "array_field": "array_field_if_applicable",
-                    "confidence_score": 0.95,
-                    "needs_review": false,
-                    "validation_reasoning": "explanation of validation decision",
-                    "sources_used": ["code_analysis", "legacy", "merged"],
-                    "conflict_resolution": "how conflicts were resolved if any"
-                }}
-            ],
-            "validation_summary": {{
-                "total_validated": 15,
-                "high_confidence": 12,
-                "needs_review": 3,
-                "conflicts_resolved": 4,
-                "methodology": "prioritized code analysis with legacy validation"
-            }}
-        }}
+        {output_format}
 
         Be thorough and accurate. When in doubt, flag for human review.
         """
+        encoder.report("Validation", prompt)
 
         try:
-            response = await self.llm_service.call_claude(prompt)
+            # Stream Claude's response and collect each validated mapping as it completes
+            parser = IncrementalJSONParser(COMPACT_SCHEMA.parser_keys if self.compact_output else ['validated_mappings'])
+            validated_mappings = []
             
-            # Parse Claude's response
-            validated_data = json.loads(response)
+            if pending or not cached_mappings:
+                # Scored on the code-side rules, one per mapping like the other agents
+                model = self.llm_service.route_model(
+                    'validation', prompt,
+                    rules=[self._code_mapping(match).get('transformation_rule') for match in pending]
+                )
+                max_tokens = self.llm_service.max_tokens_for(model, len(pending), compact=self.compact_output)
+                
+                async for key, mapping in self.llm_service.stream_json_items(model, prompt, parser, max_tokens=max_tokens):
+                    if self.compact_output:
+                        key, mapping = COMPACT_SCHEMA.decode_item(key, mapping)
+                    validated_mappings.append(mapping)
+                
+            else:
+                print(f"Validation: all {len(cached_mappings)} conflicts/partial matches resolved from the rule cache")
             
-            # Add exact matches and validated unique mappings
-            validated_mappings = validated_data.get('validated_mappings', [])
+            if rule_cache is not None:
+                # Store the new verdicts and put the results back in conflict order
+                pairing = rule_cache.store_many(
+                    'validation', pending, validated_mappings, self._rule_pair, self._code_mapping
+                )
+                validated_mappings = merge_by_index(cached_mappings, pending_indices, validated_mappings, pairing)
             
             # Add exact matches (already validated by high similarity)
             for exact_match in comparison_analysis['exact_matches']:
@@ -279,6 +339,16 @@ class ValidationAgent:
             # Fallback: prefer code analysis results
             return self._fallback_validation(comparison_analysis)
     
+    def _rule_pair(self, match: Dict[str, Any]) -> List[str]:
+        return [
+            match['code_mapping'].get('transformation_rule', ''),
+            match['legacy_mapping'].get('transformation_rule', '')
+        ]
+    
+    @staticmethod
+    def _code_mapping(match: Dict[str, Any]) -> Dict[str, Any]:
+        return match['code_mapping']
+    
     def _fallback_validation(self, comparison_analysis: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
         Fallback validation when Claude LLM fails
@@ -4,10 +4,18 @@ from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from agents.agent_orchestrator import AgentOrchestrator
 from services.gitlab_service import GitLabService
+from services.local_git_service import LocalGitService
+from services.gitlab_cache import GitLabFileCache
+from services.content_store import ContentStore
+from services.sync_state import RepositorySyncState
 from services.llm_service import LLMService
+from services.llm_cache import LLMResponseCache
+from services.rule_cache import RuleVerdictCache
+from services.traffic_cassette import TrafficCassette
 from models.database import db, MappingSession, MappingResult
 from models.databricks_config import get_database_config
 import asyncio
+import atexit
 import json
 from datetime import datetime
 import tempfile
@@ -31,14 +39,160 @@ app.config['DATABRICKS_TOKEN'] = os.getenv('DATABRICKS_TOKEN')
 db.init_app(app)
 
 # Initialize services  
+llm_cache = None
+if os.getenv('LLM_CACHE_ENABLED', 'True').lower() == 'true':
+    llm_cache = LLMResponseCache(
+        cache_dir=os.getenv('LLM_CACHE_DIR', '.llm_cache'),
+        max_size_bytes=int(os.getenv('LLM_CACHE_MAX_BYTES', str(256 * 1024 * 1024))),
+        ttl_seconds=float(os.getenv('LLM_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+    )
+
+rule_cache = None
+if os.getenv('LLM_RULE_CACHE_ENABLED', 'True').lower() == 'true':
+    rule_cache = RuleVerdictCache(max_entries=int(os.getenv('LLM_RULE_CACHE_MAX_ENTRIES', '5000')))
+
+# Optional capture of all LLM and GitLab traffic for offline replay
+# (python -m benchmarks.bench_workflow --replay <path>)
+TRAFFIC_RECORD_PATH = os.getenv('TRAFFIC_RECORD_PATH')
+traffic_cassette = None
+if TRAFFIC_RECORD_PATH:
+    traffic_cassette = TrafficCassette(metadata={
+        'claude_endpoint': app.config['CLAUDE_ENDPOINT'],
+        'llama_endpoint': app.config['LLAMA_ENDPOINT']
+    })
+
 llm_service = LLMService(
     claude_endpoint=app.config['CLAUDE_ENDPOINT'],
     llama_endpoint=app.config['LLAMA_ENDPOINT'],
-    api_token=app.config['DATABRICKS_TOKEN']
+    api_token=app.config['DATABRICKS_TOKEN'],
+    http2=os.getenv('LLM_HTTP2', 'True').lower() == 'true',
+    max_connections=int(os.getenv('LLM_MAX_CONNECTIONS', '20')),
+    max_keepalive_connections=int(os.getenv('LLM_MAX_KEEPALIVE_CONNECTIONS', '10')),
+    keepalive_expiry=float(os.getenv('LLM_KEEPALIVE_EXPIRY', '120')),
+    cache=llm_cache,
+    requests_per_second=float(os.getenv('LLM_REQUESTS_PER_SECOND', '5')),
+    burst=int(os.getenv('LLM_RATE_BURST', '10')),
+    max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', '16')),
+    max_throttle_retries=int(os.getenv('LLM_MAX_THROTTLE_RETRIES', '3')),
+    max_retries=int(os.getenv('LLM_MAX_RETRIES', '2')),
+    retry_base_delay=float(os.getenv('LLM_RETRY_BASE_DELAY', '0.5')),
+    retry_max_delay=float(os.getenv('LLM_RETRY_MAX_DELAY', '8')),
+    breaker_failure_threshold=int(os.getenv('LLM_BREAKER_FAILURE_THRESHOLD', '3')),
+    breaker_recovery_timeout=float(os.getenv('LLM_BREAKER_RECOVERY_SECONDS', '30')),
+    hedging_enabled=os.getenv('LLM_HEDGING_ENABLED', 'False').lower() == 'true',
+    hedge_percentile=float(os.getenv('LLM_HEDGE_PERCENTILE', '95')),
+    hedge_max_rate=float(os.getenv('LLM_HEDGE_MAX_RATE', '0.1')),
+    token_costs_per_million={
+        'claude': {
+            'input': float(os.getenv('LLM_CLAUDE_INPUT_COST_PER_M', '3.0')),
+            'output': float(os.getenv('LLM_CLAUDE_OUTPUT_COST_PER_M', '15.0'))
+        },
+        'llama': {
+            'input': float(os.getenv('LLM_LLAMA_INPUT_COST_PER_M', '0.5')),
+            'output': float(os.getenv('LLM_LLAMA_OUTPUT_COST_PER_M', '1.5'))
+        }
+    },
+    dedupe_inflight=os.getenv('LLM_DEDUPE_INFLIGHT', 'True').lower() == 'true',
+    routing_enabled=os.getenv('LLM_ROUTING_ENABLED', 'True').lower() == 'true',
+    routing_complexity_threshold=int(os.getenv('LLM_ROUTING_COMPLEXITY_THRESHOLD', '3')),
+    routing_large_prompt_tokens=int(os.getenv('LLM_ROUTING_LARGE_PROMPT_TOKENS', '6000')),
+    session_budget_usd=float(os.getenv('LLM_SESSION_BUDGET_USD', '0')),
+    rule_cache=rule_cache,
+    warm_interval_seconds=float(os.getenv('LLM_WARM_INTERVAL_SECONDS', '0')),
+    cold_after_seconds=float(os.getenv('LLM_COLD_AFTER_SECONDS', '900')),
+    warm_on_session=os.getenv('LLM_WARM_ON_SESSION', 'True').lower() == 'true',
+    context_tokens={
+        'claude': int(os.getenv('LLM_CLAUDE_CONTEXT_TOKENS', '200000')),
+        'llama': int(os.getenv('LLM_LLAMA_CONTEXT_TOKENS', '128000'))
+    },
+    prompt_estimate_margin=float(os.getenv('LLM_PROMPT_ESTIMATE_MARGIN', '1.1')),
+    cassette=traffic_cassette,
+    batch_concurrency=int(os.getenv('LLM_BATCH_CONCURRENCY', '8'))
+)
+
+# Save recorded traffic after the pooled clients are closed (atexit runs in reverse order)
+if traffic_cassette is not None:
+    atexit.register(lambda: traffic_cassette.save(TRAFFIC_RECORD_PATH))
+
+# Release pooled LLM connections when the app process exits
+atexit.register(lambda: asyncio.run(llm_service.aclose()))
+
+gitlab_cache = None
+if os.getenv('GITLAB_CACHE_ENABLED', 'True').lower() == 'true':
+    gitlab_cache = GitLabFileCache(
+        cache_dir=os.getenv('GITLAB_CACHE_DIR', '.gitlab_cache'),
+        max_size_bytes=int(os.getenv('GITLAB_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+    )
+
+content_store = None
+if os.getenv('CONTENT_STORE_ENABLED', 'True').lower() == 'true':
+    content_store = ContentStore(
+        cache_dir=os.getenv('CONTENT_STORE_DIR', '.content_store'),
+        max_size_bytes=int(os.getenv('CONTENT_STORE_MAX_BYTES', str(256 * 1024 * 1024)))
+    )
+
+# Last analyzed commit per project/branch, for incremental /api/sync runs
+sync_state = RepositorySyncState(cache_dir=os.getenv('GITLAB_SYNC_DIR', '.gitlab_sync'))
+
+# Read notebooks from a local checkout or bare mirror instead of the GitLab API
+GITLAB_LOCAL_REPO_PATH = os.getenv('GITLAB_LOCAL_REPO_PATH')
+if GITLAB_LOCAL_REPO_PATH:
+    gitlab_service = LocalGitService(
+        GITLAB_LOCAL_REPO_PATH,
+        default_ref=os.getenv('GITLAB_LOCAL_REF') or None,
+        sync_state=sync_state
+    )
+else:
+    gitlab_service = GitLabService(
+        cassette=traffic_cassette,
+        content_cache=gitlab_cache,
+        content_store=content_store,
+        sync_state=sync_state,
+        max_connections=int(os.getenv('GITLAB_MAX_CONNECTIONS', '10')),
+        page_concurrency=int(os.getenv('GITLAB_PAGE_CONCURRENCY', '4'))
+    )
+atexit.register(lambda: asyncio.run(gitlab_service.aclose()))
+
+agent_orchestrator = AgentOrchestrator(
+    llm_service=llm_service,
+    compact_output=os.getenv('LLM_COMPACT_OUTPUT', 'False').lower() == 'true',
+    gitlab_service=gitlab_service,
+    content_store=content_store
 )
 
-agent_orchestrator = AgentOrchestrator(llm_service=llm_service)
-gitlab_service = GitLabService()
+# Overall time budget for one analysis workflow (unset or 0 = unbounded)
+WORKFLOW_DEADLINE_SECONDS = float(os.getenv('MAX_PROCESSING_TIME', '0'))
+
+def _parse_deadline(data):
+    """
+    Deadline for one workflow from a request's optional `deadline_seconds`
+    
+    Args:
+        data: Request body; a missing or null `deadline_seconds` takes MAX_PROCESSING_TIME, 0 turns the deadline off
+        
+    Returns:
+        Seconds, or None for no deadline
+        
+    Raises:
+        ValueError: If `deadline_seconds` is not a non-negative number
+    """
+    value = data.get('deadline_seconds')
+    if value is None:
+        return WORKFLOW_DEADLINE_SECONDS or None
+    
+    try:
+        seconds = float(value) if not isinstance(value, bool) else None
+    except (TypeError, ValueError):
+        seconds = None
+    if seconds is None or not 0 <= seconds < float('inf'):
+        raise ValueError(f"deadline_seconds must be a non-negative number of seconds, got {value!r}")
+    
+    return seconds or None
+
+def _session_project_id(gitlab_credentials):
+    """Project a session is recorded under (None for a local repository)"""
+    project_id = gitlab_credentials.get('project_id')
+    return str(project_id) if project_id is not None else None
 
 @app.route('/')
 def index():
@@ -59,12 +213,20 @@ async def analyze_notebook():
     """
     try:
         data = request.get_json()
+        gitlab_credentials = data.get('gitlab_credentials') or {}
+        
+        try:
+            deadline_seconds = _parse_deadline(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
         # Create new mapping session
         session = MappingSession(
             notebook_path=data['notebook_path'],
             status='processing',
-            created_at=datetime.utcnow()
+            created_at=datetime.utcnow(),
+            gitlab_project_id=_session_project_id(gitlab_credentials),
+            gitlab_branch=gitlab_credentials.get('branch', 'main')
         )
         db.session.add(session)
         db.session.commit()
@@ -73,7 +235,8 @@ async def analyze_notebook():
         result = await agent_orchestrator.execute_mapping_workflow(
             notebook_path=data['notebook_path'],
             gitlab_credentials=data.get('gitlab_credentials'),
-            session_id=session.id
+            session_id=session.id,
+            deadline_seconds=deadline_seconds
         )
         
         # Update session status
@@ -86,6 +249,109 @@ async def analyze_notebook():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/sync', methods=['POST'])
+async def sync_repository():
+    """
+    Analyze only the notebooks changed on a branch since its last sync
+    
+    Expected input:
+    {
+        "gitlab_credentials": {...},
+        "path": "notebooks",
+        "patterns": ["notebooks/**/*.py"],
+        "file_extension": ".py"
+    }
+    
+    Sessions of deleted notebooks are marked 'retired'. The branch is only
+    recorded as synced when every changed notebook was analyzed.
+    """
+    try:
+        data = request.get_json()
+        gitlab_credentials = data.get('gitlab_credentials') or {}
+        project_id = _session_project_id(gitlab_credentials)
+        
+        try:
+            deadline_seconds = _parse_deadline(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        changes = await gitlab_service.changed_notebooks(
+            gitlab_credentials,
+            path=data.get('path', ''),
+            file_extension=data.get('file_extension', '.py'),
+            patterns=data.get('patterns')
+        )
+        
+        # One archive download for all changed notebooks instead of a fetch each;
+        # notebooks missing from it are fetched one by one by the workflow
+        prefetched = {}
+        if len(changes['changed']) > 1:
+            try:
+                prefetched = await gitlab_service.fetch_notebooks_bulk(changes['gitlab_credentials'], changes['changed'])
+            except Exception as e:
+                print(f"Bulk notebook fetch failed, fetching notebooks individually: {str(e)}")
+        
+        analyzed = []
+        for notebook_path in changes['changed']:
+            session = MappingSession(
+                notebook_path=notebook_path,
+                status='processing',
+                created_at=datetime.utcnow(),
+                gitlab_project_id=project_id,
+                gitlab_branch=changes['branch']
+            )
+            db.session.add(session)
+            db.session.commit()
+            
+            result = await agent_orchestrator.execute_mapping_workflow(
+                notebook_path=notebook_path,
+                gitlab_credentials=changes['gitlab_credentials'],
+                session_id=session.id,
+                deadline_seconds=deadline_seconds,
+                notebook_content=prefetched.get(notebook_path.lstrip('/'))
+            )
+            
+            session.status = 'completed' if result['success'] else 'failed'
+            session.completed_at = datetime.utcnow()
+            db.session.commit()
+            
+            analyzed.append({
+                'notebook_path': notebook_path,
+                'session_id': session.id,
+                'success': result['success'],
+                'mappings_generated': result.get('mappings_generated', 0)
+            })
+        
+        retired_sessions = []
+        if changes['deleted']:
+            stale = MappingSession.query.filter(
+                MappingSession.notebook_path.in_(changes['deleted']),
+                MappingSession.gitlab_project_id == project_id,
+                MappingSession.gitlab_branch == changes['branch'],
+                MappingSession.status == 'completed'
+            ).all()
+            for session in stale:
+                session.status = 'retired'
+                retired_sessions.append(session.id)
+            db.session.commit()
+        
+        synced = all(item['success'] for item in analyzed)
+        if synced:
+            gitlab_service.record_sync(gitlab_credentials, changes)
+        
+        return jsonify({
+            'success': synced,
+            'from_commit': changes['from_commit'],
+            'to_commit': changes['to_commit'],
+            'full_scan': changes['full_scan'],
+            'analyzed': analyzed,
+            'deleted': changes['deleted'],
+            'retired_sessions': retired_sessions
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/sessions/<int:session_id>/results')
 def get_session_results(session_id):
     """Get results for a specific mapping session"""
@@ -172,6 +438,26 @@ def health_check():
     """Health check endpoint"""
     return jsonify({'status': 'healthy', 'timestamp': datetime.utcnow().isoformat()})
 
+@app.route('/api/llm/cache')
+def llm_cache_stats():
+    """LLM response cache hit/miss counters"""
+    return jsonify(llm_service.get_cache_stats())
+
+@app.route('/api/llm/metrics')
+def llm_metrics():
+    """LLM endpoint rate limits, concurrency and queue depth"""
+    return jsonify(llm_service.get_metrics())
+
+@app.route('/api/gitlab/metrics')
+def gitlab_metrics():
+    """GitLab conditional fetch counters (304s vs downloads) and file cache occupancy"""
+    return jsonify(gitlab_service.get_metrics())
+
+@app.route('/api/llm/endpoints')
+def llm_endpoint_health():
+    """Circuit breaker state (closed/open/half_open) per LLM endpoint"""
+    return jsonify(llm_service.get_endpoint_health())
+
 if __name__ == '__main__':
     # Initialize database with enhanced configuration
     db_config.create_tables_if_needed(app)
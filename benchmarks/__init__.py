@@ -0,0 +1 @@
+# Benchmarks and local stand-ins for offline performance testing
\ No newline at end of file
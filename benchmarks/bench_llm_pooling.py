@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Latency comparison: pooled LLMService client vs. a new AsyncClient per call.
+
+Runs against the local mock serving endpoint, so it measures connection
+setup overhead only. Against the real HTTPS Databricks endpoints the gap is
+larger, because every unpooled call also pays a TLS handshake.
+
+    python -m benchmarks.bench_llm_pooling --calls 200 --latency 0.005
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import List
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_serving_endpoint import MockServingEndpoint
+from services.llm_service import LLMService
+
+
+async def _unpooled_call(endpoint: str, headers: dict, prompt: str) -> str:
+    """Previous LLMService behaviour: open and close a client for every prompt"""
+    payload = {'messages': [{'role': 'user', 'content': prompt}], 'max_tokens': 100, 'temperature': 0.1}
+
+    async with httpx.AsyncClient(timeout=httpx.Timeout(60.0)) as client:
+        response = await client.post(endpoint, headers=headers, json=payload)
+        response.raise_for_status()
+        return response.json()['choices'][0]['message']['content']
+
+
+def _summarize(label: str, samples: List[float], connections: int):
+    ordered = sorted(samples)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    print(f"{label:<10} mean={statistics.mean(samples) * 1000:7.2f}ms  "
+          f"p50={statistics.median(samples) * 1000:7.2f}ms  "
+          f"p95={p95 * 1000:7.2f}ms  connections={connections}")
+
+
+async def run_benchmark(calls: int, latency: float):
+    with MockServingEndpoint(latency_seconds=latency) as mock:
+        endpoint = mock.url('databricks-claude-sonnet-4')
+        headers = {'Authorization': 'Bearer bench-token', 'Content-Type': 'application/json'}
+
+        # Baseline: new client per call
+        baseline = []
+        connections_before = mock.connection_count
+        for i in range(calls):
+            start = time.perf_counter()
+            await _unpooled_call(endpoint, headers, f"benchmark prompt {i}")
+            baseline.append(time.perf_counter() - start)
+        _summarize('unpooled', baseline, mock.connection_count - connections_before)
+
+        # Pooled: one long-lived client per endpoint
+        llm_service = LLMService(
+            endpoint,
+            mock.url('databricks-meta-llama-3-3-70b-instruct'),
+            'bench-token',
+            requests_per_second=100000,
+            burst=calls
+        )
+        pooled = []
+        connections_before = mock.connection_count
+        try:
+            for i in range(calls):
+                start = time.perf_counter()
+                await llm_service.call_claude(f"benchmark prompt {i}", max_tokens=100)
+                pooled.append(time.perf_counter() - start)
+        finally:
+            await llm_service.aclose()
+        _summarize('pooled', pooled, mock.connection_count - connections_before)
+
+        speedup = statistics.mean(baseline) / statistics.mean(pooled)
+        print(f"Pooled client is {speedup:.2f}x faster per call on average")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--calls', type=int, default=200, help='Sequential calls per mode')
+    parser.add_argument('--latency', type=float, default=0.0, help='Mock endpoint latency in seconds')
+    args = parser.parse_args()
+
+    asyncio.run(run_benchmark(args.calls, args.latency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the full four-agent mapping workflow.
+
+Runs MappingWorkflowOrchestrator end to end against the local mock serving
+endpoint and an in-memory SQLite database, so the pipeline can be
+load-tested on a laptop with no network and no token spend.
+
+    python -m benchmarks.bench_workflow --runs 3 --latency-dist lognormal:0.8,0.5 --error-rate 0.02
+
+Traffic can be recorded to a compressed cassette (against the mock, or real
+endpoints via --claude-endpoint/--llama-endpoint and DATABRICKS_TOKEN, plus
+GitLab via --gitlab-url/--gitlab-project-id and GITLAB_TOKEN) and replayed
+with no network at full speed, to profile the agents' CPU time alone:
+
+    python -m benchmarks.bench_workflow --runs 1 --record session.cassette.gz
+    python -m benchmarks.bench_workflow --runs 5 --replay session.cassette.gz
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from contextlib import nullcontext
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from benchmarks.mock_serving_endpoint import MockServingEndpoint
+from models.database import db, MappingSession, AgentExecutionLog
+from agents.agent_orchestrator import MappingWorkflowOrchestrator
+from services.llm_service import LLMService
+from services.rule_cache import RuleVerdictCache
+from services.gitlab_service import GitLabService
+from services.traffic_cassette import TrafficCassette
+
+
+def _create_app() -> Flask:
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def _gitlab_credentials(args):
+    if not args.gitlab_url:
+        return None
+    return {
+        'gitlab_url': args.gitlab_url,
+        'project_id': args.gitlab_project_id,
+        'branch': args.gitlab_branch,
+        'access_token': os.getenv('GITLAB_TOKEN', 'replay-token')
+    }
+
+
+async def run_benchmark(args):
+    app = _create_app()
+    cassette = None
+
+    if args.replay:
+        cassette = TrafficCassette.load(args.replay, latency_scale=args.replay_latency_scale)
+        recorded = cassette.metadata
+        args.notebook = args.notebook or recorded.get('notebook')
+        args.gitlab_url = args.gitlab_url or recorded.get('gitlab_url')
+        args.gitlab_project_id = args.gitlab_project_id or recorded.get('gitlab_project_id')
+        args.gitlab_branch = recorded.get('gitlab_branch', args.gitlab_branch)
+        print(f"Replaying {len(cassette.interactions)} recorded interactions from {args.replay}")
+
+    args.notebook = args.notebook or 'load_silver_provider.py'
+    gitlab_credentials = _gitlab_credentials(args)
+
+    mock = nullcontext() if args.replay or args.claude_endpoint else MockServingEndpoint(
+        latency_seconds=args.latency,
+        latency_distribution=args.latency_dist,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after_seconds=args.retry_after,
+        mappings_per_response=args.mappings,
+        stream_chunk_delay_seconds=args.stream_chunk_delay,
+        seed=args.seed
+    )
+
+    with app.app_context(), mock:
+        db.create_all()
+
+        if args.replay:
+            claude_endpoint, llama_endpoint = recorded['claude_endpoint'], recorded['llama_endpoint']
+        elif args.claude_endpoint:
+            claude_endpoint, llama_endpoint = args.claude_endpoint, args.llama_endpoint
+        else:
+            claude_endpoint = mock.url('databricks-claude-sonnet-4')
+            llama_endpoint = mock.url('databricks-meta-llama-3-3-70b-instruct')
+
+        if args.record:
+            cassette = TrafficCassette(metadata={
+                'claude_endpoint': claude_endpoint,
+                'llama_endpoint': llama_endpoint,
+                'notebook': args.notebook,
+                'gitlab_url': args.gitlab_url,
+                'gitlab_project_id': args.gitlab_project_id,
+                'gitlab_branch': args.gitlab_branch
+            })
+
+        llm_service = LLMService(
+            claude_endpoint,
+            llama_endpoint,
+            os.getenv('DATABRICKS_TOKEN', 'bench-token'),
+            requests_per_second=args.rps,
+            burst=args.burst,
+            retry_base_delay=0.05,
+            retry_max_delay=0.5,
+            rule_cache=RuleVerdictCache(),
+            cassette=cassette
+        )
+        gitlab_service = GitLabService(cassette=cassette)
+        orchestrator = MappingWorkflowOrchestrator(llm_service, gitlab_service=gitlab_service)
+
+        wall_times = []
+        try:
+            for run in range(args.runs):
+                session = MappingSession(notebook_path=args.notebook, status='processing', created_at=datetime.utcnow())
+                db.session.add(session)
+                db.session.commit()
+
+                started = time.perf_counter()
+                result = await orchestrator.execute_mapping_workflow(
+                    notebook_path=args.notebook,
+                    gitlab_credentials=gitlab_credentials,
+                    session_id=session.id,
+                    deadline_seconds=args.deadline
+                )
+                elapsed = time.perf_counter() - started
+                wall_times.append(elapsed)
+
+                print(f"run {run + 1}: {elapsed:6.2f}s  success={result['success']}  "
+                      f"mappings={result.get('mappings_generated', 0)}")
+        finally:
+            await llm_service.aclose()
+            await gitlab_service.aclose()
+            if args.record:
+                cassette.save(args.record)
+
+        print("\nPer-agent timings (mean over runs):")
+        for agent_name in ('code_analysis', 'legacy_mapping', 'validation', 'document_generation'):
+            logs = AgentExecutionLog.query.filter_by(agent_name=agent_name).all()
+            if not logs:
+                continue
+            print(f"  {agent_name:<20} {statistics.mean(log.processing_time_seconds for log in logs):6.2f}s  "
+                  f"tokens={statistics.mean(log.llm_tokens_used for log in logs):8.0f}  "
+                  f"cost=${statistics.mean(log.llm_cost_estimate for log in logs):.4f}")
+
+        metrics = llm_service.get_metrics()
+        print(f"\nWorkflow wall time: mean={statistics.mean(wall_times):.2f}s  "
+              f"min={min(wall_times):.2f}s  max={max(wall_times):.2f}s")
+        for model, latency in metrics['latency'].items():
+            print(f"{model} latency: p50={latency['p50_ms']}ms  p95={latency['p95_ms']}ms  samples={latency['samples']}")
+        print(f"Rule cache: {metrics['rule_cache']}")
+        if cassette is not None:
+            print(f"Cassette: {cassette.stats()}")
+        if isinstance(mock, MockServingEndpoint):
+            print(f"Mock endpoint: {mock.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--notebook', help='Notebook to analyze (default: load_silver_provider.py, or the recorded one)')
+    parser.add_argument('--runs', type=int, default=3, help='Workflow runs')
+    parser.add_argument('--latency', type=float, default=0.0, help='Fixed mock latency in seconds')
+    parser.add_argument('--latency-dist', help="Mock latency distribution, e.g. 'lognormal:0.8,0.5'")
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of calls failed with 500/503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of calls answered with 429')
+    parser.add_argument('--retry-after', type=float, default=0.0, help='Retry-After seconds sent with 429s')
+    parser.add_argument('--mappings', type=int, default=5, help='Mappings per canned response')
+    parser.add_argument('--stream-chunk-delay', type=float, default=0.0, help='Delay between streamed chunks')
+    parser.add_argument('--rps', type=float, default=50.0, help='LLMService requests per second per endpoint')
+    parser.add_argument('--burst', type=int, default=20, help='LLMService rate limiter burst')
+    parser.add_argument('--deadline', type=float, help='Workflow deadline in seconds')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--record', metavar='PATH', help='Record all LLM/GitLab traffic to a compressed cassette')
+    parser.add_argument('--replay', metavar='PATH', help='Replay a recorded cassette instead of calling any endpoint')
+    parser.add_argument('--replay-latency-scale', type=float, default=0.0,
+                        help='Fraction of recorded latency to reproduce on replay (0 = full speed)')
+    parser.add_argument('--claude-endpoint', help='Real Claude endpoint instead of the mock (token from DATABRICKS_TOKEN)')
+    parser.add_argument('--llama-endpoint', help='Real Llama endpoint instead of the mock')
+    parser.add_argument('--gitlab-url', help='Fetch the notebook from GitLab (token from GITLAB_TOKEN)')
+    parser.add_argument('--gitlab-project-id', help='GitLab project ID')
+    parser.add_argument('--gitlab-branch', default='main', help='GitLab branch')
+    args = parser.parse_args()
+    if args.record and args.replay:
+        parser.error('--record and --replay are mutually exclusive')
+
+    asyncio.run(run_benchmark(args))
+
+
+if __name__ == '__main__':
+    main()
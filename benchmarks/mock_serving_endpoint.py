@@ -0,0 +1,475 @@
+"""
+Local stand-in for Databricks model serving endpoints.
+
+Speaks the same `/serving-endpoints/<name>/invocations` contract LLMService
+expects (`choices[0].message.content`) so the service and the full agent
+workflow can be exercised without network access or token spend.
+
+Supports latency distributions, random 5xx/429 injection, SSE streaming,
+and canned, schema-valid mapping responses for each agent's prompt.
+"""
+
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional, Union
+
+
+# Realistic provider mappings (from the standard mapping document) used to
+# build canned responses
+CANNED_MAPPINGS = [
+    ('provider_drname', 'dr_fname', 'dr_fname', 'name_first_name'),
+    ('provider_drname', 'dr_lname', 'dr_lname', 'name_last_name'),
+    ('provider_drname', 'nationalid', 'nationalid', 'service_provider_id'),
+    ('provider_drname', 'dr_no_ext', 'dr_no_ext', 'source_service_provider_id'),
+    ('provider_address1', 'zip', "substring(zip, 7, 10)", 'zip_extension'),
+    ('provider_address2', 'tax_id', "substring(tax_id, 1, 10)", 'substring_tax_id'),
+    (
+        'provider_drname',
+        'drsal, dr_fname, dr_iname, dr_lname, drsuffix',
+        'trim(concat(coalesce(drsal," "),coalesce(dr_fname," "),coalesce(dr_iname," "),'
+        'coalesce(dr_lname," "),coalesce(drsuffix," ")))',
+        'alternate_name_name'
+    ),
+    ('provider_dr_spec', 'spec_code', "when(col('spec_code').isNull(), lit('UNK')).otherwise(col('spec_code'))", 'specialty_code'),
+]
+
+# Output array key requested by each agent prompt, checked in this order
+RESPONSE_KEYS = ['standardized_mappings', 'validated_mappings', 'corrected_mappings', 'mappings']
+
+
+class LatencyDistribution:
+    """
+    Response latency sampler.
+
+    Spec strings (seconds):
+        fixed:0.05              constant
+        uniform:0.1,0.5         uniform between low and high
+        normal:0.3,0.05         mean, standard deviation
+        lognormal:0.8,0.5       median, sigma (heavy right tail, like real LLM latency)
+        exponential:0.3         mean
+    """
+
+    KINDS = ('fixed', 'uniform', 'normal', 'lognormal', 'exponential')
+
+    def __init__(self, kind: str, params: List[float], seed: Optional[int] = None):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution '{kind}', expected one of {', '.join(self.KINDS)}")
+        self.kind = kind
+        self.params = params
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec: str, seed: Optional[int] = None) -> 'LatencyDistribution':
+        kind, _, values = spec.partition(':')
+        params = [float(value) for value in values.split(',') if value.strip()]
+        return cls(kind.strip().lower(), params, seed)
+
+    def sample(self) -> float:
+        with self._lock:
+            if self.kind == 'fixed':
+                value = self.params[0]
+            elif self.kind == 'uniform':
+                value = self._random.uniform(self.params[0], self.params[1])
+            elif self.kind == 'normal':
+                value = self._random.gauss(self.params[0], self.params[1])
+            elif self.kind == 'lognormal':
+                value = self._random.lognormvariate(math.log(self.params[0]), self.params[1])
+            else:
+                value = self._random.expovariate(1.0 / self.params[0])
+        return max(value, 0.0)
+
+    def __repr__(self):
+        return f"{self.kind}:{','.join(str(param) for param in self.params)}"
+
+
+class _InvocationHandler(BaseHTTPRequestHandler):
+    """Request handler for the mock invocations API"""
+
+    # HTTP/1.1 so clients can keep connections alive between calls
+    protocol_version = 'HTTP/1.1'
+    # Avoid Nagle/delayed-ACK stalls between the header and body writes
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        endpoint = self.server.endpoint
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': 'invalid JSON body'})
+            return
+
+        request_number = endpoint.record_request(self.path)
+        messages = payload.get('messages') or [{}]
+        prompt = str(messages[-1].get('content', ''))
+
+        fault = endpoint.injected_fault(request_number, prompt)
+        if fault == 429:
+            endpoint.record_status(429)
+            self._send_json(
+                429, {'error_code': 'REQUEST_LIMIT_EXCEEDED'},
+                {'Retry-After': f"{endpoint.retry_after_seconds:g}"}
+            )
+            return
+        if fault is not None:
+            endpoint.record_status(fault)
+            self._send_json(fault, {'error_code': 'INTERNAL_ERROR', 'message': 'injected failure'})
+            return
+
+        latency = endpoint.latency_for(self.path)
+        if latency:
+            time.sleep(latency)
+
+        response = endpoint.build_response(self.path, payload)
+        endpoint.record_status(200)
+        if payload.get('stream'):
+            self._send_stream(
+                response['choices'][0]['message']['content'],
+                response['usage'],
+                endpoint.stream_chunk_chars,
+                endpoint.stream_chunk_delay_seconds
+            )
+        else:
+            self._send_json(200, response)
+
+    def _send_stream(self, content: str, usage: Dict[str, int], chunk_chars: int, chunk_delay: float = 0.0):
+        """Send content as server-sent chat-completion chunks (chunked transfer encoding)"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        for start in range(0, len(content), chunk_chars):
+            if chunk_delay:
+                time.sleep(chunk_delay)
+            event = {'choices': [{'index': 0, 'delta': {'content': content[start:start + chunk_chars]}}]}
+            self._write_chunk(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+
+        # Final event carries the usage block, as the Databricks endpoints do
+        final_event = {'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}], 'usage': usage}
+        self._write_chunk(f"data: {json.dumps(final_event)}\n\n".encode('utf-8'))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+
+    def _send_json(self, status: int, data: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep benchmark output clean
+        pass
+
+
+class MockServingEndpoint:
+    """
+    Threaded local HTTP server mimicking Databricks serving endpoints.
+
+    Usage:
+        with MockServingEndpoint(latency_distribution='lognormal:0.8,0.5', error_rate=0.02) as mock:
+            llm_service = LLMService(mock.url('claude'), mock.url('llama'), 'test-token')
+
+    Without `response_content`, each prompt gets a canned response matching
+    the output schema it asks for (mappings, corrected_mappings,
+    validated_mappings or standardized_mappings).
+    """
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        latency_seconds: float = 0.0,
+        throttle_first_requests: int = 0,
+        endpoint_latency_seconds: Optional[Dict[str, float]] = None,
+        response_content: Optional[str] = None,
+        stream_chunk_chars: int = 16,
+        error_marker: Optional[str] = None,
+        latency_distribution: Optional[Union[str, LatencyDistribution]] = None,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after_seconds: float = 0.0,
+        mappings_per_response: int = 5,
+        stream_chunk_delay_seconds: float = 0.0,
+        seed: Optional[int] = None
+    ):
+        self.host = host
+        self.port = port
+        self.latency_seconds = latency_seconds
+        self.throttle_first_requests = throttle_first_requests
+        # Per-endpoint overrides of latency_seconds, keyed by endpoint name
+        self.endpoint_latency_seconds = endpoint_latency_seconds or {}
+        # Fixed completion text for every non-connectivity prompt, if set
+        self.response_content = response_content
+        self.stream_chunk_chars = stream_chunk_chars
+        # Delay between streamed chunks, to simulate token generation speed
+        self.stream_chunk_delay_seconds = stream_chunk_delay_seconds
+        # Prompts containing this text get a 500 response
+        self.error_marker = error_marker
+        if isinstance(latency_distribution, str):
+            latency_distribution = LatencyDistribution.parse(latency_distribution, seed)
+        self.latency_distribution = latency_distribution
+        # Fraction of requests answered with a random 500/503, or a 429
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after_seconds = retry_after_seconds
+        self.mappings_per_response = mappings_per_response
+        self.request_count = 0
+        self.connection_count = 0
+        self.status_counts: Dict[int, int] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def url(self, endpoint_name: str) -> str:
+        """Invocation URL for a named endpoint"""
+        return f"http://{self.host}:{self.port}/serving-endpoints/{endpoint_name}/invocations"
+
+    def latency_for(self, path: str) -> float:
+        """Response latency for a request path (/serving-endpoints/<name>/invocations)"""
+        parts = path.strip('/').split('/')
+        name = parts[1] if len(parts) > 1 else ''
+        if name in self.endpoint_latency_seconds:
+            return self.endpoint_latency_seconds[name]
+        if self.latency_distribution is not None:
+            return self.latency_distribution.sample()
+        return self.latency_seconds
+
+    def record_request(self, path: str) -> int:
+        with self._lock:
+            self.request_count += 1
+            return self.request_count
+
+    def record_status(self, status: int):
+        with self._lock:
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def injected_fault(self, request_number: int, prompt: str) -> Optional[int]:
+        """Status code to fail this request with, or None to answer normally"""
+        if request_number <= self.throttle_first_requests:
+            return 429
+        if self.error_marker and self.error_marker in prompt:
+            return 500
+        if 'Test connectivity' in prompt:
+            return None
+
+        with self._lock:
+            roll = self._random.random()
+            server_error = self._random.choice((500, 503))
+
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return server_error
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'requests': self.request_count,
+                'connections': self.connection_count,
+                'status_counts': dict(sorted(self.status_counts.items()))
+            }
+
+    def canned_content(self, prompt: str) -> str:
+        """Schema-valid JSON for the output format the prompt asks for"""
+        if 'REQUIRED OUTPUT FORMAT (compact' in prompt:
+            return self._canned_compact_content(prompt)
+
+        key = next((key for key in RESPONSE_KEYS if f'"{key}"' in prompt), 'mappings')
+        mappings = [self._canned_mapping(key, index) for index in range(self.mappings_per_response)]
+        high_confidence = sum(1 for mapping in mappings if mapping['confidence_score'] >= 0.8)
+        needs_review = sum(1 for mapping in mappings if mapping['needs_review'])
+
+        if key == 'corrected_mappings':
+            document = {
+                'corrected_mappings': mappings,
+                'additional_mappings': [],
+                'summary': {'corrections_made': 0, 'mappings_added': 0, 'high_confidence_count': high_confidence}
+            }
+        elif key == 'validated_mappings':
+            document = {
+                'validated_mappings': mappings,
+                'validation_summary': {
+                    'total_validated': len(mappings),
+                    'high_confidence': high_confidence,
+                    'needs_review': needs_review,
+                    'conflicts_resolved': 0,
+                    'methodology': 'mock endpoint'
+                }
+            }
+        elif key == 'standardized_mappings':
+            document = {
+                'standardized_mappings': mappings,
+                'standardization_summary': {'rules_cleaned': 0, 'syntax_corrections': 0, 'formatting_applied': True}
+            }
+        else:
+            document = {
+                'mappings': mappings,
+                'summary': {
+                    'total_transformations': len(mappings),
+                    'high_confidence_count': high_confidence,
+                    'needs_review_count': needs_review
+                }
+            }
+
+        return json.dumps(document)
+
+    def _canned_compact_content(self, prompt: str) -> str:
+        """Positional rows for the compact contract (services/compact_schema.py)"""
+        keys = re.findall(r'"(\w+)": \[\[row\]', prompt) or ['m']
+        positions = re.search(r'exactly these positions: \[([^\]]*)\]', prompt)
+        column_count = len(positions.group(1).split(',')) if positions else 8
+
+        rows = []
+        for index in range(self.mappings_per_response):
+            mapping = self._canned_mapping('mappings', index)
+            row = [
+                mapping['source_table'], mapping['source_column'], mapping['transformation_rule'],
+                mapping['target_field'], mapping['array_field'],
+                int(mapping['confidence_score'] * 100), int(mapping['needs_review'])
+            ]
+            row += ['' for _ in range(column_count - len(row) - 1)]
+            if mapping['needs_review']:
+                row.append('mock endpoint: low confidence')
+            rows.append(row)
+
+        return json.dumps({keys[0]: rows, **{key: [] for key in keys[1:]}}, separators=(',', ':'))
+
+    def _canned_mapping(self, key: str, index: int) -> Dict[str, Any]:
+        source_table, source_column, transformation_rule, target_field = CANNED_MAPPINGS[index % len(CANNED_MAPPINGS)]
+        if index >= len(CANNED_MAPPINGS):
+            target_field = f"{target_field}_{index // len(CANNED_MAPPINGS)}"
+
+        confidence = 0.95 if index % 4 else 0.7
+        mapping = {
+            'source_table': source_table,
+            'source_column': source_column,
+            'transformation_rule': transformation_rule,
+            'target_field': target_field,
+            'array_field': '',
+            'confidence_score': confidence,
+            'needs_review': confidence < 0.8
+        }
+
+        if key == 'mappings':
+            mapping.update(reasoning='mock endpoint mapping', code_location=f"cell {index + 1}")
+        elif key == 'corrected_mappings':
+            mapping.update(reasoning='mock endpoint review', changes_made=[])
+        elif key == 'validated_mappings':
+            mapping.update(
+                validation_reasoning='mock endpoint validation',
+                sources_used=['code_analysis', 'legacy'],
+                conflict_resolution=''
+            )
+        else:
+            mapping.update(final_notes='')
+
+        return mapping
+
+    def build_response(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Build a chat-completions response for a request payload"""
+        messages = payload.get('messages', [])
+        prompt = messages[-1]['content'] if messages else ''
+
+        if 'Test connectivity' in prompt:
+            content = 'Connected successfully.'
+        elif self.response_content is not None:
+            content = self.response_content
+        else:
+            content = self.canned_content(prompt)
+
+        return {
+            'choices': [
+                {
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': content},
+                    'finish_reason': 'stop'
+                }
+            ],
+            'usage': {
+                'prompt_tokens': max(len(prompt) // 4, 1),
+                'completion_tokens': max(len(content) // 4, 1),
+                'total_tokens': max(len(prompt) // 4, 1) + max(len(content) // 4, 1)
+            }
+        }
+
+    def start(self) -> 'MockServingEndpoint':
+        endpoint = self
+
+        class _Server(ThreadingHTTPServer):
+            daemon_threads = True
+
+            def get_request(self):
+                request = super().get_request()
+                with endpoint._lock:
+                    endpoint.connection_count += 1
+                return request
+
+        self._server = _Server((self.host, self.port), _InvocationHandler)
+        self._server.endpoint = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> 'MockServingEndpoint':
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a local stand-in LLM serving endpoint')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.0, help='Fixed response latency in seconds')
+    parser.add_argument('--latency-dist', help="Latency distribution, e.g. 'lognormal:0.8,0.5' (overrides --latency)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests failed with 500/503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of requests answered with 429')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After seconds sent with 429s')
+    parser.add_argument('--mappings', type=int, default=5, help='Mappings per canned response')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    mock = MockServingEndpoint(
+        port=args.port,
+        latency_seconds=args.latency,
+        latency_distribution=args.latency_dist,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after_seconds=args.retry_after,
+        mappings_per_response=args.mappings,
+        seed=args.seed
+    ).start()
+    print(f"Mock serving endpoint listening on {mock.url('<endpoint-name>')}")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
@@ -15,7 +15,7 @@ class MappingSession(db.Model):
     
     id = Column(Integer, primary_key=True)
     notebook_path = Column(String(500), nullable=False)
-    status = Column(String(50), nullable=False, default='pending')  # pending, processing, completed, failed
+    status = Column(String(50), nullable=False, default='pending')  # pending, processing, completed, failed, retired
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
     error_message = Column(Text, nullable=True)
@@ -0,0 +1,158 @@
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Awaitable, Optional
+
+
+class BackgroundEventLoop:
+    """
+    Long-lived asyncio event loop running on a daemon thread.
+
+    Flask runs every async view on a fresh event loop, so connection pools and
+    asyncio primitives created inside a request die with that request. Services
+    that need state shared across requests (pooled HTTP clients, limiters, ...)
+    run their I/O on this loop instead and callers await the result from
+    whatever loop they are on.
+    """
+
+    def __init__(self, name: str = 'service-loop'):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """Return the background loop, starting it on first use"""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._run_forever,
+                    args=(self._loop,),
+                    name=self.name,
+                    daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    @property
+    def is_running(self) -> bool:
+        return self._loop is not None and not self._loop.is_closed()
+
+    def _run_forever(self, loop: asyncio.AbstractEventLoop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def in_loop(self) -> bool:
+        """True when called from a coroutine already running on the background loop"""
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    async def run(self, coro: Awaitable[Any]) -> Any:
+        """
+        Await a coroutine on the background loop from any event loop.
+        Cancelling the caller cancels the coroutine on the background loop.
+        """
+        if self.in_loop():
+            return await coro
+
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return await asyncio.wrap_future(future)
+
+    def submit(self, coro: Awaitable[Any]):
+        """Schedule a coroutine on the background loop without waiting for it"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the loop and join its thread. Must not be called from the loop itself."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop, self._thread = None, None
+
+        if loop is None or loop.is_closed():
+            return
+
+        loop.call_soon_threadsafe(loop.stop)
+        if thread is not None:
+            thread.join(timeout)
+        if not loop.is_running():
+            loop.close()
+
+
+class CrossLoopQueue:
+    """
+    Queue carrying items from a producer on another event loop (usually the
+    background loop) or a worker thread to a consumer on the loop that
+    created it.
+
+    put() and put_blocking() wait for space, so a bounded queue throttles
+    the producer to the consumer's pace. emit() never waits and is for
+    unbounded queues fed from plain callbacks. Once the consumer has called
+    close() or its loop is gone, puts return False and the producer
+    should stop.
+
+    Usage (consumer side):
+        queue = CrossLoopQueue(maxsize=16)
+        future = background.submit(produce(queue))
+        try:
+            item = await queue.get()
+            ...
+        finally:
+            queue.close()
+            future.cancel()
+    """
+
+    def __init__(self, maxsize: int = 0):
+        self.loop = asyncio.get_running_loop()
+        self.closed = False
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize)
+
+    def emit(self, item: Any):
+        """Hand over an item without waiting (unbounded queues only)"""
+        if self.closed:
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._queue.put_nowait, item)
+        except RuntimeError:
+            pass  # Consumer's loop is gone; nobody is listening any more
+
+    async def put(self, item: Any) -> bool:
+        """Hand over an item from another event loop, waiting for space"""
+        if self.closed:
+            return False
+        if asyncio.get_running_loop() is self.loop:
+            await self._queue.put(item)
+            return True
+
+        try:
+            future = asyncio.run_coroutine_threadsafe(self._queue.put(item), self.loop)
+        except RuntimeError:
+            return False
+        await asyncio.wrap_future(future)
+        return not self.closed
+
+    def put_blocking(self, item: Any) -> bool:
+        """Hand over an item from a worker thread, blocking it until there is space"""
+        if self.closed:
+            return False
+
+        try:
+            asyncio.run_coroutine_threadsafe(self._queue.put(item), self.loop).result()
+        except (RuntimeError, concurrent.futures.CancelledError):
+            return False
+        return not self.closed
+
+    async def get(self, timeout: Optional[float] = None) -> Any:
+        """Next item; raises asyncio.TimeoutError after `timeout` seconds"""
+        if timeout is None:
+            return await self._queue.get()
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+    def close(self):
+        """Stop accepting items and release a producer waiting for space (consumer loop only)"""
+        self.closed = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
@@ -0,0 +1,109 @@
+import threading
+import time
+from typing import Dict, Any, Optional
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker.
+
+    closed:    calls flow normally; consecutive failures are counted
+    open:      after `failure_threshold` consecutive failures calls are rejected
+               immediately for `recovery_timeout` seconds
+    half_open: after the timeout a limited number of trial calls are let
+               through; a success closes the breaker, a failure re-opens it
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 3,
+        recovery_timeout: float = 30.0,
+        half_open_max_calls: int = 1
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._half_open_calls = 0
+        self._half_open_started: Optional[float] = None
+        self._last_error: Optional[str] = None
+        self._times_opened = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._half_open_calls = 0
+            self._half_open_started = time.monotonic()
+
+    def allow_request(self) -> bool:
+        """Return True if a call may be sent to the endpoint now"""
+        with self._lock:
+            self._maybe_half_open()
+
+            if self._state == self.CLOSED:
+                return True
+
+            if self._state == self.HALF_OPEN:
+                # A trial call that never reported back (e.g. cancelled) must not wedge the breaker
+                if time.monotonic() - self._half_open_started >= self.recovery_timeout:
+                    self._half_open_calls = 0
+                    self._half_open_started = time.monotonic()
+
+                if self._half_open_calls < self.half_open_max_calls:
+                    self._half_open_calls += 1
+                    return True
+
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._last_error = None
+
+    def record_failure(self, error: Optional[str] = None):
+        with self._lock:
+            self._consecutive_failures += 1
+            self._last_error = error
+
+            if self._state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._times_opened += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Breaker state for monitoring and routing decisions"""
+        with self._lock:
+            self._maybe_half_open()
+            retry_in = 0.0
+            if self._state == self.OPEN:
+                retry_in = max(self.recovery_timeout - (time.monotonic() - self._opened_at), 0.0)
+
+            return {
+                'endpoint': self.name,
+                'state': self._state,
+                'available': self._state != self.OPEN,
+                'consecutive_failures': self._consecutive_failures,
+                'failure_threshold': self.failure_threshold,
+                'retry_in_seconds': round(retry_in, 3),
+                'times_opened': self._times_opened,
+                'last_error': self._last_error
+            }
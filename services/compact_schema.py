@@ -0,0 +1,119 @@
+import json
+from typing import Dict, List, Any, Optional, Tuple
+
+
+# Positional columns shared by every agent's compact rows
+BASE_FIELDS = ['source_table', 'source_column', 'transformation_rule', 'target_field', 'array_field']
+
+# Short codes for ValidationAgent's sources_used
+SOURCE_CODES = {'c': 'code_analysis', 'l': 'legacy', 'm': 'merged'}
+
+
+def decode_sources(value: Any) -> List[str]:
+    """Expand a sources code string such as 'cl' into ['code_analysis', 'legacy']"""
+    if isinstance(value, list):
+        return value
+    return [SOURCE_CODES[code] for code in str(value or '') if code in SOURCE_CODES]
+
+
+class CompactSchema:
+    """
+    Opt-in compact response contract for mapping lists.
+
+    Instead of one verbose JSON object per mapping, the model returns each
+    mapping as a positional array under a one-letter key:
+
+        [source_table, source_column, transformation_rule, target_field,
+         array_field, confidence 0-100, needs_review 0/1, <extra fields>, note]
+
+    The free-text note is only written for rows flagged for review, which
+    removes most of the output tokens. decode_item() expands rows back into
+    the verbose dict shape, so code downstream of the agents is unchanged.
+    """
+
+    def __init__(
+        self,
+        arrays: Dict[str, str],
+        note_field: str,
+        extra_fields: Optional[List[Tuple[str, str]]] = None,
+        field_decoders: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Args:
+            arrays: Compact key -> verbose array key, e.g. {'m': 'mappings'}
+            note_field: Verbose name of the free-text note ('reasoning', ...)
+            extra_fields: (field, description) pairs placed before the note
+            field_decoders: field -> callable converting the compact value
+        """
+        self.arrays = arrays
+        self.note_field = note_field
+        self.extra_fields = extra_fields or []
+        self.field_decoders = field_decoders or {}
+
+    @property
+    def parser_keys(self) -> List[str]:
+        """Top-level keys for IncrementalJSONParser (compact and verbose, in case the model ignores the contract)"""
+        return list(self.arrays) + list(self.arrays.values())
+
+    def output_format(self) -> str:
+        """Prompt instructions describing the compact contract"""
+        columns = BASE_FIELDS + ['confidence_0_to_100', 'needs_review_0_or_1']
+        columns += [name for name, _ in self.extra_fields]
+        columns.append(f"{self.note_field}_only_if_needs_review")
+
+        arrays = ', '.join(f'"{key}": [[row], ...]' for key in self.arrays)
+        described = '; '.join(f'"{key}" = {name}' for key, name in self.arrays.items())
+        extras = ''.join(f"\n- {name}: {description}" for name, description in self.extra_fields)
+        example = json.dumps(
+            ['provider_drname', 'dr_fname', 'dr_fname', 'name_first_name', '', 95, 0]
+            + ['' for _ in self.extra_fields]
+        )
+
+        return (
+            f"REQUIRED OUTPUT FORMAT (compact; JSON only, no other keys, no prose):\n"
+            f"{{{arrays}}}\n"
+            f"Arrays: {described}.\n"
+            f"Each row is a JSON array with exactly these positions: [{', '.join(columns)}]\n"
+            f"- Use \"\" for unknown or empty values.\n"
+            f"- Write the short {self.note_field} ONLY when needs_review is 1; otherwise end the row after the last field before it."
+            f"{extras}\n"
+            f"Example row: {example}"
+        )
+
+    def decode_row(self, row: Any) -> Dict[str, Any]:
+        """Expand one positional row into the verbose mapping dict"""
+        if isinstance(row, dict):
+            return row  # model answered in the verbose shape
+
+        values = list(row) if isinstance(row, (list, tuple)) else [row]
+        mapping = {}
+
+        for index, field in enumerate(BASE_FIELDS):
+            value = values[index] if index < len(values) else ''
+            mapping[field] = '' if value is None else value
+
+        confidence = values[5] if len(values) > 5 else None
+        try:
+            confidence = float(confidence)
+            # The contract asks for an integer percentage, so 1 means 0.01
+            mapping['confidence_score'] = round(min(max(confidence / 100.0, 0.0), 1.0), 3)
+        except (TypeError, ValueError):
+            mapping['confidence_score'] = 0.5
+
+        needs_review = values[6] if len(values) > 6 else 1
+        mapping['needs_review'] = str(needs_review).lower() in ('1', 'true')
+
+        position = 7
+        for name, _ in self.extra_fields:
+            value = values[position] if position < len(values) else ''
+            decoder = self.field_decoders.get(name)
+            mapping[name] = decoder(value) if decoder else value
+            position += 1
+
+        mapping[self.note_field] = str(values[position]) if position < len(values) else ''
+
+        return mapping
+
+    def decode_item(self, key: str, item: Any) -> Tuple[str, Dict[str, Any]]:
+        """Map a parsed (key, element) pair back to (verbose_key, mapping dict)"""
+        return self.arrays.get(key, key), self.decode_row(item)
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import time
+from typing import Dict, Any, Optional, Union, List, Tuple
+from services.sqlite_store import SQLiteStore
+
+
+# Bump when an agent's output format or prompts change, so stored analysis
+# artifacts from older code are no longer reused
+ARTIFACT_VERSION = 1
+
+
+def git_blob_sha(content: Union[str, bytes]) -> str:
+    """
+    Git blob SHA-1 of a file's content: the `id` GitLab reports for it in
+    repository trees and the X-Gitlab-Blob-Id header
+    """
+    data = content.encode('utf-8') if isinstance(content, str) else content
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+class ContentStore(SQLiteStore):
+    """
+    Content-addressable local store keyed by git blob SHA.
+
+    Holds notebook text and the analysis artifacts derived from it
+    (per-agent results, final session results). The
+    blob SHA changes whenever the notebook does and never otherwise, so a
+    notebook whose SHA is already in the store is neither downloaded nor
+    analyzed again, whatever branch or path it is found under. Stored in a
+    local SQLite file, bounded by total size with least-recently-used
+    eviction; evicting a blob also drops its artifacts.
+    """
+
+    FILENAME = 'content.sqlite3'
+    SCHEMA = [
+        '''
+        CREATE TABLE IF NOT EXISTS blobs (
+            sha TEXT PRIMARY KEY,
+            content TEXT NOT NULL,
+            has_content INTEGER NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            stored_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS artifacts (
+            sha TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            stored_at REAL NOT NULL,
+            PRIMARY KEY (sha, kind)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_blobs_last_access ON blobs (last_access)'
+    ]
+    TABLES = ['artifacts', 'blobs']
+    LRU_TABLE = 'blobs'
+    LRU_KEY = 'sha'
+
+    def __init__(self, cache_dir: str = '.content_store', max_size_bytes: int = 256 * 1024 * 1024):
+        super().__init__(cache_dir, max_size_bytes)
+
+        self.blob_hits = 0
+        self.blob_misses = 0
+        self.artifact_hits = 0
+        self.artifact_misses = 0
+        self.writes = 0
+
+    def has_blob(self, sha: str) -> bool:
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM blobs WHERE sha = ? AND has_content = 1', (sha,)).fetchone() is not None
+
+    def get_blob(self, sha: str) -> Optional[str]:
+        """Return the stored text of a blob, or None"""
+        with self._lock:
+            row = self._conn.execute('SELECT content FROM blobs WHERE sha = ? AND has_content = 1', (sha,)).fetchone()
+
+            if row is None:
+                self.blob_misses += 1
+                return None
+
+            self._conn.execute('UPDATE blobs SET last_access = ? WHERE sha = ?', (time.time(), sha))
+            self.blob_hits += 1
+            return row[0]
+
+    def put_blob(self, content: str, sha: Optional[str] = None) -> str:
+        """
+        Store notebook text
+
+        Args:
+            content: The text
+            sha: Blob SHA reported by GitLab (computed from the content if omitted)
+
+        Returns:
+            The blob SHA the text is stored under
+        """
+        sha = sha or git_blob_sha(content)
+        size_bytes = len(content.encode('utf-8'))
+        if size_bytes > self.max_size_bytes:
+            return sha
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO blobs (sha, content, has_content, size_bytes, stored_at, last_access) '
+                'VALUES (?, ?, 1, ?, ?, ?)',
+                (sha, content, size_bytes, now, now)
+            )
+            self.writes += 1
+            self._evict_locked()
+
+        return sha
+
+    def get_artifact(self, sha: str, kind: str) -> Optional[Any]:
+        """Return an analysis artifact stored for a blob by the current ARTIFACT_VERSION, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT data FROM artifacts WHERE sha = ? AND kind = ? AND version = ?',
+                (sha, kind, ARTIFACT_VERSION)
+            ).fetchone()
+
+            if row is None:
+                self.artifact_misses += 1
+                return None
+
+            self._conn.execute('UPDATE blobs SET last_access = ? WHERE sha = ?', (time.time(), sha))
+            self.artifact_hits += 1
+
+        return json.loads(row[0])
+
+    def put_artifact(self, sha: str, kind: str, data: Any):
+        """
+        Store a JSON-serializable analysis artifact for a blob
+
+        Artifacts live as long as their blob; the blob is registered (without
+        text) if it is not stored yet, so it can be evicted with them.
+        """
+        encoded = json.dumps(data, default=str)
+        size_bytes = len(encoded.encode('utf-8'))
+        if size_bytes > self.max_size_bytes:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR IGNORE INTO blobs (sha, content, has_content, size_bytes, stored_at, last_access) '
+                "VALUES (?, '', 0, 0, ?, ?)",
+                (sha, now, now)
+            )
+            self._conn.execute(
+                'INSERT OR REPLACE INTO artifacts (sha, kind, version, data, size_bytes, stored_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (sha, kind, ARTIFACT_VERSION, encoded, size_bytes, now)
+            )
+            self.writes += 1
+            self._evict_locked()
+
+    def _total_size_locked(self) -> int:
+        blobs = self._conn.execute('SELECT COALESCE(SUM(size_bytes), 0) FROM blobs').fetchone()[0]
+        artifacts = self._conn.execute('SELECT COALESCE(SUM(size_bytes), 0) FROM artifacts').fetchone()[0]
+        return blobs + artifacts
+
+    def _lru_entries_locked(self) -> List[Tuple[str, int]]:
+        # A blob is evicted together with its artifacts
+        return self._conn.execute(
+            'SELECT b.sha, b.size_bytes + COALESCE((SELECT SUM(a.size_bytes) FROM artifacts a WHERE a.sha = b.sha), 0) '
+            'FROM blobs b ORDER BY b.last_access ASC'
+        ).fetchall()
+
+    def _delete_entry_locked(self, sha: str):
+        self._conn.execute('DELETE FROM artifacts WHERE sha = ?', (sha,))
+        self._conn.execute('DELETE FROM blobs WHERE sha = ?', (sha,))
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current store occupancy"""
+        with self._lock:
+            blobs = self._conn.execute('SELECT COUNT(*) FROM blobs WHERE has_content = 1').fetchone()[0]
+            artifacts = self._conn.execute('SELECT COUNT(*) FROM artifacts').fetchone()[0]
+            size_bytes = self._total_size_locked()
+
+        return {
+            'blob_hits': self.blob_hits,
+            'blob_misses': self.blob_misses,
+            'artifact_hits': self.artifact_hits,
+            'artifact_misses': self.artifact_misses,
+            'writes': self.writes,
+            'evictions': self.evictions,
+            'blobs': blobs,
+            'artifacts': artifacts,
+            'size_bytes': size_bytes,
+            'max_size_bytes': self.max_size_bytes
+        }
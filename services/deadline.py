@@ -0,0 +1,87 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Iterator
+
+
+# Innermost active deadline for the current task (inherited by child tasks)
+_current_deadline: ContextVar[Optional['Deadline']] = ContextVar('workflow_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when work is started or waited on after the active deadline has passed"""
+
+
+class Deadline:
+    """
+    Absolute point in time by which a workflow (or one stage of it) must finish
+    """
+
+    def __init__(self, seconds: float):
+        self.budget_seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """Seconds left (never negative)"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def timeout(self, default: float) -> float:
+        """Per-call timeout: the default, capped by the time left"""
+        return min(default, self.remaining())
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[Optional[Deadline]]:
+    """
+    Bound the work done inside the block to `seconds` from now
+
+    A nested scope can only shorten the enclosing deadline, never extend it.
+    `None` keeps the enclosing deadline (if any) unchanged.
+    """
+    outer = _current_deadline.get()
+    if seconds is None:
+        yield outer
+        return
+
+    deadline = Deadline(seconds)
+    if outer is not None and outer.expires_at < deadline.expires_at:
+        deadline = outer
+
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """The innermost active deadline, if any"""
+    return _current_deadline.get()
+
+
+def deadline_expired() -> bool:
+    """True if a deadline is active and has passed"""
+    deadline = _current_deadline.get()
+    return deadline is not None and deadline.expired
+
+
+def call_timeout(default: float) -> float:
+    """
+    Timeout for one outbound call under the active deadline
+
+    Returns:
+        `default` without a deadline, otherwise `default` capped by the time left
+
+    Raises:
+        DeadlineExceeded: if the deadline has already passed
+    """
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return default
+    if deadline.expired:
+        raise DeadlineExceeded(f"Workflow deadline of {deadline.budget_seconds:g}s exceeded")
+    return deadline.timeout(default)
@@ -0,0 +1,168 @@
+import asyncio
+import threading
+import time
+from typing import Dict, Any, List, Optional
+from services.latency_tracker import LatencyTracker
+
+
+class EndpointWarmer:
+    """
+    Keeps the LLM serving endpoints warm.
+
+    Serving endpoints scale down when idle, so the first call after a quiet
+    period pays a cold start. The warmer sends a one-token probe to any
+    endpoint that has been idle for `interval_seconds` (keep-alive), and
+    warm_up() sends one immediately, e.g. when a mapping session starts, so
+    the endpoint is scaling up while the notebook is fetched and parsed.
+
+    Calls made while an endpoint has been idle longer than
+    `cold_after_seconds` are recorded as cold, the rest as warm, so the
+    cost of cold starts shows up in the metrics.
+    """
+
+    def __init__(
+        self,
+        llm_service,
+        interval_seconds: float = 0.0,
+        cold_after_seconds: float = 900.0,
+        probe_prompt: str = 'ping'
+    ):
+        """
+        Args:
+            llm_service: LLMService whose endpoints are kept warm
+            interval_seconds: Probe endpoints idle this long (0 = no schedule)
+            cold_after_seconds: Idle time after which an endpoint counts as cold
+            probe_prompt: Prompt sent by probes (answered with max_tokens=1)
+        """
+        self.llm_service = llm_service
+        self.interval_seconds = interval_seconds
+        self.cold_after_seconds = cold_after_seconds
+        self.probe_prompt = probe_prompt
+
+        models = list(llm_service.endpoints)
+        self._last_activity: Dict[str, Optional[float]] = {model: None for model in models}
+        self._probing = set()
+        self.call_latency = {
+            'warm': {model: LatencyTracker() for model in models},
+            'cold': {model: LatencyTracker() for model in models}
+        }
+        self.probe_latency = {model: LatencyTracker() for model in models}
+        self._stats = {'probes_sent': 0, 'probes_failed': 0, 'warmups_requested': 0, 'warmups_skipped': 0}
+        self._schedule = None
+        self._lock = threading.Lock()
+
+    def idle_seconds(self, model: str) -> Optional[float]:
+        """Seconds since the endpoint last answered, or None if it never has"""
+        last = self._last_activity.get(model)
+        return None if last is None else time.monotonic() - last
+
+    def is_cold(self, model: str) -> bool:
+        idle = self.idle_seconds(model)
+        return idle is None or idle >= self.cold_after_seconds
+
+    def mark_active(self, model: str):
+        self._last_activity[model] = time.monotonic()
+
+    def record_call(self, model: str, seconds: float, cold: bool):
+        """Record an upstream call; `cold` is is_cold() taken before the call was sent"""
+        self.call_latency['cold' if cold else 'warm'][model].record(seconds)
+        self.mark_active(model)
+
+    async def probe(self, model: str) -> bool:
+        """Send one keep-alive probe (service loop only); True if the endpoint answered"""
+        service = self.llm_service
+        payload = service._build_payload(model, self.probe_prompt, None, 1)
+        started = time.perf_counter()
+
+        try:
+            response_data = await service._post(model, payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            with self._lock:
+                self._stats['probes_failed'] += 1
+            print(f"Warm-up probe to {service.display_names[model]} failed: {str(e)}")
+            return False
+        finally:
+            with self._lock:
+                self._stats['probes_sent'] += 1
+                self._probing.discard(model)
+
+        self.probe_latency[model].record(time.perf_counter() - started)
+        service.usage_tracker.record(model, response_data.get('usage'), time.perf_counter() - started,
+                                     prompt_chars=len(self.probe_prompt))
+        self.mark_active(model)
+        return True
+
+    def warm_up(self, models: Optional[List[str]] = None, force: bool = False) -> List[str]:
+        """
+        Probe cold endpoints now without waiting for the answer
+
+        Args:
+            models: Endpoints to warm (default: all)
+            force: Probe even endpoints that are still warm
+
+        Returns:
+            The models a probe was sent to
+        """
+        started = []
+
+        for model in models or list(self._last_activity):
+            with self._lock:
+                self._stats['warmups_requested'] += 1
+                if model in self._probing or not (force or self.is_cold(model)):
+                    self._stats['warmups_skipped'] += 1
+                    continue
+                self._probing.add(model)
+
+            self.llm_service._service_loop.submit(self.probe(model))
+            started.append(model)
+
+        return started
+
+    async def _run_schedule(self):
+        while True:
+            for model in list(self._last_activity):
+                idle = self.idle_seconds(model)
+                if (idle is None or idle >= self.interval_seconds) and self.llm_service.is_endpoint_available(model):
+                    with self._lock:
+                        if model in self._probing:
+                            continue
+                        self._probing.add(model)
+                    await self.probe(model)
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        """Start the keep-alive schedule on the service loop (no-op without an interval)"""
+        if self.interval_seconds <= 0 or (self._schedule is not None and not self._schedule.done()):
+            return
+        self._schedule = self.llm_service._service_loop.submit(self._run_schedule())
+
+    def stop(self):
+        if self._schedule is not None:
+            self._schedule.cancel()
+            self._schedule = None
+
+    def metrics(self) -> Dict[str, Any]:
+        """Warm vs cold call latency, probe latency and counters per endpoint"""
+        with self._lock:
+            stats = dict(self._stats)
+
+        endpoints = {}
+        for model in self._last_activity:
+            idle = self.idle_seconds(model)
+            endpoints[model] = {
+                'state': 'cold' if self.is_cold(model) else 'warm',
+                'idle_seconds': round(idle, 1) if idle is not None else None,
+                'warm_calls': self.call_latency['warm'][model].summary(),
+                'cold_calls': self.call_latency['cold'][model].summary(),
+                'probes': self.probe_latency[model].summary()
+            }
+
+        return {
+            'schedule_running': self._schedule is not None and not self._schedule.done(),
+            'interval_seconds': self.interval_seconds,
+            'cold_after_seconds': self.cold_after_seconds,
+            'endpoints': endpoints,
+            **stats
+        }
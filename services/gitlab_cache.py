@@ -0,0 +1,118 @@
+import hashlib
+import json
+import time
+from typing import Dict, Any, Optional
+from services.sqlite_store import SQLiteStore
+
+
+class GitLabFileCache(SQLiteStore):
+    """
+    On-disk cache of GitLab file contents for conditional fetches.
+
+    Each file is stored per (GitLab URL, project, ref, path) together with
+    the ETag and Last-Modified validators GitLab returned for it. The
+    service sends them back as If-None-Match / If-Modified-Since, so an
+    unchanged file costs one 304 round trip instead of a full download.
+    The cache is bounded by total content size with least-recently-used
+    eviction. Contents are never served without revalidation, so access
+    is still checked by GitLab on every fetch.
+    """
+
+    FILENAME = 'files.sqlite3'
+    SCHEMA = [
+        '''
+        CREATE TABLE IF NOT EXISTS files (
+            key TEXT PRIMARY KEY,
+            project_id TEXT NOT NULL,
+            ref TEXT NOT NULL,
+            path TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            content TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            fetched_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_files_last_access ON files (last_access)'
+    ]
+    TABLES = ['files']
+    LRU_TABLE = 'files'
+
+    def __init__(self, cache_dir: str = '.gitlab_cache', max_size_bytes: int = 64 * 1024 * 1024):
+        super().__init__(cache_dir, max_size_bytes)
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    @staticmethod
+    def make_key(gitlab_url: str, project_id: str, ref: str, path: str) -> str:
+        """Hash the coordinates of one file version"""
+        material = json.dumps([gitlab_url.rstrip('/'), str(project_id), ref, path.lstrip('/')], separators=(',', ':'))
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, gitlab_url: str, project_id: str, ref: str, path: str) -> Optional[Dict[str, Any]]:
+        """Return {'content', 'etag', 'last_modified'} for a cached file, or None"""
+        key = self.make_key(gitlab_url, project_id, ref, path)
+
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT content, etag, last_modified FROM files WHERE key = ?', (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute('UPDATE files SET last_access = ? WHERE key = ?', (time.time(), key))
+            self.hits += 1
+            return {'content': row[0], 'etag': row[1], 'last_modified': row[2]}
+
+    def set(
+        self,
+        gitlab_url: str,
+        project_id: str,
+        ref: str,
+        path: str,
+        content: str,
+        etag: Optional[str],
+        last_modified: Optional[str]
+    ):
+        """Store a file with its validators; files without either are not cached"""
+        if not etag and not last_modified:
+            return
+
+        size_bytes = len(content.encode('utf-8'))
+        if size_bytes > self.max_size_bytes:
+            return
+
+        now = time.time()
+        key = self.make_key(gitlab_url, project_id, ref, path)
+
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO files '
+                '(key, project_id, ref, path, etag, last_modified, content, size_bytes, fetched_at, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, str(project_id), ref, path, etag, last_modified, content, size_bytes, now, now)
+            )
+            self.writes += 1
+            self._evict_locked()
+
+    def stats(self) -> Dict[str, Any]:
+        """Lookup counters and current cache occupancy"""
+        with self._lock:
+            entries, size_bytes = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM files'
+            ).fetchone()
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'evictions': self.evictions,
+            'entries': entries,
+            'size_bytes': size_bytes,
+            'max_size_bytes': self.max_size_bytes
+        }
@@ -1,17 +1,215 @@
 import httpx
 import asyncio
 import base64
-from typing import Dict, Any, Optional, List
+import re
+from typing import Dict, Any, Optional, List, AsyncIterator, Tuple
 import os
+import json
+from urllib.parse import quote
+from services.background_loop import BackgroundEventLoop, CrossLoopQueue
+from services.deadline import call_timeout
+from services.gitlab_cache import GitLabFileCache
+from services.traffic_cassette import TrafficCassette
+from services.tar_stream import ChunkPipe, iter_tar_members
+from services.content_store import ContentStore, git_blob_sha
+from services.sync_state import RepositorySyncState
+
+
+# Largest page size GitLab accepts for the repository tree API
+TREE_PAGE_SIZE = 100
+
+# Marks the end of an archive stream handed across event loops
+_ARCHIVE_DONE = object()
+
+# Extracted files waiting for the caller before the archive download pauses
+ARCHIVE_QUEUE_SIZE = 16
+
+
+def glob_to_regex(pattern: str) -> 're.Pattern':
+    """
+    Compile a repository path glob: `*` and `?` match within one directory,
+    `**` matches across directories (`notebooks/**/*.py` also matches
+    `notebooks/load.py`), `[...]` is a character class.
+    """
+    regex = ''
+    i = 0
+    pattern = pattern.lstrip('/')
+    
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif pattern[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            regex += '[^/]'
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 1:]:
+            end = pattern.index(']', i + 1)
+            regex += '[' + pattern[i + 1:end].replace('!', '^', 1) + ']'
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    
+    return re.compile(regex + r'\Z')
+
+
+def common_glob_base(patterns: List[str]) -> str:
+    """Deepest directory containing every match of all patterns ('' for the root)"""
+    bases = []
+    for pattern in patterns:
+        directories = pattern.lstrip('/').split('/')[:-1]
+        static = []
+        for part in directories:
+            if any(char in part for char in '*?['):
+                break
+            static.append(part)
+        bases.append(static)
+    
+    common = []
+    for parts in zip(*bases):
+        if len(set(parts)) != 1:
+            break
+        common.append(parts[0])
+    
+    return '/'.join(common)
 
 
 class GitLabService:
     """
     Service for fetching Databricks notebooks and code from GitLab repositories
+
+    All requests share one pooled client on a background loop, so fetching
+    many files pays the TCP/TLS handshake once. With a GitLabFileCache,
+    files are fetched conditionally (If-None-Match / If-Modified-Since) and
+    an unchanged file costs a 304 round trip instead of a full download.
+    Call aclose() on shutdown.
     """
     
-    def __init__(self):
+    def __init__(
+        self,
+        cassette: Optional[TrafficCassette] = None,
+        content_cache: Optional[GitLabFileCache] = None,
+        max_connections: int = 10,
+        max_keepalive_connections: int = 5,
+        keepalive_expiry: float = 60.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        page_concurrency: int = 4,
+        content_store: Optional[ContentStore] = None,
+        sync_state: Optional[RepositorySyncState] = None
+    ):
+        """
+        Args:
+            cassette: Optional TrafficCassette that records or replays all GitLab traffic
+            content_cache: Optional GitLabFileCache for conditional file fetches
+            max_connections: Connection pool size
+            max_keepalive_connections: Idle connections kept open
+            keepalive_expiry: Seconds an idle connection is kept
+            transport: Transport to send requests through instead of the network
+            page_concurrency: Repository tree pages fetched at the same time
+            content_store: Optional ContentStore; notebooks whose blob SHA is
+                already stored are not downloaded again
+            sync_state: Optional RepositorySyncState remembering the last
+                analyzed commit per project/branch for incremental syncs
+        """
         self.timeout = httpx.Timeout(30.0)
+        self.pool_limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.cassette = cassette
+        self.content_cache = content_cache
+        self.transport = transport
+        self.page_concurrency = page_concurrency
+        self.content_store = content_store
+        self.sync_state = sync_state
+        self.fetch_stats = {
+            'requests': 0, 'not_modified': 0, 'downloads': 0, 'bytes_downloaded': 0, 'bytes_saved': 0, 'tree_pages': 0,
+            'archive_downloads': 0, 'archive_bytes': 0, 'archive_files': 0, 'blob_store_hits': 0,
+            'compares': 0, 'full_scans': 0
+        }
+        
+        # The pooled client lives on a dedicated loop so it survives across Flask requests
+        self._service_loop = BackgroundEventLoop(name='gitlab-service-loop')
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    def _client_timeout(self) -> httpx.Timeout:
+        """Request timeout capped by the active workflow deadline, if any"""
+        return httpx.Timeout(call_timeout(self.timeout.read))
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """
+        Return the pooled client, creating it on first use.
+        Must be called from the service loop.
+        """
+        if self._client is None or self._client.is_closed:
+            transport = self.transport or httpx.AsyncHTTPTransport(limits=self.pool_limits)
+            if self.cassette is not None:
+                transport = self.cassette.transport('gitlab', transport)
+            
+            self._client = httpx.AsyncClient(timeout=self.timeout, transport=transport)
+        
+        return self._client
+    
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        params: Optional[Dict[str, Any]] = None
+    ) -> httpx.Response:
+        """Send a request over the pooled client from any event loop (the body is read before returning)"""
+        timeout = self._client_timeout()
+        
+        async def send():
+            return await self._get_client().request(method, url, headers=headers, params=params, timeout=timeout)
+        
+        return await self._service_loop.run(send())
+    
+    async def aclose(self):
+        """
+        Close the pooled connections and stop the service loop.
+        Safe to call more than once; the client is recreated lazily on the next request.
+        """
+        if not self._service_loop.is_running:
+            return
+        
+        async def close():
+            if self._client is not None:
+                await self._client.aclose()
+                self._client = None
+        
+        await self._service_loop.run(close())
+        self._service_loop.stop()
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """Conditional fetch counters and file cache occupancy"""
+        return {
+            'fetches': dict(self.fetch_stats),
+            'cache': self.content_cache.stats() if self.content_cache is not None else {'enabled': False},
+            'content_store': self.content_store.stats() if self.content_store is not None else {'enabled': False}
+        }
+    
+    @staticmethod
+    def _auth_headers(gitlab_credentials: Dict[str, str]) -> Dict[str, str]:
+        """Authorization header for the credentials' access token or username/password (empty if neither)"""
+        access_token = gitlab_credentials.get('access_token')
+        username = gitlab_credentials.get('username')
+        password = gitlab_credentials.get('password')
+        
+        if access_token:
+            return {'Authorization': f'Bearer {access_token}'}
+        if username and password:
+            # Basic authentication
+            credentials = base64.b64encode(f"{username}:{password}".encode()).decode()
+            return {'Authorization': f'Basic {credentials}'}
+        return {}
     
     async def fetch_notebook_content(
         self, 
@@ -38,20 +236,10 @@ class GitLabService:
             # Extract GitLab connection details
             gitlab_url = gitlab_credentials['gitlab_url']
             project_id = gitlab_credentials['project_id']
-            access_token = gitlab_credentials.get('access_token')
-            username = gitlab_credentials.get('username')
-            password = gitlab_credentials.get('password')
             
             # Prepare headers
-            headers = {}
-            
-            if access_token:
-                headers['Authorization'] = f'Bearer {access_token}'
-            elif username and password:
-                # Basic authentication
-                credentials = base64.b64encode(f"{username}:{password}".encode()).decode()
-                headers['Authorization'] = f'Basic {credentials}'
-            else:
+            headers = self._auth_headers(gitlab_credentials)
+            if not headers:
                 raise ValueError("No valid authentication method provided")
             
             # Construct GitLab API URL for file content
@@ -63,15 +251,59 @@ class GitLabService:
             branch = gitlab_credentials.get('branch', 'main')
             params = {'ref': branch}
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(
-                    api_url,
-                    headers=headers,
-                    params=params
+            # Credentials pinned to a commit (changed_notebooks) fetch at that
+            # SHA but keep their cache entries under the branch name
+            cache_ref = gitlab_credentials.get('cache_ref') or branch
+            
+            # A HEAD on the file metadata gives its blob SHA; a stored blob is not downloaded again
+            if self.content_store is not None:
+                head = await self._request(
+                    'HEAD', f"{gitlab_url}/api/v4/projects/{project_id}/repository/files/{encoded_path}",
+                    headers=headers, params=params
                 )
-                
-                response.raise_for_status()
-                return response.text
+                head.raise_for_status()
+                blob_id = head.headers.get('X-Gitlab-Blob-Id')
+                content = self.content_store.get_blob(blob_id) if blob_id else None
+                if content is not None:
+                    self.fetch_stats['blob_store_hits'] += 1
+                    return content
+            
+            # Revalidate a cached copy instead of downloading it again
+            cached = None
+            if self.content_cache is not None:
+                cached = self.content_cache.get(gitlab_url, project_id, cache_ref, notebook_path)
+            if cached is not None:
+                if cached['etag']:
+                    headers['If-None-Match'] = cached['etag']
+                if cached['last_modified']:
+                    headers['If-Modified-Since'] = cached['last_modified']
+            
+            response = await self._request('GET', api_url, headers=headers, params=params)
+            self.fetch_stats['requests'] += 1
+            
+            if response.status_code == 304 and cached is not None:
+                self.fetch_stats['not_modified'] += 1
+                self.fetch_stats['bytes_saved'] += len(cached['content'].encode('utf-8'))
+                return cached['content']
+            
+            response.raise_for_status()
+            self.fetch_stats['downloads'] += 1
+            self.fetch_stats['bytes_downloaded'] += len(response.content)
+            
+            if self.content_cache is not None:
+                self.content_cache.set(
+                    gitlab_url, project_id, cache_ref, notebook_path, response.text,
+                    etag=response.headers.get('ETag'),
+                    last_modified=response.headers.get('Last-Modified')
+                )
+            
+            if self.content_store is not None:
+                # The SHA of what was downloaded, not the HEAD's: the file may have changed in between
+                self.content_store.put_blob(
+                    response.text, sha=response.headers.get('X-Gitlab-Blob-Id') or git_blob_sha(response.content)
+                )
+            
+            return response.text
                 
         except httpx.HTTPStatusError as e:
             if e.response.status_code == 404:
@@ -82,6 +314,57 @@ class GitLabService:
         except Exception as e:
             raise Exception(f"Failed to fetch notebook from GitLab: {str(e)}")
     
+    async def fetch_blob(self, gitlab_credentials: Dict[str, str], blob_id: str) -> str:
+        """
+        Fetch a file by its blob SHA (the `id` of list_repository_files entries)
+        
+        A blob already in the content store is not downloaded again, but it
+        is only served after a HEAD request confirms that these credentials
+        can read it in this project, as for fetch_notebook_content.
+        
+        Args:
+            gitlab_credentials: GitLab authentication info
+            blob_id: Git blob SHA
+            
+        Returns:
+            String content of the file
+        """
+        try:
+            gitlab_url = gitlab_credentials['gitlab_url']
+            project_id = gitlab_credentials['project_id']
+            
+            headers = self._auth_headers(gitlab_credentials)
+            
+            api_url = f"{gitlab_url}/api/v4/projects/{project_id}/repository/blobs/{blob_id}/raw"
+            
+            if self.content_store is not None and self.content_store.has_blob(blob_id):
+                head = await self._request('HEAD', api_url, headers=headers)
+                head.raise_for_status()
+                content = self.content_store.get_blob(blob_id)
+                if content is not None:
+                    self.fetch_stats['blob_store_hits'] += 1
+                    return content
+            
+            response = await self._request('GET', api_url, headers=headers)
+            self.fetch_stats['requests'] += 1
+            response.raise_for_status()
+            self.fetch_stats['downloads'] += 1
+            self.fetch_stats['bytes_downloaded'] += len(response.content)
+            
+            if self.content_store is not None:
+                self.content_store.put_blob(response.text, sha=blob_id)
+            
+            return response.text
+            
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                raise FileNotFoundError(f"Blob not found: {blob_id}")
+            else:
+                raise Exception(f"GitLab API error {e.response.status_code}: {e.response.text}")
+        
+        except Exception as e:
+            raise Exception(f"Failed to fetch blob from GitLab: {str(e)}")
+    
     async def _fetch_from_local_file(self, file_path: str) -> str:
         """
         Fallback method to fetch from local file system
@@ -129,7 +412,8 @@ class GitLabService:
         self, 
         gitlab_credentials: Dict[str, str],
         path: str = '',
-        file_extension: str = '.py'
+        file_extension: str = '.py',
+        patterns: Optional[List[str]] = None
     ) -> List[Dict[str, Any]]:
         """
         List files in GitLab repository
@@ -138,56 +422,482 @@ class GitLabService:
             gitlab_credentials: GitLab authentication info
             path: Directory path to list (optional)
             file_extension: Filter by file extension (optional)
+            patterns: Path globs to keep, e.g. ['notebooks/**/*.py'] (optional)
             
         Returns:
             List of file information dictionaries
         """
         try:
-            gitlab_url = gitlab_credentials['gitlab_url']
-            project_id = gitlab_credentials['project_id']
-            access_token = gitlab_credentials.get('access_token')
+            return [
+                file_info async for file_info in
+                self.iter_repository_files(gitlab_credentials, path, file_extension, patterns)
+            ]
+                
+        except Exception as e:
+            raise Exception(f"Failed to list repository files: {str(e)}")
+    
+    async def iter_repository_files(
+        self,
+        gitlab_credentials: Dict[str, str],
+        path: str = '',
+        file_extension: str = '.py',
+        patterns: Optional[List[str]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Walk the repository tree page by page, yielding files as pages arrive
+        
+        The first page tells how many pages there are (X-Total-Pages); the
+        rest are fetched concurrently, at most `page_concurrency` at a time,
+        and their files are yielded in completion order. When GitLab leaves
+        the total out (very large trees), the Link rel="next" header is
+        followed page by page instead.
+        
+        Args:
+            gitlab_credentials: GitLab authentication info ('branch' selects the ref)
+            path: Directory path to list (optional; derived from `patterns` if omitted)
+            file_extension: Filter by file extension (optional)
+            patterns: Path globs to keep (`*` and `?` stay within a directory,
+                `**` spans directories)
             
-            headers = {}
-            if access_token:
-                headers['Authorization'] = f'Bearer {access_token}'
+        Yields:
+            File information dictionaries (name, path, id, mode)
+        """
+        gitlab_url = gitlab_credentials['gitlab_url']
+        project_id = gitlab_credentials['project_id']
+        
+        headers = self._auth_headers(gitlab_credentials)
+        
+        # GitLab API endpoint for repository tree
+        api_url = f"{gitlab_url}/api/v4/projects/{project_id}/repository/tree"
+        
+        matchers = [glob_to_regex(pattern) for pattern in patterns or []]
+        if not path and patterns:
+            path = common_glob_base(patterns)
+        
+        params = {
+            'recursive': True,
+            'per_page': TREE_PAGE_SIZE
+        }
+        
+        if path:
+            params['path'] = path
+        if gitlab_credentials.get('branch'):
+            params['ref'] = gitlab_credentials['branch']
+        
+        def select(files_data: List[Dict[str, Any]]):
+            for file_info in files_data:
+                if file_info['type'] != 'blob':  # Only files, not directories
+                    continue
+                if file_extension and not file_info['name'].endswith(file_extension):
+                    continue
+                if matchers and not any(matcher.match(file_info['path']) for matcher in matchers):
+                    continue
+                yield {
+                    'name': file_info['name'],
+                    'path': file_info['path'],
+                    'id': file_info['id'],
+                    'mode': file_info['mode']
+                }
+        
+        first = await self._get_tree_page(api_url, headers, {**params, 'page': 1})
+        for file_info in select(first.json()):
+            yield file_info
+        
+        total_pages = int(first.headers.get('X-Total-Pages') or 0)
+        
+        if total_pages > 1:
+            semaphore = asyncio.Semaphore(self.page_concurrency)
             
-            # GitLab API endpoint for repository tree
-            api_url = f"{gitlab_url}/api/v4/projects/{project_id}/repository/tree"
+            async def fetch(page: int) -> httpx.Response:
+                async with semaphore:
+                    return await self._get_tree_page(api_url, headers, {**params, 'page': page})
             
-            params = {
-                'recursive': True,
-                'per_page': 100
-            }
+            tasks = [asyncio.ensure_future(fetch(page)) for page in range(2, total_pages + 1)]
+            try:
+                for next_page in asyncio.as_completed(tasks):
+                    response = await next_page
+                    for file_info in select(response.json()):
+                        yield file_info
+            finally:
+                # The caller stopped early or a page failed: drop the pages still pending
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        
+        elif not first.headers.get('X-Total-Pages'):
+            next_url = first.links.get('next', {}).get('url')
+            while next_url:
+                response = await self._get_tree_page(next_url, headers)
+                for file_info in select(response.json()):
+                    yield file_info
+                next_url = response.links.get('next', {}).get('url')
+    
+    async def _get_tree_page(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        params: Optional[Dict[str, Any]] = None
+    ) -> httpx.Response:
+        response = await self._request('GET', url, headers=headers, params=params)
+        response.raise_for_status()
+        self.fetch_stats['tree_pages'] += 1
+        return response
+    
+    async def iter_archive_files(
+        self,
+        gitlab_credentials: Dict[str, str],
+        path: str = '',
+        file_extension: str = '.py',
+        patterns: Optional[List[str]] = None
+    ) -> AsyncIterator[Tuple[str, str]]:
+        """
+        Download the repository archive for a ref once and yield matching files
+        
+        The tar.gz archive is streamed and decompressed in memory as it
+        arrives; files are yielded as soon as they are complete and files
+        that do not match are skipped without being buffered. Use this
+        instead of fetch_notebook_content when analyzing many notebooks:
+        one download replaces one round trip per file.
+        
+        Args:
+            gitlab_credentials: GitLab authentication info ('branch' selects the ref)
+            path: Repository subdirectory to download (optional; derived from `patterns` if omitted)
+            file_extension: Filter by file extension (optional)
+            patterns: Path globs to keep, as for iter_repository_files
             
-            if path:
-                params['path'] = path
+        Yields:
+            (path, content) with the path relative to the repository root
+        """
+        matchers = [glob_to_regex(pattern) for pattern in patterns or []]
+        if not path and patterns:
+            path = common_glob_base(patterns)
+        
+        def select(file_path: str) -> bool:
+            if file_extension and not file_path.endswith(file_extension):
+                return False
+            return not matchers or any(matcher.match(file_path) for matcher in matchers)
+        
+        async for file_path, content in self._iter_archive(gitlab_credentials, path, select):
+            yield file_path, content
+    
+    async def _iter_archive(
+        self,
+        gitlab_credentials: Dict[str, str],
+        path: str,
+        select
+    ) -> AsyncIterator[Tuple[str, str]]:
+        """Stream the archive of `path` at the credentials' branch, yielding the files `select` accepts"""
+        gitlab_url = gitlab_credentials['gitlab_url']
+        project_id = gitlab_credentials['project_id']
+        
+        headers = self._auth_headers(gitlab_credentials)
+        
+        api_url = f"{gitlab_url}/api/v4/projects/{project_id}/repository/archive.tar.gz"
+        
+        params = {'sha': gitlab_credentials.get('branch', 'main')}
+        if path:
+            params['path'] = path
+        
+        timeout = self._client_timeout()
+        
+        # The download runs on the service loop and feeds a pipe that a worker
+        # thread reads with tarfile; files are handed back to the caller's loop
+        # through a bounded queue, so a slow caller pauses the download
+        queue = CrossLoopQueue(maxsize=ARCHIVE_QUEUE_SIZE)
+        
+        def extract(pipe: ChunkPipe):
+            try:
+                # Archives start with a '<project>-<ref>-<sha>/' directory
+                for member in iter_tar_members(pipe, select, strip_components=1):
+                    if not queue.put_blocking(member):
+                        return  # Caller stopped reading
+            except Exception:
+                if pipe.complete:
+                    raise
+                # Truncated because the download failed; that error is reported instead
+            finally:
+                pipe.close()
+        
+        async def download():
+            pipe = ChunkPipe()
+            extraction = asyncio.ensure_future(asyncio.to_thread(extract, pipe))
+            compressed_bytes = 0
+            complete = False
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(
-                    api_url,
-                    headers=headers,
-                    params=params
-                )
-                
-                response.raise_for_status()
-                files_data = response.json()
-                
-                # Filter files by extension if specified
-                filtered_files = []
-                for file_info in files_data:
-                    if file_info['type'] == 'blob':  # Only files, not directories
-                        if not file_extension or file_info['name'].endswith(file_extension):
-                            filtered_files.append({
-                                'name': file_info['name'],
-                                'path': file_info['path'],
-                                'id': file_info['id'],
-                                'mode': file_info['mode']
-                            })
-                
-                return filtered_files
+            try:
+                async with self._get_client().stream('GET', api_url, headers=headers, params=params, timeout=timeout) as response:
+                    if response.status_code >= 400:
+                        await response.aread()
+                        response.raise_for_status()
+                    
+                    # Raw bytes: the gzip layer belongs to the archive, not the transfer
+                    async for chunk in response.aiter_raw():
+                        compressed_bytes += len(chunk)
+                        if not pipe.try_write(chunk):
+                            await asyncio.to_thread(pipe.write, chunk)
+                complete = True
+            except BrokenPipeError:
+                complete = True  # The reader stopped early; its error, if any, is raised below
+            finally:
+                pipe.finish(complete)
+            
+            await extraction
+            self.fetch_stats['archive_downloads'] += 1
+            self.fetch_stats['archive_bytes'] += compressed_bytes
+        
+        async def produce():
+            try:
+                await download()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await queue.put(e)
+            else:
+                await queue.put(_ARCHIVE_DONE)
+        
+        future = self._service_loop.submit(produce())
+        
+        try:
+            while True:
+                item = await queue.get()
+                if item is _ARCHIVE_DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
                 
+                file_path, data = item
+                self.fetch_stats['archive_files'] += 1
+                yield file_path, data.decode('utf-8', errors='replace')
+        finally:
+            queue.close()
+            if not future.done():
+                future.cancel()
+    
+    async def fetch_notebooks_bulk(
+        self,
+        gitlab_credentials: Dict[str, str],
+        notebook_paths: List[str]
+    ) -> Dict[str, str]:
+        """
+        Fetch many notebooks with a single archive download
+        
+        Args:
+            gitlab_credentials: GitLab authentication info
+            notebook_paths: Repository paths of the notebooks
+            
+        Returns:
+            Content by path for the notebooks found in the archive
+        """
+        wanted = {notebook_path.lstrip('/') for notebook_path in notebook_paths}
+        if not wanted:
+            return {}
+        
+        try:
+            base = common_glob_base(sorted(wanted))
+            return {
+                file_path: content async for file_path, content in
+                self._iter_archive(gitlab_credentials, base, wanted.__contains__)
+            }
+        
+        except httpx.HTTPStatusError as e:
+            raise Exception(f"GitLab API error {e.response.status_code}: {e.response.text}")
+        
         except Exception as e:
-            raise Exception(f"Failed to list repository files: {str(e)}")
+            raise Exception(f"Failed to download repository archive: {str(e)}")
+    
+    async def get_branch_commit(self, gitlab_credentials: Dict[str, str]) -> str:
+        """
+        SHA of the commit a branch currently points to
+        
+        Args:
+            gitlab_credentials: GitLab authentication info ('branch' selects the branch)
+            
+        Returns:
+            Commit SHA
+        """
+        gitlab_url = gitlab_credentials['gitlab_url']
+        project_id = gitlab_credentials['project_id']
+        branch = gitlab_credentials.get('branch', 'main')
+        
+        headers = self._auth_headers(gitlab_credentials)
+        
+        api_url = f"{gitlab_url}/api/v4/projects/{project_id}/repository/branches/{quote(branch, safe='')}"
+        response = await self._request('GET', api_url, headers=headers)
+        response.raise_for_status()
+        
+        return response.json()['commit']['id']
+    
+    async def compare_commits(self, gitlab_credentials: Dict[str, str], from_sha: str, to_sha: str) -> Dict[str, Any]:
+        """
+        Files changed between two commits (GitLab compare API)
+        
+        The compare is straight: the diff goes from `from_sha` itself to
+        `to_sha`, not from their merge base, so after a force push the
+        files that only existed on the rewritten history show up as deleted.
+        
+        Args:
+            gitlab_credentials: GitLab authentication info
+            from_sha: Older commit
+            to_sha: Newer commit
+            
+        Returns:
+            The compare response: 'diffs' (old_path, new_path, new_file,
+            renamed_file, deleted_file per file), 'commits', 'compare_timeout'
+        """
+        gitlab_url = gitlab_credentials['gitlab_url']
+        project_id = gitlab_credentials['project_id']
+        
+        headers = self._auth_headers(gitlab_credentials)
+        
+        api_url = f"{gitlab_url}/api/v4/projects/{project_id}/repository/compare"
+        response = await self._request('GET', api_url, headers=headers, params={'from': from_sha, 'to': to_sha, 'straight': 'true'})
+        response.raise_for_status()
+        self.fetch_stats['compares'] += 1
+        
+        return response.json()
+    
+    async def changed_notebooks(
+        self,
+        gitlab_credentials: Dict[str, str],
+        path: str = '',
+        file_extension: str = '.py',
+        patterns: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """
+        Notebooks added, modified or deleted on a branch since its last recorded sync
+        
+        The branch head is compared with the last analyzed commit, so only
+        the notebooks that changed in between are returned and nightly cost
+        scales with churn rather than repository size. The compare is
+        straight from the last analyzed commit, so after a force push the
+        notebooks that only existed on the old history are reported as
+        deleted. The first sync of a scope, or one whose previous commit
+        can no longer be compared (garbage-collected after a rewrite,
+        compare timed out), lists the whole tree instead. Nothing is
+        recorded here: call record_sync once the changed notebooks have
+        been analyzed, so a failed run is retried.
+        
+        Args:
+            gitlab_credentials: GitLab authentication info ('branch' selects the branch)
+            path: Directory to sync (optional; derived from `patterns` if omitted)
+            file_extension: Filter by file extension (optional)
+            patterns: Path globs to keep, as for iter_repository_files
+            
+        Returns:
+            Dict with 'changed' and 'deleted' paths, 'from_commit'/'to_commit',
+            'full_scan', and 'gitlab_credentials' pinned to 'to_commit' (fetch
+            the changed notebooks with these, so a push during the run is not
+            mixed in; their 'cache_ref' keeps the branch as the file cache key,
+            so cached copies are revalidated rather than fetched anew per commit)
+        """
+        try:
+            gitlab_url, project_id = self._repository_key(gitlab_credentials)
+            branch = gitlab_credentials.get('branch', 'main')
+            scope = json.dumps([path.strip('/'), file_extension, sorted(patterns or [])])
+            
+            to_commit = await self.get_branch_commit(gitlab_credentials)
+            pinned_credentials = {**gitlab_credentials, 'branch': to_commit, 'cache_ref': branch}
+            
+            previous = None
+            if self.sync_state is not None:
+                previous = self.sync_state.get(gitlab_url, project_id, branch, scope)
+            from_commit = previous['commit_sha'] if previous else None
+            
+            changes = {
+                'branch': branch,
+                'scope': scope,
+                'from_commit': from_commit,
+                'to_commit': to_commit,
+                'full_scan': False,
+                'changed': [],
+                'deleted': [],
+                'gitlab_credentials': pinned_credentials
+            }
+            
+            if from_commit == to_commit:
+                changes['paths'] = previous['paths']
+                return changes
+            
+            compared = None
+            if from_commit is not None:
+                compared = await self._compare_since(gitlab_credentials, from_commit, to_commit)
+            
+            if compared is None:
+                self.fetch_stats['full_scans'] += 1
+                current = [
+                    file_info['path'] async for file_info in
+                    self.iter_repository_files(pinned_credentials, path, file_extension, patterns)
+                ]
+                changes['full_scan'] = True
+                changes['changed'] = sorted(current)
+                changes['deleted'] = sorted(set(previous['paths']) - set(current)) if previous else []
+                changes['paths'] = sorted(current)
+                return changes
+            
+            matchers = [glob_to_regex(pattern) for pattern in patterns or []]
+            prefix = path.strip('/') + '/' if path.strip('/') else ''
+            
+            def select(file_path: str) -> bool:
+                if prefix and not file_path.startswith(prefix):
+                    return False
+                if file_extension and not file_path.endswith(file_extension):
+                    return False
+                return not matchers or any(matcher.match(file_path) for matcher in matchers)
+            
+            changed, deleted = set(), set()
+            for diff in compared.get('diffs', []):
+                if (diff.get('deleted_file') or diff.get('renamed_file')) and select(diff['old_path']):
+                    deleted.add(diff['old_path'])
+                if not diff.get('deleted_file') and select(diff['new_path']):
+                    changed.add(diff['new_path'])
+            deleted -= changed
+            
+            changes['changed'] = sorted(changed)
+            changes['deleted'] = sorted(deleted)
+            changes['paths'] = sorted((set(previous['paths']) - deleted) | changed)
+            return changes
+            
+        except httpx.HTTPStatusError as e:
+            raise Exception(f"GitLab API error {e.response.status_code}: {e.response.text}")
+        
+        except Exception as e:
+            raise Exception(f"Failed to compute repository changes: {str(e)}")
+    
+    async def _compare_since(
+        self,
+        gitlab_credentials: Dict[str, str],
+        from_commit: str,
+        to_commit: str
+    ) -> Optional[Dict[str, Any]]:
+        """compare_commits, or None when the old commit cannot be compared and a full scan is needed"""
+        try:
+            compared = await self.compare_commits(gitlab_credentials, from_commit, to_commit)
+        except httpx.HTTPStatusError as e:
+            print(f"Cannot compare {from_commit[:12]}..{to_commit[:12]} ({e.response.status_code}), rescanning")
+            return None
+        
+        if compared.get('compare_timeout'):
+            print(f"Compare {from_commit[:12]}..{to_commit[:12]} timed out, rescanning")
+            return None
+        
+        return compared
+    
+    def _repository_key(self, gitlab_credentials: Dict[str, str]) -> Tuple[str, str]:
+        """(location, project) identifying the repository in the sync state"""
+        return gitlab_credentials['gitlab_url'], str(gitlab_credentials['project_id'])
+    
+    def record_sync(self, gitlab_credentials: Dict[str, str], changes: Dict[str, Any]):
+        """
+        Remember that the notebooks in `changes` (from changed_notebooks) have
+        been analyzed, so the next sync starts from its 'to_commit'
+        """
+        if self.sync_state is None:
+            return
+        
+        location, project_id = self._repository_key(gitlab_credentials)
+        self.sync_state.set(
+            location, project_id, changes['branch'], changes['scope'], changes['to_commit'], changes['paths']
+        )
     
     async def validate_credentials(self, gitlab_credentials: Dict[str, str]) -> Dict[str, Any]:
         """
@@ -202,28 +912,24 @@ class GitLabService:
         try:
             gitlab_url = gitlab_credentials['gitlab_url']
             project_id = gitlab_credentials['project_id']
-            access_token = gitlab_credentials.get('access_token')
             
-            headers = {}
-            if access_token:
-                headers['Authorization'] = f'Bearer {access_token}'
+            headers = self._auth_headers(gitlab_credentials)
             
             # Test connection by getting project info
             api_url = f"{gitlab_url}/api/v4/projects/{project_id}"
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(api_url, headers=headers)
-                response.raise_for_status()
-                
-                project_info = response.json()
-                
-                return {
-                    'valid': True,
-                    'project_name': project_info.get('name', 'Unknown'),
-                    'project_description': project_info.get('description', ''),
-                    'default_branch': project_info.get('default_branch', 'main'),
-                    'web_url': project_info.get('web_url', '')
-                }
+            response = await self._request('GET', api_url, headers=headers)
+            response.raise_for_status()
+            
+            project_info = response.json()
+            
+            return {
+                'valid': True,
+                'project_name': project_info.get('name', 'Unknown'),
+                'project_description': project_info.get('description', ''),
+                'default_branch': project_info.get('default_branch', 'main'),
+                'web_url': project_info.get('web_url', '')
+            }
                 
         except httpx.HTTPStatusError as e:
             if e.response.status_code == 401:
@@ -0,0 +1,179 @@
+import json
+from typing import Any, Iterable, List, Optional, Tuple
+
+
+class IncrementalJSONParser:
+    """
+    Incremental parser for streamed LLM JSON responses.
+
+    Feed it text chunks as they arrive; it returns each element of the
+    watched top-level arrays (e.g. "mappings") as soon as that element is
+    complete, without buffering the whole document. Leading prose or
+    markdown fences before the first '{' are ignored.
+
+    Usage:
+        parser = IncrementalJSONParser(['mappings'])
+        for chunk in chunks:
+            for key, mapping in parser.feed(chunk):
+                ...
+        parser.close()  # raises ValueError if the document was truncated
+    """
+
+    def __init__(self, keys: Iterable[str]):
+        self.keys = set(keys)
+        self.seen_keys = set()
+        self.items_parsed = 0
+
+        self._started = False
+        self._finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+        # Top-level key tracking (depth 1 only)
+        self._string_chars: List[str] = []
+        self._last_string: Optional[str] = None
+        self._pending_key: Optional[str] = None
+
+        # Element capture inside a watched array (array sits at depth 2)
+        self._capture_key: Optional[str] = None
+        self._element: List[str] = []
+
+    @property
+    def finished(self) -> bool:
+        """True once the top-level JSON object has been closed"""
+        return self._finished
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consume a chunk and return (key, element) pairs completed by it"""
+        completed = []
+
+        for char in chunk:
+            if self._finished:
+                break
+
+            if not self._started:
+                if char == '{':
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            capturing = self._capture_key is not None and self._depth >= 2
+
+            if self._in_string:
+                if capturing:
+                    self._element.append(char)
+                elif self._depth == 1:
+                    self._string_chars.append(char)
+
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        # Drop the closing quote; json.loads handles escapes
+                        self._last_string = json.loads('"' + ''.join(self._string_chars[:-1]) + '"')
+                        self._string_chars = []
+                continue
+
+            if char == '"':
+                self._in_string = True
+                if capturing:
+                    self._element.append(char)
+                elif self._depth == 1:
+                    self._string_chars = []
+                    self._pending_key = None
+                continue
+
+            if char.isspace():
+                if capturing and self._element:
+                    self._element.append(char)
+                continue
+
+            if self._depth == 1:
+                completed.extend(self._handle_top_level(char))
+                continue
+
+            if capturing:
+                completed.extend(self._handle_capture(char))
+                continue
+
+            # Structure we are not watching: only track nesting
+            if char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+
+        return completed
+
+    def _handle_top_level(self, char: str) -> List[Tuple[str, Any]]:
+        if char == ':':
+            self._pending_key = self._last_string
+        elif char == '[':
+            self._depth += 1
+            if self._pending_key in self.keys:
+                self._capture_key = self._pending_key
+                self.seen_keys.add(self._pending_key)
+            self._pending_key = None
+        elif char == '{':
+            self._depth += 1
+            self._pending_key = None
+        elif char == '}':
+            self._depth = 0
+            self._finished = True
+        else:
+            self._pending_key = None
+        return []
+
+    def _handle_capture(self, char: str) -> List[Tuple[str, Any]]:
+        completed = []
+
+        if self._depth == 2:
+            # Between elements of the watched array
+            if char == ']':
+                completed.extend(self._emit_element())
+                self._depth = 1
+                self._capture_key = None
+            elif char == ',':
+                completed.extend(self._emit_element())
+            else:
+                self._element.append(char)
+                if char in '{[':
+                    self._depth += 1
+            return completed
+
+        # Inside an element
+        self._element.append(char)
+        if char in '{[':
+            self._depth += 1
+        elif char in '}]':
+            self._depth -= 1
+            if self._depth == 2:
+                completed.extend(self._emit_element())
+        return completed
+
+    def _emit_element(self) -> List[Tuple[str, Any]]:
+        text = ''.join(self._element).strip()
+        self._element = []
+        if not text:
+            return []
+
+        self.items_parsed += 1
+        return [(self._capture_key, json.loads(text))]
+
+    def close(self):
+        """Raise ValueError if the stream ended before the JSON document was complete"""
+        if not self._started:
+            raise ValueError("No JSON object found in LLM response")
+        if not self._finished:
+            raise ValueError("LLM response ended before the JSON document was complete")
+
+    @staticmethod
+    def parse_all(text: str, keys: Iterable[str]) -> List[Tuple[str, Any]]:
+        """Parse a complete response in one go (used for cached/non-streamed responses)"""
+        parser = IncrementalJSONParser(keys)
+        items = parser.feed(text)
+        parser.close()
+        return items
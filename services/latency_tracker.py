@@ -0,0 +1,53 @@
+import threading
+from collections import deque
+from typing import Dict, Any, Optional
+
+
+class LatencyTracker:
+    """
+    Online latency percentiles over a sliding window of recent calls.
+
+    Keeps the last `window_size` samples per endpoint; percentiles are
+    computed on demand, which is cheap for the window sizes used here and
+    tracks shifts in endpoint latency quickly.
+    """
+
+    def __init__(self, window_size: int = 200):
+        self.window_size = window_size
+        self.total_samples = 0
+        self._samples = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self.total_samples += 1
+
+    @property
+    def count(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """Latency in seconds at the given percentile (0-100), or None without samples"""
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+
+        rank = (percentile / 100.0) * (len(ordered) - 1)
+        lower = int(rank)
+        upper = min(lower + 1, len(ordered) - 1)
+        fraction = rank - lower
+        return ordered[lower] + (ordered[upper] - ordered[lower]) * fraction
+
+    def summary(self) -> Dict[str, Any]:
+        def _ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 1) if value is not None else None
+
+        return {
+            'samples': self.count,
+            'total_samples': self.total_samples,
+            'p50_ms': _ms(self.percentile(50)),
+            'p95_ms': _ms(self.percentile(95)),
+            'p99_ms': _ms(self.percentile(99))
+        }
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import time
+from typing import Dict, Any, Optional
+from services.sqlite_store import SQLiteStore
+
+
+class LLMResponseCache(SQLiteStore):
+    """
+    Content-addressed on-disk cache for LLM completions.
+
+    Entries are keyed by a SHA-256 hash of everything that determines the
+    completion (model endpoint, system prompt, prompt, max_tokens,
+    temperature) and stored in a local SQLite file. The cache is bounded by
+    total response size with least-recently-used eviction, and entries expire
+    after an optional TTL.
+    """
+
+    FILENAME = 'responses.sqlite3'
+    SCHEMA = [
+        '''
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)'
+    ]
+    TABLES = ['responses']
+    LRU_TABLE = 'responses'
+
+    def __init__(
+        self,
+        cache_dir: str = '.llm_cache',
+        max_size_bytes: int = 256 * 1024 * 1024,
+        ttl_seconds: Optional[float] = 7 * 24 * 3600
+    ):
+        super().__init__(cache_dir, max_size_bytes)
+        self.ttl_seconds = ttl_seconds
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(model: str, system_prompt: Optional[str], prompt: str, max_tokens: int, temperature: float) -> str:
+        """Hash the request fields that determine a completion"""
+        material = json.dumps(
+            [model, system_prompt or '', prompt, max_tokens, temperature],
+            ensure_ascii=False,
+            separators=(',', ':')
+        )
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for a key, or None on miss/expiry"""
+        now = time.time()
+
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT response, created_at FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            response, created_at = row
+
+            if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+            self.hits += 1
+            return response
+
+    def set(self, key: str, model: str, response: str):
+        """Store a response and evict least-recently-used entries over the size limit"""
+        now = time.time()
+        size_bytes = len(response.encode('utf-8'))
+
+        if size_bytes > self.max_size_bytes:
+            return
+
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (key, model, response, size_bytes, created_at, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, model, response, size_bytes, now, now)
+            )
+            self.writes += 1
+            self._evict_locked()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current cache occupancy"""
+        with self._lock:
+            entries, size_bytes = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM responses'
+            ).fetchone()
+
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'writes': self.writes,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'entries': entries,
+            'size_bytes': size_bytes,
+            'max_size_bytes': self.max_size_bytes,
+            'ttl_seconds': self.ttl_seconds
+        }
@@ -1,17 +1,115 @@
 import httpx
 import asyncio
 import json
-from typing import Dict, Any, Optional
+import random
+import time
+from collections import deque
+from functools import partial
+from typing import Dict, Any, List, Optional, AsyncIterator, Awaitable, Callable, Tuple
 import os
+from services.background_loop import BackgroundEventLoop, CrossLoopQueue
+from services.llm_cache import LLMResponseCache
+from services.rate_limiter import AdaptiveRateLimiter, parse_retry_after, OUTCOME_SUCCESS, OUTCOME_THROTTLED, OUTCOME_ERROR
+from services.circuit_breaker import CircuitBreaker
+from services.latency_tracker import LatencyTracker
+from services.json_stream import IncrementalJSONParser
+from services.usage_tracker import LLMUsageTracker
+from services.single_flight import SingleFlight, STREAM_DONE, request_key
+from services.model_router import ModelRouter
+from services.rule_cache import RuleVerdictCache
+from services.endpoint_warmer import EndpointWarmer
+from services.deadline import current_deadline, call_timeout, DeadlineExceeded
+from services.token_estimator import TokenEstimator
+from services.traffic_cassette import TrafficCassette
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class LLMCallError(Exception):
+    """
+    Raised when an LLM endpoint call fails.
+
+    `retryable` is True for transient failures (timeouts, connection errors,
+    5xx, exhausted 429 retries) that are worth retrying and that count
+    against the endpoint's circuit breaker.
+    """
+    
+    def __init__(self, message: str, model: str, status_code: Optional[int] = None, retryable: bool = False):
+        super().__init__(message)
+        self.model = model
+        self.status_code = status_code
+        self.retryable = retryable
+
+
+class PromptTooLargeError(LLMCallError):
+    """Raised before sending when a prompt cannot fit the model's context window"""
+
+
+# Context window per model in tokens (prompt + completion)
+DEFAULT_CONTEXT_TOKENS = {
+    'claude': 200000,
+    'llama': 128000
+}
+
+# Response size used to derive max_tokens from the expected mapping count
+RESPONSE_OVERHEAD_TOKENS = 200
+TOKENS_PER_MAPPING = {'verbose': 120, 'compact': 40}
+MIN_EXPECTED_MAPPINGS = 5
+MIN_COMPLETION_TOKENS = 256
 
 
 class LLMService:
     """
     Service for communicating with Databricks-hosted LLM endpoints.
     Supports both Claude Sonnet 4 and Llama 3.3 70B models.
+
+    Each endpoint gets one long-lived, HTTP/2-capable connection pool that is
+    shared by every call, so a workflow pays the TCP/TLS handshake once per
+    endpoint instead of once per prompt. Call aclose() on shutdown.
     """
     
-    def __init__(self, claude_endpoint: str, llama_endpoint: str, api_token: str):
+    def __init__(
+        self,
+        claude_endpoint: str,
+        llama_endpoint: str,
+        api_token: str,
+        http2: bool = True,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 120.0,
+        cache: Optional[LLMResponseCache] = None,
+        requests_per_second: float = 5.0,
+        burst: int = 10,
+        max_concurrency: int = 16,
+        max_throttle_retries: int = 3,
+        max_retries: int = 2,
+        retry_base_delay: float = 0.5,
+        retry_max_delay: float = 8.0,
+        breaker_failure_threshold: int = 3,
+        breaker_recovery_timeout: float = 30.0,
+        hedging_enabled: bool = False,
+        hedge_percentile: float = 95.0,
+        hedge_min_samples: int = 20,
+        hedge_max_rate: float = 0.1,
+        token_costs_per_million: Optional[Dict[str, Dict[str, float]]] = None,
+        dedupe_inflight: bool = True,
+        routing_enabled: bool = True,
+        routing_complexity_threshold: int = 3,
+        routing_large_prompt_tokens: int = 6000,
+        session_budget_usd: float = 0.0,
+        rule_cache: Optional[RuleVerdictCache] = None,
+        warm_interval_seconds: float = 0.0,
+        cold_after_seconds: float = 900.0,
+        warm_on_session: bool = True,
+        context_tokens: Optional[Dict[str, int]] = None,
+        prompt_estimate_margin: float = 1.1,
+        cassette: Optional[TrafficCassette] = None,
+        batch_concurrency: int = 8
+    ):
         self.claude_endpoint = claude_endpoint
         self.llama_endpoint = llama_endpoint
         self.api_token = api_token
@@ -22,8 +120,593 @@ class LLMService:
             'Authorization': f'Bearer {api_token}',
             'Content-Type': 'application/json'
         }
+        
+        # Connection pool configuration (one pool per endpoint)
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.pool_limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        
+        # Per-model request settings
+        self.endpoints = {
+            'claude': claude_endpoint,
+            'llama': llama_endpoint
+        }
+        self.temperatures = {
+            'claude': 0.1,  # Low temperature for consistent, accurate responses
+            'llama': 0.2    # Slightly higher temperature than Claude for diverse perspectives
+        }
+        self.display_names = {
+            'claude': 'Claude',
+            'llama': 'Llama'
+        }
+        self.default_max_tokens = {
+            'claude': 4000,
+            'llama': 3000
+        }
+        # Upper bound for max_tokens derived from the expected mapping count
+        self.max_output_tokens = {
+            'claude': 8192,
+            'llama': 4096
+        }
+        
+        # Pre-flight prompt budgeting with a local token estimate (conservative
+        # margin), so oversized prompts fail before a network round trip
+        self.context_tokens = {**DEFAULT_CONTEXT_TOKENS, **(context_tokens or {})}
+        self.token_estimator = TokenEstimator(margin=prompt_estimate_margin)
+        self.preflight_stats = {'checked': 0, 'rejected': 0, 'clamped': 0}
+        
+        # Optional on-disk response cache shared by all calls
+        self.cache = cache
+        
+        # Calls one batch (call_many, an agent's notebook chunks) keeps in flight
+        self.batch_concurrency = batch_concurrency
+        
+        # Optional cache of agent verdicts for structurally identical
+        # transformation rules (consulted by the agents before prompting)
+        self.rule_cache = rule_cache
+        
+        # Per-endpoint token bucket + AIMD concurrency control; 429s are retried
+        # after Retry-After instead of failing the call
+        self.max_throttle_retries = max_throttle_retries
+        self.rate_limiters = {
+            model: AdaptiveRateLimiter(
+                name=model,
+                requests_per_second=requests_per_second,
+                burst=burst,
+                max_concurrency=max_concurrency
+            )
+            for model in self.endpoints
+        }
+        
+        # Retry policy for call_with_fallback and per-endpoint circuit breakers
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.circuit_breakers = {
+            model: CircuitBreaker(
+                name=model,
+                failure_threshold=breaker_failure_threshold,
+                recovery_timeout=breaker_recovery_timeout
+            )
+            for model in self.endpoints
+        }
+        
+        # Online latency tracking per endpoint (successful upstream calls only)
+        self.latency_trackers = {model: LatencyTracker() for model in self.endpoints}
+        
+        # Opt-in request hedging for call_with_fallback: if the primary has not
+        # answered by its p<hedge_percentile> latency, race the other endpoint.
+        # At most hedge_max_rate of recent calls may be hedged to cap token spend.
+        self.hedging_enabled = hedging_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_max_rate = hedge_max_rate
+        self._hedge_window = deque(maxlen=100)
+        self.hedge_stats = {'hedges_fired': 0, 'hedge_wins': 0, 'hedges_suppressed': 0}
+        
+        # Token/cost/latency accounting, attributed to the active agent scope
+        self.usage_tracker = LLMUsageTracker(token_costs_per_million)
+        
+        # Optional record/replay of all endpoint traffic (benchmarks, profiling)
+        self.cassette = cassette
+        
+        # Pooled clients live on a dedicated loop so they survive across Flask requests
+        self._service_loop = BackgroundEventLoop(name='llm-service-loop')
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        
+        # Identical prompts already in flight (e.g. two users opening the same
+        # notebook) share one upstream call instead of paying for it twice
+        self.dedupe_inflight = dedupe_inflight
+        self.single_flight = SingleFlight(self._service_loop)
+        
+        # Per-call model choice from prompt size, rule complexity, endpoint
+        # latency/health and the session budget
+        self.router = ModelRouter(
+            self.usage_tracker,
+            self.latency_trackers,
+            self.circuit_breakers,
+            enabled=routing_enabled,
+            complexity_threshold=routing_complexity_threshold,
+            large_prompt_tokens=routing_large_prompt_tokens,
+            session_budget_usd=session_budget_usd
+        )
+        
+        # Keep-alive probes for endpoints that scale down when idle, plus
+        # warm vs cold call latency
+        self.warm_on_session = warm_on_session
+        self.endpoint_warmer = EndpointWarmer(
+            self,
+            interval_seconds=warm_interval_seconds,
+            cold_after_seconds=cold_after_seconds
+        )
+        self.endpoint_warmer.start()
+    
+    def _get_client(self, model: str) -> httpx.AsyncClient:
+        """
+        Return the pooled client for a model endpoint, creating it on first use.
+        Must be called from the service loop.
+        """
+        client = self._clients.get(model)
+        
+        if client is None or client.is_closed:
+            transport = None
+            if self.cassette is not None:
+                transport = self.cassette.transport(
+                    'llm', httpx.AsyncHTTPTransport(http2=self.http2, limits=self.pool_limits)
+                )
+            
+            client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=self.timeout,
+                limits=self.pool_limits,
+                http2=self.http2,
+                transport=transport
+            )
+            self._clients[model] = client
+        
+        return client
+    
+    async def aclose(self):
+        """
+        Close all pooled connections and stop the service loop.
+        Safe to call more than once; clients are recreated lazily on the next call.
+        """
+        if not self._service_loop.is_running:
+            return
+        
+        self.endpoint_warmer.stop()
+        await self._service_loop.run(self._close_clients())
+        
+        if not self._service_loop.in_loop():
+            self._service_loop.stop()
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Response cache hit/miss counters, or {'enabled': False} without a cache"""
+        if self.cache is None:
+            return {'enabled': False}
+        
+        return {'enabled': True, **self.cache.stats()}
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Snapshot of LLM service metrics: per-endpoint rate limits, in-flight
+        and queued requests, and response cache counters
+        """
+        return {
+            'rate_limits': {model: limiter.metrics() for model, limiter in self.rate_limiters.items()},
+            'circuit_breakers': self.get_endpoint_health(),
+            'latency': {model: tracker.summary() for model, tracker in self.latency_trackers.items()},
+            'hedging': self.get_hedging_stats(),
+            'usage': self.usage_tracker.totals(),
+            'single_flight': self.single_flight.stats(),
+            'routing': self.router.stats(),
+            'warmup': self.endpoint_warmer.metrics(),
+            'preflight': dict(self.preflight_stats),
+            'rule_cache': self.rule_cache.stats() if self.rule_cache is not None else {'enabled': False},
+            'cassette': self.cassette.stats() if self.cassette is not None else {'enabled': False},
+            'cache': self.get_cache_stats()
+        }
+    
+    def warm_up(self, models: Optional[List[str]] = None) -> List[str]:
+        """
+        Start warming cold endpoints without waiting, e.g. when a mapping
+        session is created, so they scale up while the notebook is fetched
+        and parsed. No-op when warm_on_session is disabled.
+        
+        Returns:
+            The models a warm-up probe was sent to
+        """
+        if not self.warm_on_session:
+            return []
+        
+        models = [model for model in (models or list(self.endpoints)) if self.is_endpoint_available(model)]
+        started = self.endpoint_warmer.warm_up(models)
+        if started:
+            print(f"Warming up cold LLM endpoint(s): {', '.join(started)}")
+        return started
+    
+    def usage_scope(self, agent_name: str, session_id: Optional[int] = None):
+        """
+        Context manager attributing LLM calls made inside it to an agent run
+        
+        Usage:
+            with llm_service.usage_scope('validation', session_id) as usage:
+                ...
+            usage.total_tokens, usage.cost_estimate, usage.llm_time_seconds
+        """
+        return self.usage_tracker.scope(agent_name, session_id)
+    
+    def get_hedging_stats(self) -> Dict[str, Any]:
+        """Hedging configuration, counters and the recent hedge rate"""
+        recent = list(self._hedge_window)
+        return {
+            'enabled': self.hedging_enabled,
+            'percentile': self.hedge_percentile,
+            'max_rate': self.hedge_max_rate,
+            'recent_rate': sum(recent) / len(recent) if recent else 0.0,
+            **self.hedge_stats
+        }
     
-    async def call_claude(self, prompt: str, system_prompt: str = None, max_tokens: int = 4000) -> str:
+    def get_endpoint_health(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Circuit breaker state per model endpoint
+        
+        Returns:
+            Dict keyed by model ('claude', 'llama') with state
+            ('closed', 'open', 'half_open'), availability and failure counts
+        """
+        return {model: breaker.snapshot() for model, breaker in self.circuit_breakers.items()}
+    
+    def is_endpoint_available(self, model: str) -> bool:
+        """True unless the model's circuit breaker is open"""
+        return self.circuit_breakers[model].state != CircuitBreaker.OPEN
+    
+    async def _close_clients(self):
+        clients = list(self._clients.values())
+        self._clients.clear()
+        
+        for client in clients:
+            await client.aclose()
+    
+    def _build_payload(self, model: str, prompt: str, system_prompt: str, max_tokens: int) -> Dict[str, Any]:
+        """Build the chat-completions payload expected by Databricks serving endpoints"""
+        payload = {
+            'messages': [
+                {
+                    'role': 'user',
+                    'content': prompt
+                }
+            ],
+            'max_tokens': max_tokens,
+            'temperature': self.temperatures[model],
+        }
+        
+        if system_prompt:
+            payload['messages'].insert(0, {
+                'role': 'system',
+                'content': system_prompt
+            })
+        
+        return payload
+    
+    def _extract_content(self, response_data: Dict[str, Any]) -> str:
+        """Extract the completion text based on Databricks response format"""
+        if 'choices' in response_data and response_data['choices']:
+            return response_data['choices'][0]['message']['content']
+        elif 'content' in response_data:
+            return response_data['content']
+        else:
+            raise ValueError(f"Unexpected response format: {response_data}")
+    
+    async def _post(self, model: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Send one invocation over the model's pooled client (service loop only).
+        Admission goes through the endpoint's rate limiter; 429 responses are
+        retried after Retry-After up to max_throttle_retries times.
+        """
+        client = self._get_client(model)
+        limiter = self.rate_limiters[model]
+        
+        for attempt in range(self.max_throttle_retries + 1):
+            await limiter.acquire()
+            outcome = OUTCOME_ERROR
+            retry_after = None
+            
+            try:
+                response = await client.post(self.endpoints[model], json=payload)
+                outcome = self._outcome(response.status_code)
+                if outcome == OUTCOME_THROTTLED:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            finally:
+                await limiter.release(outcome, retry_after=retry_after)
+            
+            if outcome == OUTCOME_THROTTLED and attempt < self.max_throttle_retries:
+                print(f"{self.display_names[model]} endpoint throttled (429), retrying after backoff")
+                continue
+            
+            response.raise_for_status()
+            return response.json()
+    
+    async def _stream_post(self, model: str, payload: Dict[str, Any], emit: Callable[[str], None]):
+        """
+        Stream one invocation over the model's pooled client (service loop only),
+        passing each server-sent content delta (str) and the usage block (dict)
+        to `emit`. Endpoints that ignore `stream` and answer with plain JSON are
+        emitted as a single chunk.
+        """
+        client = self._get_client(model)
+        limiter = self.rate_limiters[model]
+        
+        for attempt in range(self.max_throttle_retries + 1):
+            await limiter.acquire()
+            outcome = OUTCOME_ERROR
+            retry_after = None
+            
+            try:
+                async with client.stream('POST', self.endpoints[model], json=payload) as response:
+                    if response.status_code == 429:
+                        outcome = OUTCOME_THROTTLED
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                        if attempt < self.max_throttle_retries:
+                            continue
+                    
+                    if response.status_code >= 400:
+                        await response.aread()
+                        response.raise_for_status()
+                    
+                    if 'text/event-stream' not in response.headers.get('content-type', ''):
+                        response_data = json.loads(await response.aread())
+                        emit(self._extract_content(response_data))
+                        if response_data.get('usage'):
+                            emit(response_data['usage'])
+                        outcome = self._outcome(response.status_code)
+                        return
+                    
+                    async for line in response.aiter_lines():
+                        if not line.startswith('data:'):
+                            continue
+                        data = line[len('data:'):].strip()
+                        if data == '[DONE]':
+                            break
+                        
+                        event = json.loads(data)
+                        delta = self._extract_delta(event)
+                        if delta:
+                            emit(delta)
+                        if event.get('usage'):
+                            emit(event['usage'])
+                    # Counted as a success only once the whole stream has arrived
+                    outcome = self._outcome(response.status_code)
+                    return
+            finally:
+                await limiter.release(outcome, retry_after=retry_after)
+    
+    @staticmethod
+    def _outcome(status_code: int) -> str:
+        """Rate limiter outcome of an HTTP status"""
+        if status_code == 429:
+            return OUTCOME_THROTTLED
+        if 200 <= status_code < 300:
+            return OUTCOME_SUCCESS
+        return OUTCOME_ERROR
+    
+    def _extract_delta(self, event: Dict[str, Any]) -> str:
+        """Extract the content delta from one streamed chat-completions chunk"""
+        choices = event.get('choices') or []
+        if not choices:
+            return ''
+        delta = choices[0].get('delta') or choices[0].get('message') or {}
+        return delta.get('content') or ''
+    
+    def _cache_key(
+        self,
+        model: str,
+        prompt: str,
+        system_prompt: str,
+        max_tokens: int,
+        use_cache: bool
+    ) -> Optional[str]:
+        if self.cache is None or not use_cache:
+            return None
+        return LLMResponseCache.make_key(
+            self.endpoints[model], system_prompt, prompt, max_tokens, self.temperatures[model]
+        )
+    
+    def _to_call_error(self, model: str, error: Exception) -> LLMCallError:
+        """Classify a failed call, record it on the model's breaker and wrap it"""
+        name = self.display_names[model]
+        breaker = self.circuit_breakers[model]
+        
+        if isinstance(error, LLMCallError):
+            return error
+        
+        if isinstance(error, httpx.HTTPStatusError):
+            status_code = error.response.status_code
+            retryable = status_code == 429 or status_code >= 500
+            error_msg = f"{name} API error {status_code}: {error.response.text}"
+            if retryable:
+                breaker.record_failure(error_msg)
+            else:
+                # Client errors say nothing about endpoint health
+                breaker.record_success()
+            return LLMCallError(error_msg, model, status_code=status_code, retryable=retryable)
+        
+        if isinstance(error, httpx.TransportError):
+            error_msg = f"{name} API call failed: {type(error).__name__}: {str(error)}"
+            breaker.record_failure(error_msg)
+            return LLMCallError(error_msg, model, retryable=True)
+        
+        breaker.record_success()
+        return LLMCallError(f"{name} API call failed: {str(error)}", model)
+    
+    def max_tokens_for(self, model: str, expected_mappings: int, compact: bool = False) -> int:
+        """
+        max_tokens sized for a response of about `expected_mappings` mappings
+        
+        Args:
+            model: 'claude' or 'llama'
+            expected_mappings: Mappings the response is expected to contain
+            compact: Response uses the compact positional contract
+            
+        Returns:
+            Token limit with 25% headroom (for at least MIN_EXPECTED_MAPPINGS),
+            capped at the model's max_output_tokens
+        """
+        per_mapping = TOKENS_PER_MAPPING['compact' if compact else 'verbose']
+        budget = RESPONSE_OVERHEAD_TOKENS + int(per_mapping * max(expected_mappings, MIN_EXPECTED_MAPPINGS) * 1.25)
+        return max(MIN_COMPLETION_TOKENS, min(budget, self.max_output_tokens[model]))
+    
+    def prompt_budget(
+        self,
+        model: str,
+        prompt: str,
+        system_prompt: str = None,
+        max_tokens: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Estimate whether a prompt fits the model's context window, locally
+        
+        Returns:
+            Dict with prompt_tokens, context_tokens, available_completion_tokens
+            and fits (True if the prompt leaves room for max_tokens, or at
+            least MIN_COMPLETION_TOKENS when max_tokens is None)
+        """
+        prompt_tokens = sum(self.token_estimator.estimate_many([prompt, system_prompt or '']))
+        context = self.context_tokens[model]
+        available = context - prompt_tokens
+        
+        return {
+            'prompt_tokens': prompt_tokens,
+            'context_tokens': context,
+            'available_completion_tokens': max(available, 0),
+            'fits': available >= (max_tokens or MIN_COMPLETION_TOKENS)
+        }
+    
+    def _preflight(self, model: str, prompt: str, system_prompt: str, max_tokens: int) -> int:
+        """
+        Check a prompt against the context window before sending it
+        
+        Returns:
+            max_tokens, lowered to what the context has room for if needed
+        
+        Raises:
+            PromptTooLargeError: if not even MIN_COMPLETION_TOKENS would fit
+        """
+        budget = self.prompt_budget(model, prompt, system_prompt)
+        self.preflight_stats['checked'] += 1
+        available = budget['available_completion_tokens']
+        
+        if available < MIN_COMPLETION_TOKENS:
+            self.preflight_stats['rejected'] += 1
+            raise PromptTooLargeError(
+                f"{self.display_names[model]} prompt of ~{budget['prompt_tokens']} tokens does not fit "
+                f"the {budget['context_tokens']}-token context window",
+                model
+            )
+        
+        if max_tokens > available:
+            self.preflight_stats['clamped'] += 1
+            print(f"Lowering max_tokens for {model} from {max_tokens} to {available} to fit the context window")
+            return available
+        
+        return max_tokens
+    
+    def _deadline_timeout(self, model: str) -> Optional[float]:
+        """
+        Time this call may take under the active workflow deadline, or None
+        without one. Raises LLMCallError once the deadline has passed.
+        """
+        if current_deadline() is None:
+            return None
+        try:
+            return call_timeout(self.timeout.read)
+        except DeadlineExceeded as e:
+            raise LLMCallError(f"{self.display_names[model]} API call skipped: {str(e)}", model)
+    
+    async def _call_model(
+        self,
+        model: str,
+        prompt: str,
+        system_prompt: str,
+        max_tokens: int,
+        use_cache: bool = True
+    ) -> str:
+        """Shared request path for call_claude and call_llama"""
+        name = self.display_names[model]
+        max_tokens = self._preflight(model, prompt, system_prompt, max_tokens)
+        
+        started = time.perf_counter()
+        cache_key = self._cache_key(model, prompt, system_prompt, max_tokens, use_cache)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.usage_tracker.record(model, None, time.perf_counter() - started, cached=True)
+                return cached
+        
+        breaker = self.circuit_breakers[model]
+        if not breaker.allow_request():
+            raise LLMCallError(f"{name} API call skipped: circuit breaker is open", model)
+        
+        timeout = self._deadline_timeout(model)
+        cold = self.endpoint_warmer.is_cold(model)
+        payload = self._build_payload(model, prompt, system_prompt, max_tokens)
+        
+        async def upstream() -> Tuple[Dict[str, Any], str]:
+            try:
+                response_data = await self._post(model, payload)
+                return response_data, self._extract_content(response_data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Classified once here so a shared failure hits the breaker once
+                raise self._to_call_error(model, e)
+        
+        if self.dedupe_inflight:
+            request = self.single_flight.do(request_key(self.endpoints[model], payload), upstream)
+        else:
+            request = self._run_owned(upstream())
+        
+        try:
+            # Bounded by the workflow deadline; a coalesced call keeps running for other waiters
+            (response_data, content), owner = await asyncio.wait_for(request, timeout)
+        except asyncio.TimeoutError:
+            raise LLMCallError(f"{name} API call exceeded the workflow deadline ({timeout:.1f}s allowed)", model)
+        
+        if not owner:
+            # Coalesced onto another caller's request: no extra tokens were spent
+            self.usage_tracker.record(model, None, time.perf_counter() - started, cached=True)
+            return content
+        
+        elapsed = time.perf_counter() - started
+        self.latency_trackers[model].record(elapsed)
+        self.endpoint_warmer.record_call(model, elapsed, cold)
+        self.usage_tracker.record(
+            model,
+            response_data.get('usage'),
+            elapsed,
+            prompt_chars=len(prompt) + len(system_prompt or ''),
+            completion_chars=len(content)
+        )
+        breaker.record_success()
+        
+        if cache_key is not None:
+            self.cache.set(cache_key, model, content)
+        
+        return content
+    
+    async def _run_owned(self, coro) -> Tuple[Any, bool]:
+        return await self._service_loop.run(coro), True
+    
+    async def call_claude(
+        self,
+        prompt: str,
+        system_prompt: str = None,
+        max_tokens: int = 4000,
+        use_cache: bool = True
+    ) -> str:
         """
         Call Claude Sonnet 4 model for high-accuracy code analysis
         
@@ -31,56 +714,20 @@ class LLMService:
             prompt: The main prompt for Claude
             system_prompt: Optional system prompt for context
             max_tokens: Maximum tokens in response
+            use_cache: Set False to bypass the response cache for this call
             
         Returns:
             String response from Claude
         """
-        try:
-            # Prepare request payload
-            payload = {
-                'messages': [
-                    {
-                        'role': 'user',
-                        'content': prompt
-                    }
-                ],
-                'max_tokens': max_tokens,
-                'temperature': 0.1,  # Low temperature for consistent, accurate responses
-            }
-            
-            if system_prompt:
-                payload['messages'].insert(0, {
-                    'role': 'system',
-                    'content': system_prompt
-                })
-            
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    self.claude_endpoint,
-                    headers=self.headers,
-                    json=payload
-                )
-                
-                response.raise_for_status()
-                
-                # Parse response
-                response_data = response.json()
-                
-                # Extract content based on Databricks response format
-                if 'choices' in response_data and response_data['choices']:
-                    return response_data['choices'][0]['message']['content']
-                elif 'content' in response_data:
-                    return response_data['content']
-                else:
-                    raise ValueError(f"Unexpected response format: {response_data}")
-        
-        except httpx.HTTPStatusError as e:
-            error_msg = f"Claude API error {e.response.status_code}: {e.response.text}"
-            raise Exception(error_msg)
-        except Exception as e:
-            raise Exception(f"Claude API call failed: {str(e)}")
+        return await self._call_model('claude', prompt, system_prompt, max_tokens, use_cache)
     
-    async def call_llama(self, prompt: str, system_prompt: str = None, max_tokens: int = 3000) -> str:
+    async def call_llama(
+        self,
+        prompt: str,
+        system_prompt: str = None,
+        max_tokens: int = 3000,
+        use_cache: bool = True
+    ) -> str:
         """
         Call Llama 3.3 70B model for secondary analysis and validation
         
@@ -88,54 +735,220 @@ class LLMService:
             prompt: The main prompt for Llama
             system_prompt: Optional system prompt for context
             max_tokens: Maximum tokens in response
+            use_cache: Set False to bypass the response cache for this call
             
         Returns:
             String response from Llama
         """
-        try:
-            # Prepare request payload
-            payload = {
-                'messages': [
-                    {
-                        'role': 'user',
-                        'content': prompt
-                    }
-                ],
-                'max_tokens': max_tokens,
-                'temperature': 0.2,  # Slightly higher temperature than Claude for diverse perspectives
-            }
+        return await self._call_model('llama', prompt, system_prompt, max_tokens, use_cache)
+    
+    async def _stream_model(
+        self,
+        model: str,
+        prompt: str,
+        system_prompt: str,
+        max_tokens: int,
+        use_cache: bool = True,
+        validate: Optional[Callable[[], None]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Shared streaming path: yields content chunks as the endpoint produces them
+        
+        `validate` runs once the stream is complete and raises if the response
+        is unusable (e.g. truncated JSON); such responses are not cached.
+        """
+        name = self.display_names[model]
+        max_tokens = self._preflight(model, prompt, system_prompt, max_tokens)
+        
+        started = time.perf_counter()
+        cache_key = self._cache_key(model, prompt, system_prompt, max_tokens, use_cache)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.usage_tracker.record(model, None, time.perf_counter() - started, cached=True)
+                yield cached
+                if validate is not None:
+                    validate()
+                return
+        
+        breaker = self.circuit_breakers[model]
+        if not breaker.allow_request():
+            raise LLMCallError(f"{name} API call skipped: circuit breaker is open", model)
+        
+        deadline = current_deadline()
+        self._deadline_timeout(model)
+        cold = self.endpoint_warmer.is_cold(model)
+        payload = self._build_payload(model, prompt, system_prompt, max_tokens)
+        payload['stream'] = True
+        
+        # The HTTP stream runs on the service loop; chunks are handed back to
+        # the caller's loop through a queue. It is unbounded: a shared stream
+        # is broadcast to every subscriber and must not wait on the slowest
+        # one, and a completion is bounded by max_tokens anyway
+        queue = CrossLoopQueue()
+        emit = queue.emit
+        
+        async def upstream(broadcast):
+            try:
+                await self._stream_post(model, payload, broadcast)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Classified once here so a shared failure hits the breaker once
+                raise self._to_call_error(model, e)
+        
+        if self.dedupe_inflight:
+            subscription = self.single_flight.subscribe(request_key(self.endpoints[model], payload), upstream, emit)
+        else:
+            subscription = None
             
-            if system_prompt:
-                payload['messages'].insert(0, {
-                    'role': 'system',  
-                    'content': system_prompt
-                })
+            async def produce():
+                try:
+                    await upstream(emit)
+                except Exception as e:
+                    emit(e)
+                else:
+                    emit(STREAM_DONE)
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    self.llama_endpoint,
-                    headers=self.headers,
-                    json=payload
-                )
-                
-                response.raise_for_status()
-                
-                # Parse response
-                response_data = response.json()
+            future = self._service_loop.submit(produce())
+        
+        chunks = []
+        usage = None
+        completion_chars = 0
+        
+        try:
+            while True:
+                try:
+                    item = await queue.get(deadline.remaining() if deadline is not None else None)
+                except asyncio.TimeoutError:
+                    raise LLMCallError(f"{name} stream exceeded the workflow deadline", model)
+                if item is STREAM_DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise self._to_call_error(model, item)
+                if isinstance(item, dict):
+                    usage = item  # usage block from the final stream event
+                    continue
                 
-                # Extract content based on Databricks response format
-                if 'choices' in response_data and response_data['choices']:
-                    return response_data['choices'][0]['message']['content']
-                elif 'content' in response_data:
-                    return response_data['content']
-                else:
-                    raise ValueError(f"Unexpected response format: {response_data}")
+                completion_chars += len(item)
+                if cache_key is not None:
+                    chunks.append(item)
+                yield item
+        finally:
+            queue.close()
+            if subscription is not None:
+                subscription.release()
+            elif not future.done():
+                future.cancel()
         
-        except httpx.HTTPStatusError as e:
-            error_msg = f"Llama API error {e.response.status_code}: {e.response.text}"
-            raise Exception(error_msg)
-        except Exception as e:
-            raise Exception(f"Llama API call failed: {str(e)}")
+        elapsed = time.perf_counter() - started
+        
+        # An unusable response is still accounted for, but never cached
+        validation_error = None
+        if validate is not None:
+            try:
+                validate()
+            except Exception as e:
+                validation_error = e
+        
+        if subscription is not None and not subscription.claim():
+            # Coalesced onto another caller's stream: no extra tokens were spent
+            self.usage_tracker.record(model, None, elapsed, cached=True)
+            if validation_error is not None:
+                raise validation_error
+            return
+        
+        self.latency_trackers[model].record(elapsed)
+        self.endpoint_warmer.record_call(model, elapsed, cold)
+        self.usage_tracker.record(
+            model,
+            usage,
+            elapsed,
+            prompt_chars=len(prompt) + len(system_prompt or ''),
+            completion_chars=completion_chars
+        )
+        breaker.record_success()
+        
+        if validation_error is not None:
+            raise validation_error
+        
+        if cache_key is not None:
+            self.cache.set(cache_key, model, ''.join(chunks))
+    
+    def stream_claude(
+        self,
+        prompt: str,
+        system_prompt: str = None,
+        max_tokens: int = 4000,
+        use_cache: bool = True
+    ) -> AsyncIterator[str]:
+        """
+        Stream a Claude completion as it is generated
+        
+        Args:
+            prompt: The main prompt for Claude
+            system_prompt: Optional system prompt for context
+            max_tokens: Maximum tokens in response
+            use_cache: Set False to bypass the response cache for this call
+            
+        Returns:
+            Async iterator of response text chunks
+        """
+        return self._stream_model('claude', prompt, system_prompt, max_tokens, use_cache)
+    
+    def stream_llama(
+        self,
+        prompt: str,
+        system_prompt: str = None,
+        max_tokens: int = 3000,
+        use_cache: bool = True
+    ) -> AsyncIterator[str]:
+        """
+        Stream a Llama completion as it is generated
+        
+        Args:
+            prompt: The main prompt for Llama
+            system_prompt: Optional system prompt for context
+            max_tokens: Maximum tokens in response
+            use_cache: Set False to bypass the response cache for this call
+            
+        Returns:
+            Async iterator of response text chunks
+        """
+        return self._stream_model('llama', prompt, system_prompt, max_tokens, use_cache)
+    
+    async def stream_json_items(
+        self,
+        model: str,
+        prompt: str,
+        parser: IncrementalJSONParser,
+        system_prompt: str = None,
+        max_tokens: Optional[int] = None,
+        use_cache: bool = True
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Stream a completion and yield each element of the parser's watched
+        arrays (e.g. 'mappings') as soon as it is complete
+        
+        Args:
+            model: 'claude' or 'llama'
+            prompt: The prompt text
+            parser: IncrementalJSONParser configured with the array keys to watch
+            system_prompt: Optional system prompt
+            max_tokens: Maximum response tokens (model default if None)
+            use_cache: Set False to bypass the response cache
+            
+        Returns:
+            Async iterator of (array_key, element) pairs. Raises ValueError if
+            the response ends before the JSON document is complete.
+        """
+        if max_tokens is None:
+            max_tokens = self.default_max_tokens[model]
+        
+        # parser.close() validates the complete response before it is cached
+        async for chunk in self._stream_model(model, prompt, system_prompt, max_tokens, use_cache, validate=parser.close):
+            for item in parser.feed(chunk):
+                yield item
     
     async def test_connection(self) -> Dict[str, Any]:
         """
@@ -153,7 +966,8 @@ class LLMService:
         try:
             claude_response = await self.call_claude(
                 "Test connectivity. Respond with just 'Connected successfully.'",
-                max_tokens=50
+                max_tokens=50,
+                use_cache=False
             )
             
             if 'connected' in claude_response.lower():
@@ -170,7 +984,8 @@ class LLMService:
         try:
             llama_response = await self.call_llama(
                 "Test connectivity. Respond with just 'Connected successfully.'",
-                max_tokens=50
+                max_tokens=50,
+                use_cache=False
             )
             
             if 'connected' in llama_response.lower():
@@ -185,43 +1000,63 @@ class LLMService:
         
         return results
     
-    async def get_model_choice_recommendation(self, task_type: str) -> str:
+    def route_model(self, task_type: str, prompt: str, rules: Optional[List[Any]] = None) -> str:
+        """
+        Pick the model for one call (see ModelRouter)
+        
+        Args:
+            task_type: Type of task ('code_analysis', 'validation', 'generation', etc.)
+            prompt: The prompt about to be sent
+            rules: Transformation rules the call covers, scored for complexity
+            
+        Returns:
+            Model to call ('claude' or 'llama')
+        """
+        return self.router.route(task_type, prompt, rules)['model']
+    
+    async def get_model_choice_recommendation(
+        self,
+        task_type: str,
+        prompt: str = '',
+        rules: Optional[List[Any]] = None
+    ) -> str:
         """
         Recommend which model to use for specific tasks
         
         Args:
             task_type: Type of task ('code_analysis', 'validation', 'generation', etc.)
+            prompt: The prompt about to be sent, if known
+            rules: Transformation rules the call covers, if known
             
         Returns:
             Recommended model ('claude' or 'llama')
         """
-        
-        # Task-specific model recommendations
-        recommendations = {
-            'code_analysis': 'claude',  # Claude is better for code understanding
-            'validation': 'claude',     # Claude is better for complex reasoning
-            'generation': 'claude',     # Claude is better for structured output
-            'enhancement': 'llama',     # Llama can provide different perspectives
-            'fallback': 'llama'         # Llama as backup when Claude fails
-        }
-        
-        return recommendations.get(task_type, 'claude')
+        return self.route_model(task_type, prompt, rules)
     
     async def call_with_fallback(
         self, 
         prompt: str, 
         system_prompt: str = None, 
         preferred_model: str = 'claude',
-        max_tokens: int = 3000
+        max_tokens: int = 3000,
+        use_cache: bool = True,
+        hedge: Optional[bool] = None
     ) -> Dict[str, Any]:
         """
-        Call LLM with automatic fallback to secondary model
+        Call LLM with retries and automatic fallback to the secondary model.
+        
+        Each model is retried on transient errors with exponential backoff and
+        full jitter. A model whose circuit breaker is open is skipped, so calls
+        go straight to the healthy endpoint instead of waiting for a timeout.
         
         Args:
             prompt: The prompt text
             system_prompt: Optional system prompt
             preferred_model: 'claude' or 'llama'
             max_tokens: Maximum response tokens
+            use_cache: Set False to bypass the response cache
+            hedge: Race the secondary model if the primary is slow
+                (defaults to the service's hedging_enabled setting)
             
         Returns:
             Dict with response and metadata
@@ -230,44 +1065,289 @@ class LLMService:
         primary_model = preferred_model
         fallback_model = 'llama' if preferred_model == 'claude' else 'claude'
         
-        # Try primary model first
-        try:
-            if primary_model == 'claude':
-                response = await self.call_claude(prompt, system_prompt, max_tokens)
-            else:
-                response = await self.call_llama(prompt, system_prompt, max_tokens)
+        if hedge if hedge is not None else self.hedging_enabled:
+            return await self._call_hedged(
+                primary_model, fallback_model, prompt, system_prompt, max_tokens, use_cache
+            )
+        
+        return await self._call_models_in_order(
+            primary_model, [primary_model, fallback_model], prompt, system_prompt, max_tokens, use_cache, {}
+        )
+    
+    async def _call_models_in_order(
+        self,
+        primary_model: str,
+        models: list,
+        prompt: str,
+        system_prompt: str,
+        max_tokens: int,
+        use_cache: bool,
+        errors: Dict[str, str]
+    ) -> Dict[str, Any]:
+        """Try each model in turn, skipping endpoints whose breaker is open"""
+        fallback_model = 'llama' if primary_model == 'claude' else 'claude'
+        
+        for model in models:
+            if not self.is_endpoint_available(model):
+                errors[model] = f"{self.display_names[model]} circuit breaker is open"
+                print(f"Skipping {model}: circuit breaker is open")
+                continue
             
-            return {
-                'response': response,
-                'model_used': primary_model,
-                'used_fallback': False,
-                'success': True
-            }
+            try:
+                response = await self._call_with_retries(model, prompt, system_prompt, max_tokens, use_cache)
+            except Exception as e:
+                errors[model] = str(e)
+                print(f"Model ({model}) failed: {str(e)}")
+                continue
+            
+            return self._fallback_result(response, model, primary_model, errors)
+        
+        return {
+            'response': None,
+            'model_used': None,
+            'used_fallback': True,
+            'success': False,
+            'primary_error': errors.get(primary_model),
+            'fallback_error': errors.get(fallback_model)
+        }
+    
+    def _fallback_result(self, response: str, model: str, primary_model: str, errors: Dict[str, str]) -> Dict[str, Any]:
+        result = {
+            'response': response,
+            'model_used': model,
+            'used_fallback': model != primary_model,
+            'success': True
+        }
+        if primary_model in errors:
+            result['primary_error'] = errors[primary_model]
+        return result
+    
+    async def call_many(
+        self,
+        prompts: List[str],
+        model: str = 'claude',
+        max_concurrency: Optional[int] = None,
+        system_prompt: str = None,
+        max_tokens: Optional[int] = None,
+        use_cache: bool = True,
+        fallback: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Run independent prompts concurrently with bounded concurrency
+        
+        Each prompt is retried like call_with_fallback; one failing prompt
+        never fails the batch. The endpoint rate limiters still apply, so
+        max_concurrency only caps how many prompts this batch has in flight.
+        
+        Args:
+            prompts: Prompt texts
+            model: 'claude' or 'llama'
+            max_concurrency: Maximum prompts in flight at once (batch_concurrency if None)
+            system_prompt: Optional system prompt shared by every prompt
+            max_tokens: Maximum response tokens (defaults to the model's default)
+            use_cache: Set False to bypass the response cache
+            fallback: Fall back to the other model when `model` fails
             
-        except Exception as primary_error:
-            print(f"Primary model ({primary_model}) failed: {str(primary_error)}")
+        Returns:
+            Dict with per-prompt results (in input order) and aggregate
+            latency/throughput statistics
+        """
+        if max_tokens is None:
+            max_tokens = self.default_max_tokens[model]
+        
+        batch_latency = LatencyTracker(window_size=max(1, len(prompts)))
+        
+        async def run_one(index: int, prompt: str) -> Dict[str, Any]:
+            started = time.perf_counter()
+            result = {'index': index, 'success': False, 'response': None, 'model_used': None, 'error': None}
             
-            # Try fallback model
             try:
-                if fallback_model == 'claude':
-                    response = await self.call_claude(prompt, system_prompt, max_tokens)
+                if fallback:
+                    outcome = await self.call_with_fallback(
+                        prompt, system_prompt, preferred_model=model, max_tokens=max_tokens, use_cache=use_cache
+                    )
+                    result.update(
+                        success=outcome['success'],
+                        response=outcome['response'],
+                        model_used=outcome['model_used'],
+                        error=None if outcome['success'] else outcome.get('primary_error')
+                    )
                 else:
-                    response = await self.call_llama(prompt, system_prompt, max_tokens)
+                    result['response'] = await self._call_with_retries(
+                        model, prompt, system_prompt, max_tokens, use_cache
+                    )
+                    result.update(success=True, model_used=model)
+            except Exception as e:
+                result['error'] = str(e)
+            
+            result['latency_seconds'] = round(time.perf_counter() - started, 4)
+            batch_latency.record(result['latency_seconds'])
+            return result
+        
+        started = time.perf_counter()
+        results = await self.run_bounded(
+            [partial(run_one, index, prompt) for index, prompt in enumerate(prompts)], max_concurrency
+        )
+        total_seconds = time.perf_counter() - started
+        
+        succeeded = sum(1 for result in results if result['success'])
+        
+        return {
+            'results': list(results),
+            'total': len(results),
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'total_seconds': round(total_seconds, 4),
+            'throughput_per_second': round(len(results) / total_seconds, 2) if total_seconds > 0 else None,
+            'latency': batch_latency.summary()
+        }
+    
+    def batch_limiter(self, max_concurrency: Optional[int] = None) -> asyncio.Semaphore:
+        """
+        Semaphore bounding one batch to `max_concurrency` LLM calls (batch_concurrency if None)
+        
+        Hold it only around the request itself, e.g. `async with limiter:
+        async for ... in stream_json_items(...)`, so work that splits and
+        recurses can pass the same limiter down without deadlocking.
+        """
+        return asyncio.Semaphore(max(1, max_concurrency or self.batch_concurrency))
+    
+    async def run_bounded(
+        self,
+        calls: List[Callable[[], Awaitable[Any]]],
+        max_concurrency: Optional[int] = None
+    ) -> List[Any]:
+        """
+        Await a batch of calls with at most `max_concurrency` in flight
+        
+        The batch primitive behind call_many, for callers whose calls are
+        more than a plain prompt (streamed, routed per item, with their own
+        fallbacks). Each call holds its slot until it returns, so a call
+        must not start a nested batch; callers that fan out recursively
+        share one batch_limiter() instead.
+        
+        Args:
+            calls: Zero-argument functions returning the awaitables to run
+            max_concurrency: Calls in flight at once (batch_concurrency if None)
+            
+        Returns:
+            Results in input order; the first exception propagates as with asyncio.gather
+        """
+        semaphore = self.batch_limiter(max_concurrency)
+        
+        async def run_one(call):
+            async with semaphore:
+                return await call()
+        
+        return list(await asyncio.gather(*[run_one(call) for call in calls]))
+    
+    def _hedge_delay(self, model: str) -> Optional[float]:
+        """Seconds to wait on the primary before hedging, or None if there is too little history"""
+        tracker = self.latency_trackers[model]
+        if tracker.count < self.hedge_min_samples:
+            return None
+        return tracker.percentile(self.hedge_percentile)
+    
+    def _take_hedge_slot(self) -> bool:
+        """Reserve a hedge if the recent hedge rate stays under hedge_max_rate"""
+        recent = list(self._hedge_window)
+        if (sum(recent) + 1) / (len(recent) + 1) > self.hedge_max_rate:
+            self.hedge_stats['hedges_suppressed'] += 1
+            return False
+        
+        self._hedge_window.append(True)
+        self.hedge_stats['hedges_fired'] += 1
+        return True
+    
+    async def _call_hedged(
+        self,
+        primary_model: str,
+        secondary_model: str,
+        prompt: str,
+        system_prompt: str,
+        max_tokens: int,
+        use_cache: bool
+    ) -> Dict[str, Any]:
+        """
+        Send to the primary; if it is still running after its tracked latency
+        percentile, fire the same prompt at the secondary and take whichever
+        answers first. The slower request is cancelled.
+        """
+        if not self.is_endpoint_available(primary_model):
+            return await self._call_models_in_order(
+                primary_model, [primary_model, secondary_model], prompt, system_prompt, max_tokens, use_cache, {}
+            )
+        
+        tasks = {
+            asyncio.ensure_future(
+                self._call_with_retries(primary_model, prompt, system_prompt, max_tokens, use_cache)
+            ): primary_model
+        }
+        errors = {}
+        
+        try:
+            hedge_delay = self._hedge_delay(primary_model)
+            if hedge_delay is not None and self.is_endpoint_available(secondary_model):
+                done, _ = await asyncio.wait(set(tasks), timeout=hedge_delay)
                 
-                return {
-                    'response': response,
-                    'model_used': fallback_model,
-                    'used_fallback': True,
-                    'success': True,
-                    'primary_error': str(primary_error)
-                }
+                if not done and self._take_hedge_slot():
+                    print(f"{self.display_names[primary_model]} slower than p{self.hedge_percentile:g} "
+                          f"({hedge_delay:.2f}s), hedging to {secondary_model}")
+                    tasks[asyncio.ensure_future(
+                        self._call_with_retries(secondary_model, prompt, system_prompt, max_tokens, use_cache)
+                    )] = secondary_model
+            
+            if len(tasks) == 1:
+                self._hedge_window.append(False)
+            
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                
+                # Prefer the primary if both finished in the same tick
+                for task in sorted(done, key=lambda t: tasks[t] != primary_model):
+                    model = tasks[task]
+                    if task.exception() is not None:
+                        errors[model] = str(task.exception())
+                        print(f"Model ({model}) failed: {errors[model]}")
+                        continue
+                    
+                    if model != primary_model:
+                        self.hedge_stats['hedge_wins'] += 1
+                    result = self._fallback_result(task.result(), model, primary_model, errors)
+                    result['hedged'] = len(tasks) > 1
+                    return result
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        
+        # Every raced request failed; fall back to the secondary if it was not tried yet
+        remaining = [model for model in (secondary_model,) if model not in errors]
+        return await self._call_models_in_order(
+            primary_model, remaining, prompt, system_prompt, max_tokens, use_cache, errors
+        )
+    
+    async def _call_with_retries(
+        self,
+        model: str,
+        prompt: str,
+        system_prompt: str,
+        max_tokens: int,
+        use_cache: bool
+    ) -> str:
+        """Call one model, retrying transient failures with jittered exponential backoff"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self._call_model(model, prompt, system_prompt, max_tokens, use_cache)
+            except LLMCallError as e:
+                last_attempt = attempt == self.max_retries
+                if not e.retryable or last_attempt or not self.is_endpoint_available(model):
+                    raise
                 
-            except Exception as fallback_error:
-                return {
-                    'response': None,
-                    'model_used': None,
-                    'used_fallback': True,
-                    'success': False,
-                    'primary_error': str(primary_error),
-                    'fallback_error': str(fallback_error)
-                }
\ No newline at end of file
+                delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt)))
+                deadline = current_deadline()
+                if deadline is not None and delay >= deadline.remaining():
+                    raise  # no time left for another attempt
+                print(f"{self.display_names[model]} call failed (attempt {attempt + 1}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
@@ -0,0 +1,351 @@
+import asyncio
+import os
+import subprocess
+import threading
+from typing import Dict, Any, Optional, List, AsyncIterator, Tuple
+from services.gitlab_service import GitLabService, glob_to_regex, common_glob_base
+from services.sync_state import RepositorySyncState
+
+
+class LocalGitService(GitLabService):
+    """
+    GitLabService backend reading a git repository on local disk.
+
+    Works on a checkout or a bare mirror: blobs, trees and diffs are read
+    with git itself at the requested ref, with no HTTP, so batch runs
+    over many notebooks are bound by disk rather than network. Exposes
+    the same interface as GitLabService (fetching notebooks and blobs,
+    tree listings, bulk fetches, compare and incremental sync), so it can
+    be handed to the orchestrator and agents in its place. Credentials
+    are optional; only their 'branch' is used, to select the ref.
+
+    Objects are read through one long-lived `git cat-file --batch`
+    process rather than a git invocation per file.
+    """
+
+    def __init__(
+        self,
+        repo_path: str,
+        default_ref: Optional[str] = None,
+        sync_state: Optional[RepositorySyncState] = None,
+        git_binary: str = 'git'
+    ):
+        """
+        Args:
+            repo_path: Working tree or bare repository directory
+            default_ref: Ref read when the credentials name no branch (default: HEAD)
+            sync_state: Optional RepositorySyncState for incremental syncs
+            git_binary: git executable
+        """
+        super().__init__(sync_state=sync_state)
+        self.repo_path = os.path.abspath(repo_path)
+        self.default_ref = default_ref
+        self.git_binary = git_binary
+        self.fetch_stats.update({'git_commands': 0, 'objects_read': 0, 'bytes_read': 0})
+
+        self._cat_file: Optional[subprocess.Popen] = None
+        self._cat_file_lock = threading.Lock()
+        # git runs in worker threads, so fetch_stats is only updated through _count
+        self._stats_lock = threading.Lock()
+
+    def _ref(self, gitlab_credentials: Optional[Dict[str, str]]) -> str:
+        return (gitlab_credentials or {}).get('branch') or self.default_ref or 'HEAD'
+
+    def _count(self, **increments: int):
+        """Add to fetch_stats counters (thread-safe)"""
+        with self._stats_lock:
+            for name, amount in increments.items():
+                self.fetch_stats[name] += amount
+
+    def _git(self, *args: str) -> bytes:
+        """Run one git command in the repository and return its stdout"""
+        self._count(git_commands=1)
+        completed = subprocess.run(
+            [self.git_binary, '-C', self.repo_path, *args],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=False
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(f"git {args[0]} failed: {completed.stderr.decode('utf-8', errors='replace').strip()}")
+        return completed.stdout
+
+    def _read_object(self, name: str) -> Optional[Tuple[str, str, bytes]]:
+        """
+        Read one object ('<sha>' or '<ref>:<path>') through the cat-file process
+
+        Returns:
+            (sha, type, data), or None if there is no such object
+        """
+        if '\n' in name:
+            raise ValueError(f"Invalid object name: {name!r}")
+
+        with self._cat_file_lock:
+            if self._cat_file is None or self._cat_file.poll() is not None:
+                self._cat_file = subprocess.Popen(
+                    [self.git_binary, '-C', self.repo_path, 'cat-file', '--batch'],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL
+                )
+                self._count(git_commands=1)
+
+            try:
+                self._cat_file.stdin.write(name.encode('utf-8') + b'\n')
+                self._cat_file.stdin.flush()
+
+                header = self._cat_file.stdout.readline().decode('utf-8', errors='replace').rstrip('\n')
+                if not header:
+                    raise RuntimeError("git cat-file exited unexpectedly")
+                if header.endswith((' missing', ' ambiguous')):
+                    return None
+
+                sha, kind, size = header.split(' ')
+                data = self._cat_file.stdout.read(int(size))
+                self._cat_file.stdout.read(1)  # trailing newline
+            except Exception:
+                # The stream is out of step; start a fresh process next time
+                self._close_cat_file_locked()
+                raise
+
+        self._count(objects_read=1, bytes_read=len(data))
+        return sha, kind, data
+
+    def _close_cat_file_locked(self):
+        if self._cat_file is None:
+            return
+
+        try:
+            self._cat_file.stdin.close()
+            self._cat_file.wait(timeout=5)
+        except Exception:
+            self._cat_file.kill()
+        self._cat_file = None
+
+    def _list_tree(self, ref: str, path: str) -> List[Dict[str, Any]]:
+        """Every file under `path` at `ref`, as GitLab tree entries"""
+        # --end-of-options: a ref from the request must not be read as an option
+        args = ['ls-tree', '-r', '-z', '--full-tree', '--end-of-options', ref]
+        if path:
+            args += ['--', path.strip('/')]
+
+        entries = []
+        for record in self._git(*args).split(b'\0'):
+            if not record:
+                continue
+            meta, file_path = record.decode('utf-8', errors='replace').split('\t', 1)
+            mode, kind, sha = meta.split(' ')
+            entries.append({
+                'name': file_path.rsplit('/', 1)[-1],
+                'path': file_path,
+                'id': sha,
+                'mode': mode,
+                'type': kind
+            })
+        return entries
+
+    async def aclose(self):
+        """Stop the cat-file process"""
+        with self._cat_file_lock:
+            self._close_cat_file_locked()
+        await super().aclose()
+
+    async def fetch_notebook_content(
+        self,
+        notebook_path: str,
+        gitlab_credentials: Optional[Dict[str, str]] = None
+    ) -> str:
+        """
+        Read a notebook from the repository at the credentials' branch
+
+        Args:
+            notebook_path: Path to the notebook in the repository
+            gitlab_credentials: Optional; 'branch' selects the ref
+
+        Returns:
+            String content of the notebook
+        """
+        name = f"{self._ref(gitlab_credentials)}:{notebook_path.lstrip('/')}"
+        found = await asyncio.to_thread(self._read_object, name)
+
+        if found is None or found[1] != 'blob':
+            raise FileNotFoundError(f"Notebook not found at path: {notebook_path}")
+
+        self._count(requests=1)
+        return found[2].decode('utf-8', errors='replace')
+
+    async def fetch_blob(self, gitlab_credentials: Optional[Dict[str, str]], blob_id: str) -> str:
+        """
+        Read a file by its blob SHA
+
+        Args:
+            gitlab_credentials: Unused; kept for interface compatibility
+            blob_id: Git blob SHA
+
+        Returns:
+            String content of the file
+        """
+        found = await asyncio.to_thread(self._read_object, blob_id)
+
+        if found is None or found[1] != 'blob':
+            raise FileNotFoundError(f"Blob not found: {blob_id}")
+
+        self._count(requests=1)
+        return found[2].decode('utf-8', errors='replace')
+
+    async def iter_repository_files(
+        self,
+        gitlab_credentials: Optional[Dict[str, str]] = None,
+        path: str = '',
+        file_extension: str = '.py',
+        patterns: Optional[List[str]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        List repository files at the credentials' branch (one `git ls-tree`)
+
+        Args and yields are as for GitLabService.iter_repository_files.
+        """
+        matchers = [glob_to_regex(pattern) for pattern in patterns or []]
+        if not path and patterns:
+            path = common_glob_base(patterns)
+
+        entries = await asyncio.to_thread(self._list_tree, self._ref(gitlab_credentials), path)
+
+        for file_info in entries:
+            if file_info['type'] != 'blob':
+                continue
+            if file_extension and not file_info['name'].endswith(file_extension):
+                continue
+            if matchers and not any(matcher.match(file_info['path']) for matcher in matchers):
+                continue
+            yield {
+                'name': file_info['name'],
+                'path': file_info['path'],
+                'id': file_info['id'],
+                'mode': file_info['mode']
+            }
+
+    async def _iter_archive(
+        self,
+        gitlab_credentials: Optional[Dict[str, str]],
+        path: str,
+        select
+    ) -> AsyncIterator[Tuple[str, str]]:
+        """Read every file under `path` that `select` accepts, in tree order"""
+        entries = await asyncio.to_thread(self._list_tree, self._ref(gitlab_credentials), path)
+
+        for file_info in entries:
+            if file_info['type'] != 'blob' or not select(file_info['path']):
+                continue
+            found = await asyncio.to_thread(self._read_object, file_info['id'])
+            if found is None:
+                continue
+            self._count(archive_files=1)
+            yield file_info['path'], found[2].decode('utf-8', errors='replace')
+
+    async def get_branch_commit(self, gitlab_credentials: Optional[Dict[str, str]] = None) -> str:
+        """SHA of the commit the credentials' branch (or the default ref) points to"""
+        ref = self._ref(gitlab_credentials)
+        output = await asyncio.to_thread(self._git, 'rev-parse', '--verify', '--end-of-options', f'{ref}^{{commit}}')
+        return output.decode('utf-8').strip()
+
+    async def compare_commits(self, gitlab_credentials: Optional[Dict[str, str]], from_sha: str, to_sha: str) -> Dict[str, Any]:
+        """
+        Files changed between two commits, shaped like the GitLab compare response
+
+        As with GitLab's straight compare (see GitLabService.compare_commits),
+        the diff goes from `from_sha` itself to `to_sha`, not from their merge
+        base, so files that only existed on a force-pushed-over history show
+        up as deleted; renames are detected.
+        """
+        def compare():
+            diff = self._git(
+                'diff', '--name-status', '-z', '-M', '--no-ext-diff', '--end-of-options', from_sha, to_sha, '--'
+            )
+            commits = self._git('rev-list', '--reverse', '--end-of-options', f'{from_sha}..{to_sha}').decode('utf-8').split()
+            return diff, commits
+
+        diff, commits = await asyncio.to_thread(compare)
+        self._count(compares=1)
+
+        fields = diff.decode('utf-8', errors='replace').split('\0')
+        diffs = []
+        i = 0
+        while i < len(fields) and fields[i]:
+            status = fields[i][0]
+            if status in ('R', 'C'):
+                old_path, new_path = fields[i + 1], fields[i + 2]
+                i += 3
+            else:
+                old_path = new_path = fields[i + 1]
+                i += 2
+            diffs.append({
+                'old_path': old_path,
+                'new_path': new_path,
+                'new_file': status in ('A', 'C'),
+                'renamed_file': status == 'R',
+                'deleted_file': status == 'D'
+            })
+
+        return {
+            'commits': [{'id': sha} for sha in commits],
+            'diffs': diffs,
+            'compare_timeout': False,
+            'compare_same_ref': from_sha == to_sha
+        }
+
+    async def _compare_since(
+        self,
+        gitlab_credentials: Optional[Dict[str, str]],
+        from_commit: str,
+        to_commit: str
+    ) -> Optional[Dict[str, Any]]:
+        try:
+            return await self.compare_commits(gitlab_credentials, from_commit, to_commit)
+        except RuntimeError as e:
+            # Old commit gone (history rewritten, mirror pruned) or unrelated histories
+            print(f"Cannot compare {from_commit[:12]}..{to_commit[:12]} ({str(e)}), rescanning")
+            return None
+
+    def _repository_key(self, gitlab_credentials: Optional[Dict[str, str]]) -> Tuple[str, str]:
+        return f"file://{self.repo_path}", 'local'
+
+    async def changed_notebooks(
+        self,
+        gitlab_credentials: Optional[Dict[str, str]] = None,
+        path: str = '',
+        file_extension: str = '.py',
+        patterns: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """As GitLabService.changed_notebooks; the default ref is used when no branch is given"""
+        gitlab_credentials = {**(gitlab_credentials or {}), 'branch': self._ref(gitlab_credentials)}
+        return await super().changed_notebooks(gitlab_credentials, path, file_extension, patterns)
+
+    async def validate_credentials(self, gitlab_credentials: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """
+        Check that the repository can be read
+
+        Returns:
+            Validation results dictionary, as for GitLabService
+        """
+        try:
+            await asyncio.to_thread(self._git, 'rev-parse', '--git-dir')
+
+            try:
+                default_branch = (await asyncio.to_thread(self._git, 'symbolic-ref', '--short', 'HEAD')).decode('utf-8').strip()
+            except RuntimeError:
+                default_branch = 'HEAD'  # detached checkout
+
+            return {
+                'valid': True,
+                'project_name': os.path.basename(self.repo_path.rstrip('/')).removesuffix('.git'),
+                'project_description': '',
+                'default_branch': self.default_ref or default_branch,
+                'web_url': f"file://{self.repo_path}"
+            }
+
+        except Exception as e:
+            return {
+                'valid': False,
+                'error': f'Cannot read local repository: {str(e)}'
+            }
@@ -0,0 +1,171 @@
+import re
+import threading
+from collections import deque
+from typing import Dict, Any, List, Optional, Iterable
+from services.circuit_breaker import CircuitBreaker
+from services.prompt_encoding import estimate_tokens
+
+
+# Constructs that make a transformation rule hard to map correctly
+COMPLEXITY_PATTERN = re.compile(r'\b(when|concat(?:_ws)?|coalesce)\b', re.IGNORECASE)
+
+# Per-task models used when routing is disabled
+STATIC_RECOMMENDATIONS = {
+    'code_analysis': 'claude',  # Claude is better for code understanding
+    'validation': 'claude',     # Claude is better for complex reasoning
+    'generation': 'claude',     # Claude is better for structured output
+    'enhancement': 'llama',     # Llama can provide different perspectives
+    'fallback': 'llama'         # Llama as backup when Claude fails
+}
+
+
+def complexity_score(rules: Iterable[Any]) -> int:
+    """Number of when/concat/coalesce occurrences across the given rules"""
+    return sum(len(COMPLEXITY_PATTERN.findall(str(rule or ''))) for rule in rules)
+
+
+class ModelRouter:
+    """
+    Picks the endpoint for each LLM call.
+
+    Simple batches (mostly direct column copies, small prompts) go to the
+    cheaper, faster model; batches with conditional/concatenation logic or
+    large prompts are escalated to the stronger model. Escalation is
+    undone when it would exceed the session budget, simple batches move to
+    the stronger model while the cheap endpoint is much slower than it, and
+    an endpoint whose circuit breaker is open is never chosen if the other
+    one is available.
+    """
+
+    def __init__(
+        self,
+        usage_tracker,
+        latency_trackers: Dict[str, Any],
+        circuit_breakers: Dict[str, CircuitBreaker],
+        enabled: bool = True,
+        cheap_model: str = 'llama',
+        strong_model: str = 'claude',
+        complexity_threshold: int = 3,
+        large_prompt_tokens: int = 6000,
+        session_budget_usd: float = 0.0,
+        expected_completion_tokens: int = 1500,
+        slow_ratio: float = 2.0,
+        min_latency_samples: int = 5,
+        recent_decisions: int = 50
+    ):
+        """
+        Args:
+            usage_tracker: LLMUsageTracker used for cost estimates and session spend
+            latency_trackers: LatencyTracker per model
+            circuit_breakers: CircuitBreaker per model
+            enabled: False restores the static per-task recommendations
+            complexity_threshold: when/concat/coalesce count that escalates a batch
+            large_prompt_tokens: Prompt size (estimated tokens) that escalates a batch
+            session_budget_usd: Spend per mapping session above which nothing
+                more is escalated (0 = unlimited)
+            expected_completion_tokens: Completion size assumed for cost estimates
+            slow_ratio: Cheap/strong p50 latency ratio that moves simple batches
+                to the strong model
+            min_latency_samples: Samples needed before latency is considered
+            recent_decisions: Latest decisions kept for stats()
+        """
+        self.usage_tracker = usage_tracker
+        self.latency_trackers = latency_trackers
+        self.circuit_breakers = circuit_breakers
+        self.enabled = enabled
+        self.cheap_model = cheap_model
+        self.strong_model = strong_model
+        self.complexity_threshold = complexity_threshold
+        self.large_prompt_tokens = large_prompt_tokens
+        self.session_budget_usd = session_budget_usd
+        self.expected_completion_tokens = expected_completion_tokens
+        self.slow_ratio = slow_ratio
+        self.min_latency_samples = min_latency_samples
+
+        self._decisions: Dict[str, Dict[str, int]] = {}
+        self._reasons: Dict[str, int] = {}
+        self._recent: deque = deque(maxlen=recent_decisions)
+        self._lock = threading.Lock()
+
+    def _p50(self, model: str) -> Optional[float]:
+        tracker = self.latency_trackers.get(model)
+        if tracker is None or tracker.count < self.min_latency_samples:
+            return None
+        return tracker.percentile(50)
+
+    def _available(self, model: str) -> bool:
+        return self.circuit_breakers[model].state != CircuitBreaker.OPEN
+
+    def _remaining_budget(self) -> Optional[float]:
+        if self.session_budget_usd <= 0:
+            return None
+        scope = self.usage_tracker.current_scope()
+        if scope is None or scope.session_id is None:
+            return None  # not part of a mapping session
+        return self.session_budget_usd - self.usage_tracker.session_cost(scope.session_id)
+
+    def route(self, task_type: str, prompt: str, rules: Optional[List[Any]] = None) -> Dict[str, Any]:
+        """
+        Choose the model for one call
+
+        Args:
+            task_type: 'code_analysis', 'enhancement', 'validation', 'generation', ...
+            prompt: The prompt about to be sent
+            rules: Transformation rules (or code) the call is about; the
+                prompt itself is scored when omitted
+
+        Returns:
+            Dict with the chosen model, the reason, and the inputs considered
+        """
+        prompt_tokens = estimate_tokens(prompt)
+        complexity = complexity_score(rules if rules is not None else [prompt])
+
+        if not self.enabled:
+            model = STATIC_RECOMMENDATIONS.get(task_type, self.strong_model)
+            reason = 'static'
+        elif complexity >= self.complexity_threshold or prompt_tokens >= self.large_prompt_tokens:
+            model, reason = self.strong_model, 'complex'
+
+            remaining = self._remaining_budget()
+            estimated_cost = self.usage_tracker.estimate_cost(
+                self.strong_model, prompt_tokens, self.expected_completion_tokens
+            )
+            if remaining is not None and estimated_cost > remaining:
+                model, reason = self.cheap_model, 'budget'
+        else:
+            model, reason = self.cheap_model, 'simple'
+
+            cheap_p50, strong_p50 = self._p50(self.cheap_model), self._p50(self.strong_model)
+            if cheap_p50 is not None and strong_p50 is not None and cheap_p50 > strong_p50 * self.slow_ratio:
+                model, reason = self.strong_model, 'latency'
+
+        if not self._available(model):
+            other = self.strong_model if model == self.cheap_model else self.cheap_model
+            if self._available(other):
+                model, reason = other, 'circuit_open'
+
+        decision = {
+            'task_type': task_type,
+            'model': model,
+            'reason': reason,
+            'complexity': complexity,
+            'prompt_tokens': prompt_tokens
+        }
+
+        with self._lock:
+            by_model = self._decisions.setdefault(task_type, {})
+            by_model[model] = by_model.get(model, 0) + 1
+            self._reasons[reason] = self._reasons.get(reason, 0) + 1
+            self._recent.append(decision)
+
+        return decision
+
+    def stats(self) -> Dict[str, Any]:
+        """Routing decisions per task and model, counts per reason, and the latest decisions"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'decisions': {task: dict(models) for task, models in self._decisions.items()},
+                'reasons': dict(self._reasons),
+                'recent': list(self._recent)
+            }
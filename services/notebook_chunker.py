@@ -0,0 +1,254 @@
+import re
+from typing import Dict, List, Any, Optional, Iterable
+from services.token_estimator import TokenEstimator, DEFAULT_ESTIMATOR
+
+
+CELL_SEPARATOR = '# COMMAND ----------'
+
+# Assignments that bind a dataframe variable to a source table
+DATAFRAME_TABLE_PATTERNS = [
+    re.compile(r'^\s*(\w+)\s*=\s*dm_df\[\s*[\'"]([^\'"]+)[\'"]\s*\]', re.MULTILINE),
+    re.compile(r'^\s*(\w+)\s*=\s*spark\.(?:read\.)?table\(\s*[\'"]([^\'"]+)[\'"]', re.MULTILINE),
+]
+TEMP_VIEW_PATTERN = re.compile(r'(\w+)\.createOrReplace(?:Global)?TempView\(\s*[\'"]([^\'"]+)[\'"]')
+
+
+class NotebookChunk:
+    """A run of consecutive notebook cells sent to the LLM as one prompt"""
+
+    def __init__(self, index: int, cell_start: int, cell_end: int, text: str, context: Dict[str, str]):
+        self.index = index
+        self.cell_start = cell_start
+        self.cell_end = cell_end
+        self.text = text
+        self.context = context
+
+    def context_text(self) -> str:
+        """Dataframe-to-table bindings referenced by this chunk, one per line"""
+        if not self.context:
+            return '(none)'
+        return '\n'.join(f"{name} -> {table}" for name, table in sorted(self.context.items()))
+
+    def __repr__(self):
+        return f"NotebookChunk(index={self.index}, cells={self.cell_start}-{self.cell_end}, chars={len(self.text)})"
+
+
+class NotebookChunker:
+    """
+    Splits a Databricks notebook along `# COMMAND ----------` cell boundaries
+    into chunks that fit a token budget.
+
+    Cells are packed greedily in order, costed with the local token
+    estimator; a single cell larger than the budget is split on line
+    boundaries. Dataframe variables are often bound to
+    tables in an early cell and used much later, so every chunk carries the
+    notebook-wide dataframe-to-table bindings for the names it references.
+    """
+
+    def __init__(
+        self,
+        max_chunk_tokens: int = 3000,
+        token_estimator: Optional[TokenEstimator] = None
+    ):
+        self.max_chunk_tokens = max_chunk_tokens
+        self.token_estimator = token_estimator or DEFAULT_ESTIMATOR
+
+    def estimate_tokens(self, text: str) -> int:
+        return self.token_estimator.estimate(text)
+
+    def split_cells(self, notebook_content: str) -> List[str]:
+        """Split notebook source into cells, dropping the separator lines"""
+        cells = []
+        current = []
+
+        for line in notebook_content.split('\n'):
+            if line.strip().startswith(CELL_SEPARATOR):
+                cells.append('\n'.join(current).strip('\n'))
+                current = []
+            else:
+                current.append(line)
+        cells.append('\n'.join(current).strip('\n'))
+
+        return [cell for cell in cells if cell.strip()]
+
+    def extract_dataframe_context(self, notebook_content: str) -> Dict[str, str]:
+        """Map dataframe variable names (and temp views) to the tables they read"""
+        context = {}
+
+        for pattern in DATAFRAME_TABLE_PATTERNS:
+            for match in pattern.finditer(notebook_content):
+                context[match.group(1)] = match.group(2)
+
+        for match in TEMP_VIEW_PATTERN.finditer(notebook_content):
+            df_name, view_name = match.group(1), match.group(2)
+            context[view_name] = context.get(df_name, df_name)
+
+        return context
+
+    def chunk(self, notebook_content: str, extra_context: Optional[Dict[str, str]] = None) -> List[NotebookChunk]:
+        """
+        Split a notebook into budget-sized chunks
+
+        Args:
+            notebook_content: Notebook source (.py export)
+            extra_context: Additional dataframe-to-table bindings, e.g. from
+                the legacy AST extractor; these take precedence
+
+        Returns:
+            Chunks in notebook order; empty for an empty notebook
+        """
+        context = self.extract_dataframe_context(notebook_content)
+        if extra_context:
+            context.update({name: str(table) for name, table in extra_context.items() if table})
+
+        # (cell_number, text) pieces no larger than the budget; all cells
+        # are costed in one batch
+        cells = self.split_cells(notebook_content)
+        pieces = []
+        for cell_number, (cell, tokens) in enumerate(zip(cells, self.token_estimator.estimate_many(cells)), start=1):
+            if tokens <= self.max_chunk_tokens:
+                pieces.append((cell_number, cell, tokens))
+            else:
+                pieces.extend((cell_number, part, part_tokens) for part, part_tokens in self._split_oversized_cell(cell))
+
+        chunks = []
+        current: List[tuple] = []
+        current_tokens = 0
+        separator_tokens = self.estimate_tokens(f"\n{CELL_SEPARATOR}\n")
+
+        for cell_number, text, tokens in pieces:
+            added_tokens = tokens + (separator_tokens if current else 0)
+            if current and current_tokens + added_tokens > self.max_chunk_tokens:
+                chunks.append(self._make_chunk(len(chunks), current, context))
+                current = []
+                current_tokens = 0
+                added_tokens = tokens
+            current.append((cell_number, text))
+            current_tokens += added_tokens
+
+        if current:
+            chunks.append(self._make_chunk(len(chunks), current, context))
+
+        return chunks
+
+    def _split_oversized_cell(self, cell: str) -> List[tuple]:
+        """Split a cell on line boundaries into (text, tokens) parts within the budget"""
+        parts = []
+        current = []
+        current_tokens = 0
+        lines = cell.split('\n')
+
+        for line, tokens in zip(lines, self.token_estimator.estimate_many(lines)):
+            # A single overlong line is hard-split; rare outside generated code
+            if tokens > self.max_chunk_tokens:
+                if current:
+                    parts.append(('\n'.join(current), current_tokens))
+                    current, current_tokens = [], 0
+                step = max(1, len(line) * self.max_chunk_tokens // tokens)
+                for start in range(0, len(line), step):
+                    piece = line[start:start + step]
+                    parts.append((piece, self.estimate_tokens(piece)))
+                continue
+
+            if current and current_tokens + tokens + 1 > self.max_chunk_tokens:
+                parts.append(('\n'.join(current), current_tokens))
+                current, current_tokens = [], 0
+            current.append(line)
+            current_tokens += tokens + 1
+
+        if current:
+            parts.append(('\n'.join(current), current_tokens))
+
+        return parts
+
+    def split_chunk(self, chunk: NotebookChunk) -> List[NotebookChunk]:
+        """
+        Split a chunk into two halves of about equal token count, on cell
+        boundaries when it has several cells and on lines otherwise. Used when
+        a prompt built from the chunk turns out not to fit the model.
+
+        Returns:
+            The two halves, or [chunk] if it cannot be split further
+        """
+        separator = f"\n{CELL_SEPARATOR}\n"
+        units = chunk.text.split(separator)
+        joiner = separator
+        if len(units) < 2:
+            units = chunk.text.split('\n')
+            joiner = '\n'
+        if len(units) < 2:
+            return [chunk]
+
+        tokens = self.token_estimator.estimate_many(units)
+        half = sum(tokens) / 2
+        cut, running = 1, tokens[0]
+        while cut < len(units) - 1 and running + tokens[cut] <= half:
+            running += tokens[cut]
+            cut += 1
+
+        by_cells = joiner == separator
+        first_end = min(chunk.cell_start + cut - 1, chunk.cell_end) if by_cells else chunk.cell_end
+        second_start = min(first_end + 1, chunk.cell_end) if by_cells else chunk.cell_start
+
+        halves = []
+        for text, cell_start, cell_end in (
+            (joiner.join(units[:cut]), chunk.cell_start, first_end),
+            (joiner.join(units[cut:]), second_start, chunk.cell_end)
+        ):
+            referenced = set(re.findall(r'\w+', text))
+            context = {name: table for name, table in chunk.context.items() if name in referenced}
+            halves.append(NotebookChunk(chunk.index, cell_start, cell_end, text, context))
+
+        return halves
+
+    def _make_chunk(self, index: int, pieces: List[tuple], context: Dict[str, str]) -> NotebookChunk:
+        text = f"\n{CELL_SEPARATOR}\n".join(piece for _, piece in pieces)
+        referenced = set(re.findall(r'\w+', text))
+        chunk_context = {name: table for name, table in context.items() if name in referenced}
+
+        return NotebookChunk(
+            index=index,
+            cell_start=pieces[0][0],
+            cell_end=pieces[-1][0],
+            text=text,
+            context=chunk_context
+        )
+
+
+def _mapping_key(mapping: Dict[str, Any]) -> tuple:
+    def _norm(value: Any) -> str:
+        return ' '.join(str(value or '').split()).lower()
+
+    return (
+        _norm(mapping.get('source_table')),
+        _norm(mapping.get('source_column')),
+        _norm(mapping.get('target_field')),
+        _norm(mapping.get('transformation_rule'))
+    )
+
+
+def merge_chunk_mappings(partial_results: Iterable[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Merge per-chunk mapping lists into one list.
+
+    Partial results must be given in chunk order. Output order is the order
+    of first appearance, so the merge is deterministic regardless of which
+    chunk's LLM call finished first. Duplicates (same source, target and
+    transformation, ignoring case and whitespace) collapse into the entry
+    with the highest confidence score.
+    """
+    merged: Dict[tuple, Dict[str, Any]] = {}
+
+    for mappings in partial_results:
+        for mapping in mappings:
+            if not isinstance(mapping, dict):
+                continue
+            key = _mapping_key(mapping)
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = mapping
+            elif (mapping.get('confidence_score') or 0) > (existing.get('confidence_score') or 0):
+                # Replacing the value keeps the key's original position
+                merged[key] = mapping
+
+    return list(merged.values())
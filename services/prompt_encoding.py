@@ -0,0 +1,163 @@
+import json
+from typing import Dict, List, Any, Optional, Iterable
+from services.token_estimator import DEFAULT_ESTIMATOR
+
+
+# Columns whose long values are often repeated across rows (the same source
+# line yields several transformations); repeats are replaced by references
+DEDUPE_COLUMNS = ('source_line', 'code_location', 'transformation')
+DEDUPE_MIN_CHARS = 24
+
+# Explanation of the table format, included once in prompts that use it
+TABLE_FORMAT_NOTE = (
+    "Tables below are '|'-delimited with a header row. Lines 'column=value (all rows)' "
+    "give a value shared by every row; '@L1' refers to the numbered line 'L1: ...' listed above the header."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Local token count estimate (see TokenEstimator)"""
+    return DEFAULT_ESTIMATOR.estimate(text)
+
+
+def _flatten(record: Dict[str, Any], prefix: str = '') -> Dict[str, Any]:
+    flat = {}
+    for key, value in record.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and value:
+            flat.update(_flatten(value, f"{name}."))
+        else:
+            flat[name] = value
+    return flat
+
+
+def _cell(value: Any, delimiter: str) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, (list, dict)):
+        text = json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=str) if value else ''
+    elif isinstance(value, bool):
+        text = 'true' if value else 'false'
+    else:
+        text = str(value)
+    return text.replace('\\', '\\\\').replace('\n', '\\n').replace(delimiter, '\\' + delimiter)
+
+
+def encode_table(
+    records: Iterable[Dict[str, Any]],
+    columns: Optional[List[str]] = None,
+    delimiter: str = '|',
+    dedupe_columns: Iterable[str] = DEDUPE_COLUMNS
+) -> str:
+    """
+    Render a list of dicts as compact delimited text for a prompt.
+
+    Nested dicts are flattened to dotted column names. Columns that are
+    empty in every row are dropped, and columns with the same value in every
+    row are stated once above the header. Long values repeated in the
+    dedupe columns are listed once as L1, L2, ... and referenced as @L1.
+
+    Args:
+        records: Mapping/transformation dicts
+        columns: Columns to include, in order (default: all, first-seen order)
+        delimiter: Field delimiter; occurrences in values are backslash-escaped
+        dedupe_columns: Columns eligible for repeated-value references
+
+    Returns:
+        Encoded text, or '(none)' for an empty list
+    """
+    rows = [_flatten(record) for record in records if isinstance(record, dict)]
+    if not rows:
+        return '(none)'
+
+    if columns is None:
+        columns = []
+        for row in rows:
+            columns.extend(key for key in row if key not in columns)
+
+    cells = [{column: _cell(row.get(column), delimiter) for column in columns} for row in rows]
+    columns = [column for column in columns if any(row[column] for row in cells)]
+
+    lines = []
+
+    # Hoist columns that never vary
+    if len(cells) > 1:
+        constant = [column for column in columns if len({row[column] for row in cells}) == 1]
+        for column in constant:
+            lines.append(f"{column}={cells[0][column]} (all rows)")
+        columns = [column for column in columns if column not in constant]
+
+    # Replace repeated long values with references
+    dedupe_columns = set(dedupe_columns)
+    counts: Dict[str, int] = {}
+    for row in cells:
+        for column in columns:
+            if column.split('.')[-1] in dedupe_columns and len(row[column]) >= DEDUPE_MIN_CHARS:
+                counts[row[column]] = counts.get(row[column], 0) + 1
+
+    references: Dict[str, str] = {}
+    for value, count in counts.items():
+        if count > 1:
+            references[value] = f"L{len(references) + 1}"
+            lines.append(f"{references[value]}: {value}")
+
+    if references:
+        for row in cells:
+            for column in columns:
+                if row[column] in references and column.split('.')[-1] in dedupe_columns:
+                    row[column] = '@' + references[row[column]]
+
+    lines.append(delimiter.join(columns))
+    lines.extend(delimiter.join(row[column] for column in columns) for row in cells)
+
+    return '\n'.join(lines)
+
+
+class PromptEncoder:
+    """
+    Encodes the record lists of one prompt and reports the token savings.
+
+    Usage:
+        encoder = PromptEncoder()
+        table = encoder.table(mappings, baseline='json')
+        prompt = f"... {table} ..."
+        encoder.report('validation', prompt)
+    """
+
+    def __init__(self):
+        self.baseline_tokens = 0
+        self.encoded_tokens = 0
+
+    def table(self, records: List[Dict[str, Any]], baseline: str = 'json', **kwargs) -> str:
+        """
+        Encode records with encode_table, remembering the size of the
+        representation they replace ('json' = json.dumps(indent=2), 'repr')
+        """
+        encoded = encode_table(records, **kwargs)
+
+        if baseline == 'repr':
+            previous = repr(records)
+        else:
+            previous = json.dumps(records, indent=2, default=str)
+
+        baseline_tokens, encoded_tokens = DEFAULT_ESTIMATOR.estimate_many([previous, encoded])
+        self.baseline_tokens += baseline_tokens
+        self.encoded_tokens += encoded_tokens
+        return encoded
+
+    def report(self, label: str, prompt: str) -> Dict[str, Any]:
+        """Log and return the before/after token estimate for a finished prompt"""
+        after_tokens = estimate_tokens(prompt)
+        # The same prompt with the previous renderings substituted back in
+        before_tokens = after_tokens - self.encoded_tokens + self.baseline_tokens
+        saved = before_tokens - after_tokens
+        saved_pct = round(100.0 * saved / before_tokens, 1) if before_tokens else 0.0
+
+        print(f"{label} prompt: ~{after_tokens} tokens (~{before_tokens} before compact encoding, {saved_pct}% saved)")
+
+        return {
+            'before_tokens': before_tokens,
+            'after_tokens': after_tokens,
+            'saved_tokens': saved,
+            'saved_pct': saved_pct
+        }
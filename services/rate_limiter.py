@@ -0,0 +1,205 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional
+
+
+# Outcomes of one admitted request, fed back into the AIMD limit
+OUTCOME_SUCCESS = 'success'      # 2xx response
+OUTCOME_THROTTLED = 'throttled'  # 429 response
+OUTCOME_ERROR = 'error'          # transport error, timeout, cancelled or any other status
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header (delay in seconds or an HTTP date)
+
+    Returns:
+        Seconds to wait, or None if the header is missing or malformed
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class AdaptiveRateLimiter:
+    """
+    Per-endpoint admission control for LLM calls.
+
+    Combines a token bucket (steady request rate with bursts) with an AIMD
+    concurrency limit: every 2xx raises the limit by 1/limit (about +1 per
+    round trip of requests), every 429 halves it and pauses the endpoint for
+    the server's Retry-After. Errors leave the limit where it is: a failing
+    endpoint is the circuit breaker's concern, and must not grow the limit.
+    Throughput converges on what the endpoint can sustain instead of
+    failing requests.
+
+    All methods must be called from the same event loop.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_second: float = 5.0,
+        burst: int = 10,
+        initial_concurrency: int = 4,
+        min_concurrency: int = 1,
+        max_concurrency: int = 16,
+        decrease_factor: float = 0.5,
+        default_backoff_seconds: float = 1.0
+    ):
+        self.name = name
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.decrease_factor = decrease_factor
+        self.default_backoff_seconds = default_backoff_seconds
+
+        self.concurrency_limit = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self.in_flight = 0
+        self.queue_depth = 0
+
+        self.total_admitted = 0
+        self.total_throttled = 0
+        self.total_errors = 0
+
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._last_decrease = float('-inf')
+        self._condition: Optional[asyncio.Condition] = None
+        self._condition_loop = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Recreate the condition if the owning loop was restarted
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._condition_loop is not loop:
+            self._condition = asyncio.Condition()
+            self._condition_loop = loop
+            self.in_flight = 0
+        return self._condition
+
+    async def acquire(self):
+        """Wait for a concurrency slot and a rate token"""
+        condition = self._get_condition()
+        self.queue_depth += 1
+
+        try:
+            async with condition:
+                while self.in_flight >= int(self.concurrency_limit):
+                    await condition.wait()
+                self.in_flight += 1
+
+            try:
+                await self._take_token()
+            except BaseException:
+                await self._release_slot()
+                raise
+        finally:
+            self.queue_depth -= 1
+
+        self.total_admitted += 1
+
+    async def _take_token(self):
+        while True:
+            now = time.monotonic()
+
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+
+            self._refill(now)
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return
+
+            await asyncio.sleep((1.0 - self._tokens) / self.requests_per_second)
+
+    def _refill(self, now: float):
+        elapsed = now - self._last_refill
+        self._tokens = min(float(self.burst), self._tokens + elapsed * self.requests_per_second)
+        self._last_refill = now
+
+    async def _release_slot(self):
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight = max(self.in_flight - 1, 0)
+            condition.notify_all()
+
+    async def release(self, outcome: str = OUTCOME_ERROR, retry_after: Optional[float] = None):
+        """
+        Return the slot taken by acquire() and feed the outcome back into AIMD
+
+        Args:
+            outcome: OUTCOME_SUCCESS (2xx), OUTCOME_THROTTLED (429) or OUTCOME_ERROR
+            retry_after: Parsed Retry-After delay in seconds, if provided
+        """
+        if outcome == OUTCOME_SUCCESS:
+            self._on_success()
+        elif outcome == OUTCOME_THROTTLED:
+            self._on_throttled(retry_after)
+        else:
+            self.total_errors += 1
+
+        await self._release_slot()
+
+    def _on_success(self):
+        # Additive increase: roughly +1 per window of `limit` successful calls
+        self.concurrency_limit = min(
+            float(self.max_concurrency),
+            self.concurrency_limit + 1.0 / max(self.concurrency_limit, 1.0)
+        )
+
+    def _on_throttled(self, retry_after: Optional[float]):
+        now = time.monotonic()
+        self.total_throttled += 1
+
+        delay = retry_after if retry_after is not None else self.default_backoff_seconds
+        self._blocked_until = max(self._blocked_until, now + delay)
+        self._tokens = 0.0
+
+        # Multiplicative decrease, once per congestion event rather than once per 429
+        if now - self._last_decrease >= max(delay, self.default_backoff_seconds):
+            self.concurrency_limit = max(
+                float(self.min_concurrency),
+                self.concurrency_limit * self.decrease_factor
+            )
+            self._last_decrease = now
+
+    def metrics(self) -> Dict[str, Any]:
+        """Current limits and queue depth for monitoring"""
+        now = time.monotonic()
+        available_tokens = min(
+            float(self.burst),
+            self._tokens + (now - self._last_refill) * self.requests_per_second
+        )
+
+        return {
+            'endpoint': self.name,
+            'concurrency_limit': int(self.concurrency_limit),
+            'in_flight': self.in_flight,
+            'queue_depth': self.queue_depth,
+            'requests_per_second': self.requests_per_second,
+            'burst': self.burst,
+            'available_tokens': round(available_tokens, 2),
+            'blocked_for_seconds': round(max(self._blocked_until - now, 0.0), 3),
+            'total_admitted': self.total_admitted,
+            'total_throttled': self.total_throttled,
+            'total_errors': self.total_errors
+        }
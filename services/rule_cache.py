@@ -0,0 +1,380 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple, Callable
+
+
+# Tokens of a PySpark/SQL transformation expression
+TOKEN_PATTERN = re.compile(
+    r"""(?P<string>'(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*")"""
+    r"""|(?P<name>[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)*)"""
+    r"""|(?P<number>\d+(?:\.\d+)?)"""
+    r"""|(?P<space>\s+)"""
+    r"""|(?P<other>.)""",
+    re.DOTALL
+)
+
+# Words that are part of the expression language rather than column names
+KEYWORDS = {
+    'and', 'or', 'not', 'null', 'true', 'false', 'is', 'in', 'like', 'between',
+    'case', 'when', 'then', 'else', 'end', 'as', 'cast', 'distinct', 'none'
+}
+
+# Functions whose string argument is a column name, e.g. col("dr_fname")
+COLUMN_FUNCTIONS = {'col', 'column', 'f.col', 'f.column'}
+
+# Fields that identify a mapping; a verdict is only reused for the same ones
+IDENTITY_FIELDS = ('source_table', 'target_field', 'array_field')
+
+# Fields rewritten with the new mapping's identifiers when a verdict is reused
+TEMPLATE_FIELDS = ('transformation_rule', 'source_column')
+
+_PLACEHOLDER = '\x01{}\x01'
+_PLACEHOLDER_PATTERN = re.compile('\x01(\\d+)\x01')
+
+
+def _tokens(text: str) -> List[Tuple[str, str]]:
+    return [(match.lastgroup, match.group()) for match in TOKEN_PATTERN.finditer(text)]
+
+
+def _is_function(tokens: List[Tuple[str, str]], index: int) -> bool:
+    for kind, value in tokens[index + 1:]:
+        if kind != 'space':
+            return value == '('
+    return False
+
+
+def _column_argument(tokens: List[Tuple[str, str]], index: int) -> bool:
+    """True if the string token at `index` is the argument of col()/column()"""
+    previous = [value for kind, value in tokens[:index] if kind != 'space'][-2:]
+    return len(previous) == 2 and previous[1] == '(' and previous[0].lower() in COLUMN_FUNCTIONS
+
+
+def _is_identifier(tokens: List[Tuple[str, str]], index: int) -> bool:
+    kind, value = tokens[index]
+    if kind == 'name':
+        return value.lower() not in KEYWORDS and not _is_function(tokens, index)
+    return kind == 'string' and _column_argument(tokens, index)
+
+
+def _identifier(kind: str, value: str) -> str:
+    return value[1:-1] if kind == 'string' else value
+
+
+def rule_signature(rules: List[str]) -> Tuple[str, List[str]]:
+    """
+    Normalize transformation rules with their column identifiers abstracted
+
+    Whitespace outside string literals is dropped, function names and
+    keywords are lower-cased, and every column identifier is replaced by a
+    numbered placeholder in order of first appearance, so
+    `trim(concat(coalesce(a," "), coalesce(b," ")))` and the same idiom
+    over other columns share one signature.
+
+    Returns:
+        (signature, identifiers) where identifiers[i] fills placeholder i
+    """
+    identifiers: List[str] = []
+    parts = []
+
+    for rule in rules:
+        tokens = _tokens(str(rule or ''))
+        normalized = []
+        previous_word = False
+
+        for index, (kind, value) in enumerate(tokens):
+            if kind == 'space':
+                continue
+
+            word = kind in ('name', 'number')
+            if word and previous_word:
+                normalized.append(' ')
+            previous_word = word
+
+            if _is_identifier(tokens, index):
+                name = _identifier(kind, value)
+                if name not in identifiers:
+                    identifiers.append(name)
+                placeholder = _PLACEHOLDER.format(identifiers.index(name))
+                normalized.append(f'"{placeholder}"' if kind == 'string' else placeholder)
+            elif kind == 'name':
+                normalized.append(value.lower())
+            else:
+                normalized.append(value)
+
+        parts.append(''.join(normalized))
+
+    return '\x1f'.join(parts), identifiers
+
+
+def templatize(text: str, identifiers: List[str], strict: bool = True) -> Optional[str]:
+    """
+    Replace the given identifiers in `text` with placeholders, keeping its formatting
+
+    With strict=True (expressions) the result is None if `text` refers to a
+    column that is not among `identifiers`, since such a verdict cannot be
+    transferred to other columns. With strict=False (free text) only whole
+    words matching an identifier are replaced.
+    """
+    text = str(text or '')
+    positions = {name: index for index, name in enumerate(identifiers)}
+
+    if not strict:
+        if not identifiers:
+            return text
+        pattern = re.compile(r'(?<![\w.])(' + '|'.join(re.escape(name) for name in sorted(identifiers, key=len, reverse=True)) + r')(?![\w.])')
+        return pattern.sub(lambda match: _PLACEHOLDER.format(positions[match.group(1)]), text)
+
+    tokens = _tokens(text)
+    result = []
+    for index, (kind, value) in enumerate(tokens):
+        if _is_identifier(tokens, index):
+            name = _identifier(kind, value)
+            if name not in positions:
+                return None
+            placeholder = _PLACEHOLDER.format(positions[name])
+            result.append(value[0] + placeholder + value[-1] if kind == 'string' else placeholder)
+        else:
+            result.append(value)
+
+    return ''.join(result)
+
+
+def fill(template: str, identifiers: List[str]) -> Optional[str]:
+    """Substitute identifiers back into a template (None if one is missing)"""
+    try:
+        return _PLACEHOLDER_PATTERN.sub(lambda match: identifiers[int(match.group(1))], template)
+    except IndexError:
+        return None
+
+
+def _same(left: Any, right: Any) -> bool:
+    return str(left or '').strip().lower() == str(right or '').strip().lower()
+
+
+def _target(mapping: Dict[str, Any]) -> str:
+    return str(mapping.get('target_field') or '').strip().lower()
+
+
+def pair_by_target(inputs: List[Dict[str, Any]], outputs: List[Dict[str, Any]]) -> List[Optional[int]]:
+    """
+    For each LLM output mapping, the index of the input mapping it answers
+
+    Outputs are paired by target field; an output whose target matches no
+    input, or several, is left unpaired (None).
+    """
+    indices_by_target: Dict[str, List[int]] = {}
+    for index, mapping in enumerate(inputs):
+        indices_by_target.setdefault(_target(mapping), []).append(index)
+
+    pairing = []
+    for output in outputs:
+        candidates = indices_by_target.get(_target(output), [])
+        pairing.append(candidates[0] if len(candidates) == 1 else None)
+    return pairing
+
+
+def merge_by_index(
+    cached: Dict[int, Dict[str, Any]],
+    pending_indices: List[int],
+    outputs: List[Dict[str, Any]],
+    pairing: List[Optional[int]]
+) -> List[Dict[str, Any]]:
+    """
+    Recombine cached verdicts and LLM outputs in the order of the original batch
+
+    Args:
+        cached: Mappings resolved from the cache, by batch index
+        pending_indices: Batch index of each input sent to the LLM
+        outputs: The LLM's output mappings
+        pairing: pair_by_target(pending inputs, outputs)
+
+    Returns:
+        One mapping per batch position that has one, in batch order, followed
+        by LLM outputs that could not be placed (extra or ambiguous mappings)
+    """
+    placed = dict(cached)
+    unplaced = []
+
+    for output, pending_index in zip(outputs, pairing):
+        index = pending_indices[pending_index] if pending_index is not None else None
+        if index is None or index in placed:
+            unplaced.append(output)
+        else:
+            placed[index] = output
+
+    return [placed[index] for index in sorted(placed)] + unplaced
+
+
+class RuleVerdictCache:
+    """
+    Reuses LLM verdicts for structurally identical transformation rules.
+
+    Notebooks repeat the same idioms (trim(concat(coalesce(...))),
+    when(...).otherwise(...)) over different columns. Verdicts are stored
+    under the rule signature with identifiers abstracted; a later mapping
+    with the same signature gets the stored verdict with its own
+    identifiers substituted back in, without an LLM call.
+
+    Usage:
+        cached = rule_cache.lookup('validation', [rule], mapping)
+        ...
+        rule_cache.store('validation', [rule], mapping, llm_verdict)
+
+    or, for an agent's batch of items:
+        cached, pending_indices = rule_cache.lookup_many('validation', items, rules_of, mapping_of)
+        ...
+        pairing = rule_cache.store_many('validation', pending_items, outputs, rules_of, mapping_of)
+        results = merge_by_index(cached, pending_indices, outputs, pairing)
+    """
+
+    def __init__(self, max_entries: int = 5000):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, agent: str, counter: str):
+        stats = self._stats.setdefault(agent, {'hits': 0, 'misses': 0, 'stored': 0})
+        stats[counter] += 1
+
+    def lookup(self, agent: str, rules: List[str], mapping: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Apply a stored verdict to `mapping`
+
+        Args:
+            agent: Agent the verdict belongs to (verdicts are not shared across agents)
+            rules: Transformation rule(s) the verdict depends on
+            mapping: The input mapping the verdict would replace
+
+        Returns:
+            The mapping with the verdict applied, or None on a miss
+        """
+        signature, identifiers = rule_signature(rules)
+        key = f"{agent}\x1e{signature}"
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        applied = None
+        if entry is not None:
+            applied = dict(mapping)
+            for field, value in entry['fields'].items():
+                applied[field] = fill(value, identifiers) if isinstance(value, str) else value
+            for field, template in entry['templates'].items():
+                applied[field] = fill(template, identifiers) if template is not None else mapping.get(field, '')
+            if any(applied.get(field) is None for field in entry['templates']):
+                applied = None
+
+        with self._lock:
+            self._count(agent, 'hits' if applied is not None else 'misses')
+
+        return applied
+
+    def store(self, agent: str, rules: List[str], mapping: Dict[str, Any], verdict: Dict[str, Any]) -> bool:
+        """
+        Remember the LLM's verdict for `mapping` if it can be transferred
+
+        Verdicts that change the mapping's table or target, or whose
+        expressions refer to columns not present in the input rules, are
+        specific to this mapping and are not stored.
+
+        Returns:
+            True if the verdict was stored
+        """
+        if any(not _same(verdict.get(field), mapping.get(field)) for field in IDENTITY_FIELDS if field in verdict):
+            return False
+
+        signature, identifiers = rule_signature(rules)
+
+        templates = {}
+        for field in TEMPLATE_FIELDS:
+            template = templatize(verdict.get(field, ''), identifiers)
+            if template is None:
+                if not _same(verdict.get(field), mapping.get(field)):
+                    return False
+                # Keep the input's value on reuse
+            templates[field] = template
+
+        fields = {}
+        for field, value in verdict.items():
+            if field in IDENTITY_FIELDS or field in TEMPLATE_FIELDS:
+                continue
+            fields[field] = templatize(value, identifiers, strict=False) if isinstance(value, str) else value
+
+        with self._lock:
+            key = f"{agent}\x1e{signature}"
+            self._entries[key] = {'fields': fields, 'templates': templates}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._count(agent, 'stored')
+
+        return True
+
+    def lookup_many(
+        self,
+        agent: str,
+        items: List[Any],
+        rules_of: Callable[[Any], List[str]],
+        mapping_of: Callable[[Any], Dict[str, Any]] = lambda item: item
+    ) -> Tuple[Dict[int, Dict[str, Any]], List[int]]:
+        """
+        Apply stored verdicts to a batch
+
+        Args:
+            agent: Agent the verdicts belong to
+            items: Batch items (mappings, or e.g. conflicts wrapping them)
+            rules_of: Rules a verdict for an item depends on
+            mapping_of: The input mapping of an item
+
+        Returns:
+            (cached mappings by batch index, indices of the items still needing the LLM)
+        """
+        cached = {}
+        pending_indices = []
+
+        for index, item in enumerate(items):
+            applied = self.lookup(agent, rules_of(item), mapping_of(item))
+            if applied is None:
+                pending_indices.append(index)
+            else:
+                cached[index] = applied
+
+        return cached, pending_indices
+
+    def store_many(
+        self,
+        agent: str,
+        items: List[Any],
+        outputs: List[Dict[str, Any]],
+        rules_of: Callable[[Any], List[str]],
+        mapping_of: Callable[[Any], Dict[str, Any]] = lambda item: item
+    ) -> List[Optional[int]]:
+        """
+        Remember the LLM's verdicts for the items it was sent
+
+        Each output is paired with its item by target field (pair_by_target);
+        unpaired outputs are not stored.
+
+        Returns:
+            The pairing, for merge_by_index
+        """
+        pairing = pair_by_target([mapping_of(item) for item in items], outputs)
+
+        for output, index in zip(outputs, pairing):
+            if index is not None:
+                self.store(agent, rules_of(items[index]), mapping_of(items[index]), output)
+
+        return pairing
+
+    def stats(self) -> Dict[str, Any]:
+        """Hits, misses, stored verdicts and hit rate per agent"""
+        with self._lock:
+            agents = {}
+            for agent, counts in self._stats.items():
+                lookups = counts['hits'] + counts['misses']
+                agents[agent] = {**counts, 'hit_rate': round(counts['hits'] / lookups, 3) if lookups else 0.0}
+            return {'entries': len(self._entries), 'max_entries': self.max_entries, 'agents': agents}
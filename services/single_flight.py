@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import json
+import threading
+from typing import Dict, Any, Awaitable, Callable, List, Tuple
+from services.background_loop import BackgroundEventLoop
+
+
+# Sentinel broadcast to stream subscribers when the shared stream completes
+STREAM_DONE = object()
+
+
+def request_key(endpoint: str, payload: Dict[str, Any]) -> str:
+    """Key identifying byte-identical requests to the same endpoint"""
+    body = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{endpoint}\n{body}".encode('utf-8')).hexdigest()
+
+
+class _CallFlight:
+    def __init__(self):
+        self.future = None
+        self.waiters = 0
+        self.delivered = False
+
+
+class _StreamFlight:
+    def __init__(self):
+        self.future = None
+        self.items: List[Any] = []
+        self.subscribers: List[Callable[[Any], None]] = []
+        self.finished = False
+        self.delivered = False
+
+
+class StreamSubscription:
+    """A caller's view of a shared stream; release() when done consuming"""
+
+    def __init__(self, single_flight: 'SingleFlight', key: str, flight: _StreamFlight, emit: Callable[[Any], None]):
+        self._single_flight = single_flight
+        self._key = key
+        self._flight = flight
+        self._emit = emit
+        self._released = False
+
+    def claim(self) -> bool:
+        """True for exactly one subscriber of a completed stream (the one that accounts for it)"""
+        return self._single_flight._claim(self._flight)
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._single_flight._unsubscribe(self._key, self._flight, self._emit)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical upstream requests onto one shared call.
+
+    The shared call runs on the background loop, so it outlives any single
+    waiter: cancelling one waiter only detaches it. The call itself is
+    cancelled only once every waiter has gone. Streams are shared the same
+    way; late subscribers first receive a replay of the chunks already sent.
+    """
+
+    def __init__(self, service_loop: BackgroundEventLoop):
+        self._service_loop = service_loop
+        self._calls: Dict[str, _CallFlight] = {}
+        self._streams: Dict[str, _StreamFlight] = {}
+        self._lock = threading.Lock()
+        self._stats = {'upstream_calls': 0, 'coalesced': 0, 'abandoned': 0}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, 'in_flight': len(self._calls) + len(self._streams)}
+
+    def _claim(self, flight) -> bool:
+        with self._lock:
+            owner = not flight.delivered
+            flight.delivered = True
+            return owner
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Await the shared call for `key`, starting it if none is in flight
+
+        Returns:
+            (result, owner) where owner is True for exactly one waiter, so
+            per-call accounting (latency, usage, caching) happens once
+        """
+        with self._lock:
+            flight = self._calls.get(key)
+            if flight is None:
+                flight = _CallFlight()
+                self._calls[key] = flight
+                self._stats['upstream_calls'] += 1
+                flight.future = self._service_loop.submit(self._run_call(key, flight, factory))
+            else:
+                self._stats['coalesced'] += 1
+            flight.waiters += 1
+
+        try:
+            # shield: a cancelled waiter must not cancel the shared call
+            result = await asyncio.shield(asyncio.wrap_future(flight.future))
+        except asyncio.CancelledError:
+            with self._lock:
+                flight.waiters -= 1
+                abandon = flight.waiters == 0 and not flight.future.done()
+                if abandon:
+                    self._stats['abandoned'] += 1
+            if abandon:
+                flight.future.cancel()
+            raise
+        except BaseException:
+            with self._lock:
+                flight.waiters -= 1
+            raise
+
+        with self._lock:
+            flight.waiters -= 1
+        return result, self._claim(flight)
+
+    async def _run_call(self, key: str, flight: _CallFlight, factory: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            return await factory()
+        finally:
+            with self._lock:
+                if self._calls.get(key) is flight:
+                    del self._calls[key]
+
+    def subscribe(
+        self,
+        key: str,
+        factory: Callable[[Callable[[Any], None]], Awaitable[None]],
+        emit: Callable[[Any], None]
+    ) -> StreamSubscription:
+        """
+        Subscribe `emit` to the shared stream for `key`, starting it if needed
+
+        `factory(broadcast)` produces the stream by calling broadcast(item)
+        for each item. Subscribers receive every item, then either an
+        exception or STREAM_DONE. `emit` is called with the lock held and
+        must not block.
+        """
+        with self._lock:
+            flight = self._streams.get(key)
+            leader = flight is None
+            if leader:
+                flight = _StreamFlight()
+                self._streams[key] = flight
+                self._stats['upstream_calls'] += 1
+            else:
+                self._stats['coalesced'] += 1
+
+            for item in flight.items:
+                emit(item)
+            flight.subscribers.append(emit)
+
+            if leader:
+                flight.future = self._service_loop.submit(self._run_stream(key, flight, factory))
+
+        return StreamSubscription(self, key, flight, emit)
+
+    async def _run_stream(self, key: str, flight: _StreamFlight, factory):
+        def broadcast(item):
+            with self._lock:
+                flight.items.append(item)
+                for subscriber in flight.subscribers:
+                    subscriber(item)
+
+        def finish(item):
+            with self._lock:
+                flight.finished = True
+                if self._streams.get(key) is flight:
+                    del self._streams[key]
+                for subscriber in flight.subscribers:
+                    subscriber(item)
+
+        try:
+            await factory(broadcast)
+        except asyncio.CancelledError:
+            with self._lock:
+                flight.finished = True
+                if self._streams.get(key) is flight:
+                    del self._streams[key]
+            raise
+        except Exception as e:
+            finish(e)
+        else:
+            finish(STREAM_DONE)
+
+    def _unsubscribe(self, key: str, flight: _StreamFlight, emit: Callable[[Any], None]):
+        with self._lock:
+            if emit in flight.subscribers:
+                flight.subscribers.remove(emit)
+            abandon = not flight.subscribers and not flight.finished
+            if abandon:
+                self._stats['abandoned'] += 1
+                if self._streams.get(key) is flight:
+                    del self._streams[key]
+
+        if abandon and flight.future is not None:
+            flight.future.cancel()
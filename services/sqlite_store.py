@@ -0,0 +1,82 @@
+import os
+import sqlite3
+import threading
+from typing import List, Optional, Tuple
+
+
+class SQLiteStore:
+    """
+    Base for the local SQLite stores (LLM responses, GitLab files, blob
+    contents, sync state).
+
+    Opens one autocommit connection in WAL mode, shared by every thread
+    behind a lock, and creates the subclass's schema. Stores bounded by
+    size keep a `size_bytes` and `last_access` column in LRU_TABLE and
+    call _evict_locked() after each write.
+
+    Subclasses set:
+        FILENAME: Database file inside cache_dir
+        SCHEMA: CREATE statements run on open
+        TABLES: Tables emptied by clear(), in order
+        LRU_TABLE, LRU_KEY: Table and key column evicted by size
+    """
+
+    FILENAME = 'store.sqlite3'
+    SCHEMA: List[str] = []
+    TABLES: List[str] = []
+    LRU_TABLE: Optional[str] = None
+    LRU_KEY = 'key'
+
+    def __init__(self, cache_dir: str, max_size_bytes: Optional[int] = None):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.evictions = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(cache_dir, self.FILENAME),
+            check_same_thread=False,
+            isolation_level=None  # autocommit; each statement is its own transaction
+        )
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        for statement in self.SCHEMA:
+            self._conn.execute(statement)
+
+    def _total_size_locked(self) -> int:
+        return self._conn.execute(f'SELECT COALESCE(SUM(size_bytes), 0) FROM {self.LRU_TABLE}').fetchone()[0]
+
+    def _lru_entries_locked(self) -> List[Tuple[str, int]]:
+        """(key, size_bytes) of every entry, least recently used first"""
+        return self._conn.execute(
+            f'SELECT {self.LRU_KEY}, size_bytes FROM {self.LRU_TABLE} ORDER BY last_access ASC'
+        ).fetchall()
+
+    def _delete_entry_locked(self, key: str):
+        self._conn.execute(f'DELETE FROM {self.LRU_TABLE} WHERE {self.LRU_KEY} = ?', (key,))
+
+    def _evict_locked(self):
+        """Drop least-recently-used entries until the store fits max_size_bytes"""
+        if self.max_size_bytes is None:
+            return
+
+        total = self._total_size_locked()
+        if total <= self.max_size_bytes:
+            return
+
+        for key, size_bytes in self._lru_entries_locked():
+            if total <= self.max_size_bytes:
+                break
+            self._delete_entry_locked(key)
+            total -= size_bytes
+            self.evictions += 1
+
+    def clear(self):
+        """Remove every stored entry"""
+        with self._lock:
+            for table in self.TABLES:
+                self._conn.execute(f'DELETE FROM {table}')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import time
+from typing import Dict, Any, List, Optional
+from services.sqlite_store import SQLiteStore
+
+
+class RepositorySyncState(SQLiteStore):
+    """
+    Last analyzed commit per GitLab project, branch and scope.
+
+    A scope is the part of the repository a sync covers (directory, file
+    extension and path globs), so differently scoped syncs of one branch
+    keep separate state. Besides the commit, the notebook paths present at
+    that commit are kept: after a full rescan (first sync, or history
+    rewritten so the old commit can no longer be compared) the paths that
+    disappeared can still be reported as deleted. Stored in a local SQLite
+    file.
+    """
+
+    FILENAME = 'sync.sqlite3'
+    SCHEMA = [
+        '''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            project_id TEXT NOT NULL,
+            branch TEXT NOT NULL,
+            scope TEXT NOT NULL,
+            commit_sha TEXT NOT NULL,
+            paths TEXT NOT NULL,
+            synced_at REAL NOT NULL
+        )
+        '''
+    ]
+    TABLES = ['sync_state']
+
+    def __init__(self, cache_dir: str = '.gitlab_sync'):
+        super().__init__(cache_dir)
+
+    @staticmethod
+    def make_key(gitlab_url: str, project_id: str, branch: str, scope: str) -> str:
+        """Hash the coordinates of one synced scope"""
+        material = json.dumps([gitlab_url.rstrip('/'), str(project_id), branch, scope], separators=(',', ':'))
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, gitlab_url: str, project_id: str, branch: str, scope: str) -> Optional[Dict[str, Any]]:
+        """Return {'commit_sha', 'paths', 'synced_at'} of the last recorded sync, or None"""
+        key = self.make_key(gitlab_url, project_id, branch, scope)
+
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT commit_sha, paths, synced_at FROM sync_state WHERE key = ?', (key,)
+            ).fetchone()
+
+        if row is None:
+            return None
+        return {'commit_sha': row[0], 'paths': json.loads(row[1]), 'synced_at': row[2]}
+
+    def set(self, gitlab_url: str, project_id: str, branch: str, scope: str, commit_sha: str, paths: List[str]):
+        """Record that `scope` has been analyzed up to `commit_sha`, where it holds `paths`"""
+        key = self.make_key(gitlab_url, project_id, branch, scope)
+
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO sync_state (key, project_id, branch, scope, commit_sha, paths, synced_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, str(project_id), branch, scope, commit_sha, json.dumps(sorted(paths)), time.time())
+            )
+
+    def clear(self):
+        """Forget every recorded sync (the next sync of each scope is a full scan)"""
+        super().clear()
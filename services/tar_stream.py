@@ -0,0 +1,146 @@
+import collections
+import gzip
+import io
+import tarfile
+import threading
+from typing import Callable, Iterator, Optional, Tuple
+
+
+class ChunkPipe(io.RawIOBase):
+    """
+    Blocking file-like reader over byte chunks written by another thread.
+
+    Lets a synchronous reader such as tarfile consume data that arrives
+    asynchronously: the network side writes chunks as they come in, the
+    reader thread reads them. At most `max_chunks` chunks wait in the pipe;
+    write() blocks beyond that, so the download cannot run ahead of
+    decompression by more than a few chunks.
+
+    Usage:
+        pipe = ChunkPipe()
+        # writer:  pipe.write(chunk) ... pipe.finish()
+        # reader:  iter_tar_members(pipe) ... pipe.close()
+    """
+
+    def __init__(self, max_chunks: int = 16):
+        super().__init__()
+        self.max_chunks = max_chunks
+        self._chunks = collections.deque()
+        self._condition = threading.Condition()
+        self._finished = False
+        self._reader_closed = False
+        self.complete = False
+
+    def readable(self) -> bool:
+        return True
+
+    def try_write(self, data: bytes) -> bool:
+        """Append a chunk if there is room; False if the writer would have to wait"""
+        with self._condition:
+            if self._reader_closed:
+                raise BrokenPipeError("Archive reader has stopped")
+            if len(self._chunks) >= self.max_chunks:
+                return False
+            if data:
+                self._chunks.append(bytes(data))
+                self._condition.notify_all()
+            return True
+
+    def write(self, data: bytes) -> int:
+        """
+        Append a chunk, waiting while the pipe is full
+
+        Raises:
+            BrokenPipeError: if the reader has stopped
+        """
+        with self._condition:
+            while len(self._chunks) >= self.max_chunks and not self._reader_closed:
+                self._condition.wait()
+            if self._reader_closed:
+                raise BrokenPipeError("Archive reader has stopped")
+            if data:
+                self._chunks.append(bytes(data))
+                self._condition.notify_all()
+        return len(data)
+
+    def finish(self, complete: bool = True):
+        """
+        Mark the end of the data; the reader sees EOF once the pipe is empty
+
+        Args:
+            complete: False when the writer gave up (e.g. the download failed),
+                so the reader's resulting truncation error can be ignored
+        """
+        with self._condition:
+            self._finished = True
+            self.complete = complete
+            self._condition.notify_all()
+
+    def readinto(self, buffer) -> int:
+        with self._condition:
+            while not self._chunks and not self._finished:
+                self._condition.wait()
+            if not self._chunks:
+                return 0
+
+            chunk = self._chunks[0]
+            size = min(len(buffer), len(chunk))
+            buffer[:size] = chunk[:size]
+            if size == len(chunk):
+                self._chunks.popleft()
+            else:
+                self._chunks[0] = chunk[size:]
+            self._condition.notify_all()
+            return size
+
+    def close(self):
+        """Reader side: stop reading and release a waiting writer"""
+        with self._condition:
+            self._reader_closed = True
+            self._chunks.clear()
+            self._condition.notify_all()
+        super().close()
+
+
+def iter_tar_members(
+    fileobj,
+    select: Optional[Callable[[str], bool]] = None,
+    strip_components: int = 0
+) -> Iterator[Tuple[str, bytes]]:
+    """
+    Read a gzip-compressed tar stream front to back with the stdlib tarfile
+
+    Members are read one at a time and never seeked, so `fileobj` can be a
+    pipe; regular files rejected by `select` are skipped without being
+    read into memory. Long names (GNU and pax) are handled by tarfile.
+    The gzip layer is read with GzipFile, which inflates in bounded steps
+    and checks the trailer, so a truncated archive raises (EOFError)
+    instead of looking like a shorter one.
+
+    Args:
+        fileobj: Readable file-like object positioned at the start of the archive
+        select: Keep regular files whose (stripped) path it accepts (default: all)
+        strip_components: Leading path components to drop, e.g. 1 for the
+            '<project>-<ref>-<sha>/' directory of repository archives
+
+    Yields:
+        (path, content bytes)
+    """
+    with gzip.GzipFile(fileobj=fileobj, mode='rb') as inflated, \
+            tarfile.open(fileobj=inflated, mode='r|') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+
+            parts = [part for part in member.name.split('/') if part]
+            if len(parts) <= strip_components:
+                continue
+            path = '/'.join(parts[strip_components:])
+            if select is not None and not select(path):
+                continue
+
+            yield path, archive.extractfile(member).read()
+
+        # Read through the end-of-archive padding so the gzip trailer is verified
+        while inflated.read(64 * 1024):
+            pass
@@ -0,0 +1,265 @@
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from urllib.parse import urlsplit
+import httpx
+
+
+CASSETTE_VERSION = 1
+
+# Response headers that are never written to a cassette
+SKIPPED_RESPONSE_HEADERS = {'set-cookie', 'content-length', 'transfer-encoding', 'connection'}
+
+
+class CassetteMissError(Exception):
+    """Raised on replay when the cassette holds no response for a request"""
+
+
+def interaction_key(service: str, method: str, url: str, body: bytes) -> str:
+    """
+    Match key of one request: service, method, URL path and query, and body
+
+    The scheme and host are left out so a cassette recorded against one
+    host replays against another; headers (credentials) are never part of it.
+    """
+    parts = urlsplit(url)
+    digest = hashlib.sha256()
+    for part in (service, method.upper(), parts.path, parts.query):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\x00')
+    digest.update(body or b'')
+    return digest.hexdigest()
+
+
+def _encode_body(body: bytes) -> Dict[str, str]:
+    try:
+        return {'body': body.decode('utf-8'), 'body_encoding': 'utf-8'}
+    except UnicodeDecodeError:
+        return {'body': base64.b64encode(body).decode('ascii'), 'body_encoding': 'base64'}
+
+
+def _decode_body(interaction: Dict[str, Any]) -> bytes:
+    if interaction.get('body_encoding') == 'base64':
+        return base64.b64decode(interaction['body'])
+    return interaction['body'].encode('utf-8')
+
+
+class TrafficCassette:
+    """
+    Recorded HTTP traffic of LLMService and GitLabService, for replay.
+
+    In 'record' mode every request/response going through transport() is
+    captured (response headers, body and upstream latency; request bodies
+    only as a hash, credentials never). save() writes the interactions as
+    gzip-compressed JSON lines. A cassette opened with load() is in
+    'replay' mode: each request is answered from the recording without
+    touching the network, at full speed by default, so a whole workflow
+    can be rerun to measure the CPU side of the agents in isolation.
+
+    Identical requests are answered in recorded order; once the recorded
+    answers for a request are used up the last one is repeated, so a
+    one-run recording can drive a multi-run benchmark.
+
+    Usage:
+        cassette = TrafficCassette(metadata={'claude_endpoint': url, ...})
+        llm_service = LLMService(..., cassette=cassette)
+        gitlab_service = GitLabService(cassette=cassette)
+        ...
+        cassette.save('session.cassette.gz')
+
+        cassette = TrafficCassette.load('session.cassette.gz')
+    """
+
+    def __init__(self, mode: str = 'record', metadata: Optional[Dict[str, Any]] = None, latency_scale: float = 0.0):
+        """
+        Args:
+            mode: 'record' or 'replay'
+            metadata: Free-form details saved with the recording (endpoints, notebook, ...)
+            latency_scale: On replay, sleep for this fraction of each recorded
+                upstream latency (0 = full speed, 1 = as recorded)
+        """
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+
+        self.mode = mode
+        self.metadata = dict(metadata or {})
+        self.latency_scale = latency_scale
+
+        self.interactions: List[Dict[str, Any]] = []
+        self._replay: Dict[str, deque] = {}
+        self._last: Dict[str, Dict[str, Any]] = {}
+        self._stats = {'recorded': 0, 'replayed': 0, 'repeated': 0, 'misses': 0}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str, latency_scale: float = 0.0) -> 'TrafficCassette':
+        """Open a saved cassette for replay"""
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header.get('version') != CASSETTE_VERSION:
+                raise ValueError(f"Unsupported cassette version: {header.get('version')}")
+
+            cassette = cls('replay', metadata=header.get('metadata'), latency_scale=latency_scale)
+            for line in f:
+                if line.strip():
+                    cassette._add(json.loads(line))
+
+        return cassette
+
+    def save(self, path: str):
+        """Write the recorded interactions as gzip-compressed JSON lines"""
+        with self._lock:
+            interactions = list(self.interactions)
+
+        header = {
+            'version': CASSETTE_VERSION,
+            'recorded_at': datetime.utcnow().isoformat(),
+            'metadata': self.metadata,
+            'interactions': len(interactions)
+        }
+
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            f.write(json.dumps(header) + '\n')
+            for interaction in interactions:
+                f.write(json.dumps(interaction) + '\n')
+
+        print(f"Saved {len(interactions)} recorded HTTP interactions to {path}")
+
+    def _add(self, interaction: Dict[str, Any]):
+        with self._lock:
+            self.interactions.append(interaction)
+            if self.mode == 'replay':
+                self._replay.setdefault(interaction['key'], deque()).append(interaction)
+
+    def transport(self, service: str, inner: Optional[httpx.AsyncBaseTransport] = None) -> httpx.AsyncBaseTransport:
+        """
+        httpx transport that records through `inner` or replays from the cassette
+
+        Args:
+            service: Label stored with each interaction ('llm', 'gitlab')
+            inner: Transport that sends the real requests when recording
+                (a default AsyncHTTPTransport if omitted)
+        """
+        if self.mode == 'replay':
+            return _ReplayTransport(self, service)
+        return _RecordingTransport(self, service, inner or httpx.AsyncHTTPTransport())
+
+    def _record(self, service: str, request: httpx.Request, response: httpx.Response, body: bytes, elapsed: float):
+        headers = [
+            [name, value] for name, value in response.headers.multi_items()
+            if name.lower() not in SKIPPED_RESPONSE_HEADERS
+        ]
+        self._add({
+            'service': service,
+            'key': interaction_key(service, request.method, str(request.url), request.content),
+            'method': request.method,
+            'path': request.url.path,
+            'status_code': response.status_code,
+            'headers': headers,
+            'elapsed_seconds': round(elapsed, 4),
+            **_encode_body(body)
+        })
+        with self._lock:
+            self._stats['recorded'] += 1
+
+    def _next(self, service: str, request: httpx.Request) -> Dict[str, Any]:
+        key = interaction_key(service, request.method, str(request.url), request.content)
+
+        with self._lock:
+            queue = self._replay.get(key)
+            if queue:
+                interaction = queue.popleft()
+                self._last[key] = interaction
+                self._stats['replayed'] += 1
+                return interaction
+
+            if key in self._last:
+                self._stats['repeated'] += 1
+                return self._last[key]
+
+            self._stats['misses'] += 1
+
+        raise CassetteMissError(f"No recorded {service} response for {request.method} {request.url.path}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'mode': self.mode, 'interactions': len(self.interactions), **self._stats}
+
+
+class _RecordingStream(httpx.AsyncByteStream):
+    """Passes response chunks through as they arrive and records the body once complete"""
+
+    def __init__(self, cassette: TrafficCassette, service: str, request: httpx.Request,
+                 response: httpx.Response, started: float):
+        self.cassette = cassette
+        self.service = service
+        self.request = request
+        self.response = response
+        self.started = started
+        self._chunks = []
+        self._recorded = False
+
+    def _finish(self):
+        if not self._recorded:
+            self._recorded = True
+            self.cassette._record(self.service, self.request, self.response, b''.join(self._chunks),
+                                  time.perf_counter() - self.started)
+
+    async def __aiter__(self):
+        async for chunk in self.response.stream:
+            self._chunks.append(chunk)
+            yield chunk
+        self._finish()
+
+    async def aclose(self):
+        # Streams the caller stops reading early (e.g. after the SSE [DONE]
+        # event) are recorded with what was received
+        self._finish()
+        await self.response.aclose()
+
+
+class _RecordingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: TrafficCassette, service: str, inner: httpx.AsyncBaseTransport):
+        self.cassette = cassette
+        self.service = service
+        self.inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(self.cassette, self.service, request, response, started),
+            extensions=response.extensions
+        )
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+class _ReplayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: TrafficCassette, service: str):
+        self.cassette = cassette
+        self.service = service
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        interaction = self.cassette._next(self.service, request)
+
+        if self.cassette.latency_scale > 0:
+            await asyncio.sleep(interaction['elapsed_seconds'] * self.cassette.latency_scale)
+
+        return httpx.Response(
+            status_code=interaction['status_code'],
+            headers=interaction['headers'],
+            content=_decode_body(interaction),
+            request=request
+        )
@@ -0,0 +1,149 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Optional, Iterator
+
+
+# Innermost active usage scope for the current task (inherited by child tasks)
+_current_scope: ContextVar[Optional['UsageScope']] = ContextVar('llm_usage_scope', default=None)
+
+
+# Default list prices in USD per million tokens (input, output)
+DEFAULT_TOKEN_COSTS_PER_MILLION = {
+    'claude': {'input': 3.0, 'output': 15.0},
+    'llama': {'input': 0.5, 'output': 1.5}
+}
+
+
+class UsageScope:
+    """
+    Token, cost and latency totals for LLM calls made by one agent run
+    """
+
+    def __init__(self, agent_name: str, session_id: Optional[int] = None):
+        self.agent_name = agent_name
+        self.session_id = session_id
+        self.calls = 0
+        self.cached_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_estimate = 0.0
+        self.llm_time_seconds = 0.0
+        self.tokens_by_model: Dict[str, int] = {}
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def primary_model(self) -> Optional[str]:
+        """Model that consumed the most tokens in this scope"""
+        if not self.tokens_by_model:
+            return None
+        return max(self.tokens_by_model, key=self.tokens_by_model.get)
+
+    def add(self, model: str, prompt_tokens: int, completion_tokens: int, cost: float, latency_seconds: float, cached: bool):
+        self.calls += 1
+        if cached:
+            self.cached_calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cost_estimate += cost
+        self.llm_time_seconds += latency_seconds
+        self.tokens_by_model[model] = self.tokens_by_model.get(model, 0) + prompt_tokens + completion_tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'agent_name': self.agent_name,
+            'session_id': self.session_id,
+            'calls': self.calls,
+            'cached_calls': self.cached_calls,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'total_tokens': self.total_tokens,
+            'cost_estimate': round(self.cost_estimate, 6),
+            'llm_time_seconds': round(self.llm_time_seconds, 3),
+            'tokens_by_model': dict(self.tokens_by_model)
+        }
+
+
+class LLMUsageTracker:
+    """
+    Records the `usage` block and wall time of every LLM call.
+
+    Calls are attributed to the innermost active scope (agent + session),
+    opened with `scope()`; service-wide totals per model are kept as well.
+    """
+
+    def __init__(self, token_costs_per_million: Optional[Dict[str, Dict[str, float]]] = None):
+        self.token_costs_per_million = token_costs_per_million or DEFAULT_TOKEN_COSTS_PER_MILLION
+        self._totals: Dict[str, UsageScope] = {}
+        self._session_costs: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def scope(self, agent_name: str, session_id: Optional[int] = None) -> Iterator[UsageScope]:
+        """Attribute LLM calls made inside the block to an agent run"""
+        usage_scope = UsageScope(agent_name, session_id)
+        token = _current_scope.set(usage_scope)
+        try:
+            yield usage_scope
+        finally:
+            _current_scope.reset(token)
+
+    def estimate_cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        costs = self.token_costs_per_million.get(model, {})
+        return (
+            prompt_tokens * costs.get('input', 0.0) + completion_tokens * costs.get('output', 0.0)
+        ) / 1_000_000
+
+    def record(
+        self,
+        model: str,
+        usage: Optional[Dict[str, Any]],
+        latency_seconds: float,
+        prompt_chars: int = 0,
+        completion_chars: int = 0,
+        cached: bool = False
+    ):
+        """
+        Record one call. Cache hits cost nothing; when the endpoint returns no
+        usage block, token counts are estimated at ~4 characters per token.
+        """
+        if cached:
+            prompt_tokens = completion_tokens = 0
+        elif usage:
+            prompt_tokens = int(usage.get('prompt_tokens') or 0)
+            completion_tokens = int(usage.get('completion_tokens') or 0)
+        else:
+            prompt_tokens = prompt_chars // 4
+            completion_tokens = completion_chars // 4
+
+        cost = self.estimate_cost(model, prompt_tokens, completion_tokens)
+
+        scope = _current_scope.get()
+        if scope is not None:
+            scope.add(model, prompt_tokens, completion_tokens, cost, latency_seconds, cached)
+
+        with self._lock:
+            totals = self._totals.setdefault(model, UsageScope(agent_name='*'))
+            totals.add(model, prompt_tokens, completion_tokens, cost, latency_seconds, cached)
+            if scope is not None and scope.session_id is not None:
+                self._session_costs[scope.session_id] = self._session_costs.get(scope.session_id, 0.0) + cost
+
+    def current_scope(self) -> Optional[UsageScope]:
+        """The innermost active scope for the current task, if any"""
+        return _current_scope.get()
+
+    def session_cost(self, session_id: Optional[int]) -> float:
+        """Estimated spend so far for a mapping session, across all its agents"""
+        with self._lock:
+            return self._session_costs.get(session_id, 0.0)
+
+    def totals(self) -> Dict[str, Dict[str, Any]]:
+        """Service-wide usage per model since startup"""
+        with self._lock:
+            return {
+                model: {key: value for key, value in scope.to_dict().items() if key not in ('agent_name', 'session_id')}
+                for model, scope in self._totals.items()
+            }